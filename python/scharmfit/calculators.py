@@ -1,159 +1,657 @@
 """routines to turn workspaces into CLs, upper limits, etc"""
 
 from scharmfit.utils import OutputFilter
-from os.path import isfile
+from scharmfit.profiling import stage
+from scharmfit.workspace import SIGNAL_THEORY_NP
+from scharmfit.limits import find_upper_limits, estimate_bracket
+from scharmfit.limits import sensitive_channel
+from scharmfit.limits import limit_keys
+from scharmfit import toys
+from os.path import isfile, basename
+import math
+
+# get_Pvalue sets anything below this to this value (to avoid zeros)
+_min_cls = 0.000001
+# range (in sigma) of the asymptotic expected CLs distribution
+_max_sigma = 5.0
+# used if there's no signal to estimate the limit from
+_default_bracket = (0.1, 2.0)
+# mu_Sig covers at least this many times the top of the initial bracket
+_poi_range_factor = 4.0
+# not used to warm start fits, since they differ between signal points
+_signal_pars = {'mu_Sig', 'alpha_' + SIGNAL_THEORY_NP}
 
 # __________________________________________________________________________
 # limit calculators
 
 class UpperLimitCalc(object):
-    """Calculates the upper limit min, mean, and max values"""
-    def __init__(self, n_toys=0, do_prefit=False):
+    """
+    Calculates the observed and expected upper limits. Rather than
+    scanning a fixed grid, each limit is found by root-finding on CLs,
+    starting from a bracket estimated from the workspace yields.
+
+    All the calculate methods take a `start` dict of parameter values
+    to start the fits from (see `scharmfit.warmstart`). Afterwards the
+    fitted values are in `best_fit`, and the expected background in
+    the most sensitive channel is in `sr_background`.
+
+    With toys, each hypothesis test splits its toys over `n_workers`
+    processes (see `scharmfit.toys`). The toys are reproducible for a
+    given `seed`, however many workers run them.
+    """
+    _interpolation_code = 4
+    _test_stat_type = 3         # atlas standard
+    _rel_tol = 0.005            # relative precision on the limits
+    def __init__(self, n_toys=0, n_workers=1, seed=1):
         self._n_toys = n_toys
         # use asymptotic (calc type 2) if we're not using toys
         self._calc_type = 0 if n_toys else 2
-        self._do_prefit = do_prefit
+        self._n_workers = n_workers
+        self._seed = seed
+        self.best_fit = None
+        self.sr_background = None
 
-    def _prefit_ul(self, workspace):
-        Util.SetInterpolationCode(workspace,4)
+    def get_settings(self):
+        """everything that changes the result, as a dict"""
+        return {
+            'n_toys': self._n_toys,
+            'calc_type': self._calc_type,
+            'test_stat_type': self._test_stat_type,
+            'interpolation_code': self._interpolation_code,
+            'limit_finder': 'root-finding',
+            'rel_tol': self._rel_tol,
+            'seed': self._seed,
+            'toys_per_chunk': toys._toys_per_chunk,
+            }
 
-        with OutputFilter(accept_strings={}):
-            inverted = RooStats.DoHypoTestInversion(
-                workspace,
-                1,
-                2,              # use asymptotic
-                3,              # test type (3 is atlas standard)
-                True,           # use CLs
-                20,             # number of points
-                0,              # POI min
-                -1,             # POI max (why -1?)
-                )
+    def upper_limits(self, workspace_name, keys=None, start=None):
+        """
+        returns a dict of limits, for the CLs values given in `keys`
+        (all of them by default, see `scharmfit.limits.limit_keys`)
+        """
+        workspace = _load_workspace(
+            workspace_name, self._interpolation_code)
+        _set_start_values(workspace, start)
+        # the limits are for the nominal signal, like the other
+        # calculators
+        theory_np = workspace.var('alpha_' + SIGNAL_THEORY_NP)
+        if theory_np:
+            theory_np.setVal(0.0)
+            theory_np.setConstant(True)
+        bracket, self.sr_background = _limit_start(
+            _channel_yields(workspace))
+        _widen_poi(workspace, bracket)
+        tests = _HypoTests(workspace, self._n_toys, self._calc_type,
+                           self._test_stat_type)
+        if self._n_toys:
+            tests.set_toys(self._n_workers, self._seed,
+                           basename(workspace_name))
+        limits, _ = find_upper_limits(
+            tests, bracket, keys, rel_tol=self._rel_tol)
+        self.best_fit = tests.best_fit
+        return limits
 
-        try:
-            return inverted.GetExpectedUpperLimit(2)
-        except ReferenceError:
-            return -1
+    def lim_range(self, workspace_name, start=None):
+        """
+        returns a 3-tuple of expected limits (-1, 0, +1 sigma)
+        """
+        limits = self.upper_limits(
+            workspace_name, ['exp_d1s', 'exp', 'exp_u1s'], start)
+        return limits['ul_exp_d1s'], limits['ul_exp'], limits['ul_exp_u1s']
 
-    def lim_range(self, workspace_name):
+    def observed_upper_limit(self, workspace_name, start=None):
         """
-        returns a 3-tuple of limits
+        returns the observed limit
         """
-        from scharmfit import utils
-        utils.load_susyfit()
-        from ROOT import Util
-        from ROOT import RooStats
-        if not isfile(workspace_name):
-            raise OSError("can't find workspace {}".format(workspace_name))
-        workspace = Util.GetWorkspaceFromFile(workspace_name, 'combined')
+        return self.upper_limits(workspace_name, ['obs'], start)['ul']
+
+class CLsCalc(object):
+    """
+    Calculates the CLs. Like `UpperLimitCalc`, fits start from the
+    `start` values if they're given, and the fitted values are saved
+    in `best_fit`. Only the limit calculations set `sr_background`.
+    """
+    _interpolation_code = 4
+    _n_toys = 1
+    _calc_type = 2              # asymtotic calculator
+    _test_stat_type = 3         # atlas standard
+    def __init__(self):
+        """
+        for now has no init... In the future we may set things like
+        the fit method (use toys, asymptotic, CLs vs whatever...)
+        """
+        # magic strings, found on the end of filenames
+        self.nominal = 'nominal'
+        self.up1s = 'up1sigma'
+        self.down1s = 'down1sigma'
+        self.best_fit = None
+        self.sr_background = None
+
+    def get_settings(self):
+        """everything that changes the result, as a dict"""
+        return {
+            'n_toys': self._n_toys,
+            'calc_type': self._calc_type,
+            'test_stat_type': self._test_stat_type,
+            'interpolation_code': self._interpolation_code,
+            }
+
+    def calculate_cls(self, workspace_name, start=None):
+        """
+        returns a dictionary of CLs values
+        """
+        workspace = _load_workspace(
+            workspace_name, self._interpolation_code)
+        _set_start_values(workspace, start)
+        ws_type = workspace_name.rsplit('_',1)[1].split('.')[0]
+        theory_np = workspace.var('alpha_' + SIGNAL_THEORY_NP)
+        if ws_type == self.nominal and theory_np:
+            return self._cls_with_theory_np(workspace, theory_np)
 
-        Util.SetInterpolationCode(workspace,4)
+        limit = self._get_limit(workspace)
+        self.best_fit = _fitted_values(workspace)
+        if ws_type == self.nominal:
+            return self._nominal_cls(limit)
+        elif ws_type == self.up1s:
+            return {'obs_u1s':limit.GetCLs()}
+        elif ws_type == self.down1s:
+            return {'obs_d1s':limit.GetCLs()}
+        # should never get here
+        raise ValueError('can\'t classify {} as type of limit'.format(
+                workspace_name))
 
-        # using -1 as the poi max means auto range (I think)
-        poi_max = self._prefit_ul(workspace) if self._do_prefit else -1
+    def _cls_with_theory_np(self, workspace, theory_np):
+        """
+        The signal theory uncertainty is a parameter in this workspace,
+        rather than having separate up / down workspaces. It's fixed to
+        0 for the nominal CLs and to +-1 for the variations.
+        """
+        initial = workspace.allVars().snapshot()
+        cls_dict = {}
+        for value in [0.0, 1.0, -1.0]:
+            workspace.allVars().assignValueOnly(initial)
+            theory_np.setVal(value)
+            theory_np.setConstant(True)
+            limit = self._get_limit(workspace)
+            if value == 0.0:
+                self.best_fit = _fitted_values(workspace)
+                cls_dict.update(self._nominal_cls(limit))
+            else:
+                key = 'obs_u1s' if value > 0 else 'obs_d1s'
+                cls_dict[key] = limit.GetCLs()
+        return cls_dict
 
+    def _get_limit(self, workspace):
+        from ROOT import RooStats
         # NOTE: We're completely silencing the fitter. Add an empty string
         # to the accept_strings to get all output.
-        with OutputFilter(accept_strings={}):
-            inverted = RooStats.DoHypoTestInversion(
+        with stage('get_Pvalue'), OutputFilter(accept_strings={}):
+            return RooStats.get_Pvalue(
                 workspace,
+                True,                   # doUL
                 self._n_toys,
                 self._calc_type,
-                3,                      # test type (3 is atlas standard)
-                True,                   # use CLs
-                20,                     # number of points
-                0,                      # POI min
-                poi_max,
+                self._test_stat_type,
                 )
 
-        try:
-            mean_limit = inverted.GetExpectedUpperLimit(0)
-            lower_limit = inverted.GetExpectedUpperLimit(-1)
-            upper_limit = inverted.GetExpectedUpperLimit(1)
-        except ReferenceError:
-            return -1, -1, -1
-        return lower_limit, mean_limit, upper_limit
+    def _nominal_cls(self, limit):
+        return {
+            'obs':limit.GetCLs(),
+            'exp':limit.GetCLsexp(),
+            'exp_u1s':limit.GetCLsu1S(),
+            'exp_d1s':limit.GetCLsd1S(),
+            }
+
 
-    def observed_upper_limit(self, workspace_name):
+class MultiCalc(CLsCalc):
+    """
+    Calculates the CLs and the upper limits (observed and expected,
+    with +-1 and +-2 sigma bands) while loading each workspace once.
+    The CLs values come from the hypothesis test at mu_Sig = 1, which
+    is also the first test used by the limit finder.
+
+    The signal theory variations only need the observed CLs.
+    """
+    _rel_tol = UpperLimitCalc._rel_tol
+    def __init__(self, metrics=('cls', 'ul')):
+        super(MultiCalc, self).__init__()
+        self.metrics = set(metrics)
+
+    def get_settings(self):
+        settings = super(MultiCalc, self).get_settings()
+        settings.update(
+            limit_finder='root-finding', rel_tol=self._rel_tol,
+            metrics=sorted(self.metrics))
+        return settings
+
+    def calculate(self, workspace_name, start=None):
+        """returns a dictionary with every requested value"""
+        ws_type = workspace_name.rsplit('_',1)[1].split('.')[0]
+        if ws_type != self.nominal or 'ul' not in self.metrics:
+            return self.calculate_cls(workspace_name, start)
+
+        workspace = _load_workspace(
+            workspace_name, self._interpolation_code)
+        _set_start_values(workspace, start)
+        theory_np = workspace.var('alpha_' + SIGNAL_THEORY_NP)
+        if theory_np:
+            initial = workspace.allVars().snapshot()
+            theory_np.setVal(0.0)
+            theory_np.setConstant(True)
+        bracket, self.sr_background = _limit_start(
+            _channel_yields(workspace))
+        _widen_poi(workspace, bracket)
+        tests = _HypoTests(workspace, self._n_toys, self._calc_type,
+                           self._test_stat_type)
+        nominal = tests(1.0)
+        self.best_fit = tests.best_fit
+        tested = {1.0: nominal} if nominal['obs'] >= 0 else {}
+        out, _ = find_upper_limits(
+            tests, bracket, rel_tol=self._rel_tol, tested=tested)
+        if 'cls' not in self.metrics:
+            return out
+
+        if tested:
+            out.update(nominal)
+        else:
+            out.update(self._nominal_cls(self._get_limit(workspace)))
+        if theory_np:
+            for value, key in [(1.0, 'obs_u1s'), (-1.0, 'obs_d1s')]:
+                workspace.allVars().assignValueOnly(initial)
+                theory_np.setVal(value)
+                theory_np.setConstant(True)
+                out[key] = self._get_limit(workspace).GetCLs()
+        return out
+
+# __________________________________________________________________________
+# helpers
+
+class _HypoTests(object):
+    """
+    Runs the hypothesis test at one signal strength at a time and
+    returns the CLs values, as `find_upper_limits` wants them.
+
+    The asymptotic tests share one inverter: the first test sets it up
+    (the initial fit, the calculator, and the Asimov data), the others
+    add their point to it.
+
+    Toy based tests (calc type 0) are run in chunks with their own
+    seeds, call `set_toys` first.
+    """
+    def __init__(self, workspace, n_toys, calc_type, test_stat_type):
+        self._workspace = workspace
+        self._n_toys = n_toys
+        self._calc_type = calc_type
+        self._test_stat_type = test_stat_type
+        self._poi = workspace.var('mu_Sig')
+        self._n_workers = 1
+        self._seed = 1
+        self._seed_key = None
+        # set up by the first asymptotic test
+        self._tool = None
+        # saved after the first test
+        self.best_fit = None
+
+    def set_toys(self, n_workers, seed, seed_key):
         """
-        returns a 3-tuple of limits
+        run the toys in `n_workers` processes, seeded from `seed` and
+        `seed_key` (something to identify the workspace)
         """
-        from scharmfit import utils
-        utils.load_susyfit()
-        from ROOT import Util
-        from ROOT import RooStats
-        if not isfile(workspace_name):
-            raise OSError("can't find workspace {}".format(workspace_name))
-        workspace = Util.GetWorkspaceFromFile(workspace_name, 'combined')
+        self._n_workers = n_workers
+        self._seed = seed
+        self._seed_key = seed_key
 
-        Util.SetInterpolationCode(workspace,4)
+    def __call__(self, mu):
+        if self._calc_type == 0:
+            return self._toy_cls(mu)
+        inverted = self._add_point(mu)
+        if self.best_fit is None:
+            self.best_fit = _fitted_values(self._workspace)
+        index = inverted.FindIndex(mu) if inverted else -1
+        if index < 0:
+            return {key: -1 for key, _ in limit_keys}
+        return _point_cls(inverted, index)
 
+    def _add_point(self, mu):
+        """
+        Test `mu` with the shared inverter, return everything it has
+        tested so far (None if the setup failed).
+        """
+        import ROOT
+        self._check_range(mu)
         # NOTE: We're completely silencing the fitter. Add an empty string
         # to the accept_strings to get all output.
-        with OutputFilter(accept_strings={}):
-            inverted = RooStats.DoHypoTestInversion(
-                workspace,
-                self._n_toys,
+        with stage('hypothesis test', mu=mu), OutputFilter(
+                accept_strings={}):
+            if self._tool is None:
+                tool = ROOT.RooStats.HypoTestTool()
+                inverted = tool.RunHypoTestInverter(
+                    self._workspace,
+                    'ModelConfig',
+                    '',                     # build the B model from S+B
+                    'obsData',
+                    self._calc_type,
+                    self._test_stat_type,
+                    True,                   # use CLs
+                    1,                      # number of points
+                    mu,                     # POI min
+                    mu,                     # POI max
+                    self._n_toys,
+                    )
+                # try again next time if the setup failed
+                if inverted:
+                    self._tool = tool
+            else:
+                inverter = self._tool.GetInverter()
+                inverter.RunOnePoint(mu)
+                inverted = inverter.GetInterval()
+        if inverted:
+            # these are copies, with every point tested so far
+            ROOT.SetOwnership(inverted, True)
+        return inverted
+
+    def _check_range(self, mu):
+        # the limit can be above the range the workspace was built with
+        if mu > self._poi.getMax():
+            self._poi.setMax(2 * mu)
+
+    def _invert(self, mu, n_toys):
+        """one point inversion, set up from scratch"""
+        from ROOT import RooStats
+        self._check_range(mu)
+        # NOTE: We're completely silencing the fitter. Add an empty string
+        # to the accept_strings to get all output.
+        with stage('DoHypoTestInversion', mu=mu), OutputFilter(
+                accept_strings={}):
+            return RooStats.DoHypoTestInversion(
+                self._workspace,
+                n_toys,
                 self._calc_type,
-                3,                      # test type (3 is atlas standard)
+                self._test_stat_type,
                 True,                   # use CLs
-                20,                     # number of points
-                0,                      # POI min
-                -1,
+                1,                      # number of points
+                mu,                     # POI min
+                mu,                     # POI max
                 )
 
-        try:
-            return inverted.UpperLimit()
-        except ReferenceError:
-            return -1
-
-class CLsCalc(object):
-    """Calculates the CLs"""
-    def __init__(self):
+    def _toy_cls(self, mu):
         """
-        for now has no init... In the future we may set things like
-        the fit method (use toys, asymptotic, CLs vs whatever...)
+        Run the toys chunk by chunk, in worker processes if we have
+        more than one, and merge the test statistic distributions.
         """
-        # magic strings, found on the end of filenames
-        self.nominal = 'nominal'
-        self.up1s = 'up1sigma'
-        self.down1s = 'down1sigma'
+        chunks = toys.chunk_seeds(
+            self._seed, [self._seed_key, mu], self._n_toys)
+        arg_list = [(mu, seed, n_toys) for seed, n_toys in chunks]
+        if self._n_workers > 1:
+            # the workers are forked with the workspace as it is here
+            from scharmfit.parallel import run_jobs
+            parts = []
+            for _, part, error in run_jobs(
+                    self._run_chunk, arg_list, self._n_workers):
+                if error:
+                    raise RuntimeError(
+                        'toys at mu_Sig = {} failed:\n{}'.format(mu, error))
+                parts.append(part)
+        else:
+            parts = [self._run_chunk(*args) for args in arg_list]
+        # sort by seed, so the merge doesn't depend on the finishing order
+        parts.sort(key=lambda part: part['seed'])
+        if self.best_fit is None:
+            self.best_fit = parts[0]['best_fit']
+        null = toys.TestStatDist.merged(part['null'] for part in parts)
+        alt = toys.TestStatDist.merged(part['alt'] for part in parts)
+        cls_dict = toys.toy_cls(null, alt, parts[0]['observed'])
+        # same hack as get_Pvalue, to avoid zero values
+        return {k: max(v, _min_cls) for k, v in cls_dict.items()}
+
+    def _run_chunk(self, mu, seed, n_toys):
+        """run `n_toys` toys with `seed`, return the sampled test stats"""
+        from ROOT import RooRandom
+        RooRandom.randomGenerator().SetSeed(seed)
+        inverted = self._invert(mu, n_toys)
+        if not inverted or inverted.ArraySize() < 1:
+            raise RuntimeError(
+                'hypothesis test at mu_Sig = {} failed'.format(mu))
+        result = inverted.GetResult(0)
+        return {
+            'seed': seed,
+            'null': _test_stat_dist(result.GetNullDistribution()),
+            'alt': _test_stat_dist(result.GetAltDistribution()),
+            'observed': result.GetTestStatisticData(),
+            'best_fit': _fitted_values(self._workspace),
+            }
+
+def _limit_start(channel_yields):
+    """
+    Initial bracket on the limit, and the expected background in the
+    most sensitive channel (None if there's no signal anywhere).
+    """
+    try:
+        sig, bg, obs = sensitive_channel(channel_yields)
+    except ValueError:
+        return _default_bracket, None
+    return estimate_bracket([(sig, bg, obs)]), bg
+
+def _widen_poi(workspace, bracket):
+    """
+    mu_Sig is booked with the range [0, 2], which is below some of the
+    limits (and bands). Widen it before the first test, so nothing is
+    cut off at the edge of the range.
+    """
+    poi = workspace.var('mu_Sig')
+    poi.setMax(max(poi.getMax(), _poi_range_factor * bracket[1]))
+
+def _point_cls(inverted, index):
+    """
+    CLs values at one point of an asymptotic inversion result. The
+    expected values are read off the distribution the same way
+    get_Pvalue does it.
+    """
+    import ROOT
+    dist = inverted.GetExpectedPValueDist(index)
+    ROOT.SetOwnership(dist, True)
+    values = dist.GetSamplingDistribution()
+    dsig = 2 * _max_sigma / (values.size() - 1)
+    def expected(nsig):
+        return values[int(math.floor(
+                    (nsig + _max_sigma) / dsig + 0.5))]
+    cls_dict = {
+        'obs': inverted.CLs(index),
+        'exp': expected(0),
+        'exp_u1s': expected(1),
+        'exp_d1s': expected(-1),
+        'exp_u2s': expected(2),
+        'exp_d2s': expected(-2),
+        }
+    # same hack as get_Pvalue, to avoid zero values
+    return {k: max(v, _min_cls) for k, v in cls_dict.items()}
+
+def _test_stat_dist(sampling_dist):
+    """`toys.TestStatDist` from a RooStats `SamplingDistribution`"""
+    return toys.TestStatDist(
+        list(sampling_dist.GetSamplingDistribution()),
+        list(sampling_dist.GetSampleWeights()))
+
+def _channel_yields(workspace):
+    """
+    (signal, background, observed) yields in each channel of a
+    workspace, with the signal for mu_Sig = 1
+    """
+    model_config = workspace.obj('ModelConfig')
+    pdf = model_config.GetPdf()
+    observables = model_config.GetObservables()
+    poi = workspace.var('mu_Sig')
+    data = workspace.data('obsData')
+    cat = pdf.indexCat()
+    initial = poi.getVal()
+    yields = []
+    for name in _category_names(cat):
+        chan_pdf = pdf.getPdf(name)
+        chan_obs = chan_pdf.getObservables(observables)
+        expected = []
+        for mu in [0.0, 1.0]:
+            poi.setVal(mu)
+            expected.append(chan_pdf.expectedEvents(chan_obs))
+        cut = '{0}=={0}::{1}'.format(cat.GetName(), name)
+        bg = expected[0]
+        yields.append((expected[1] - bg, bg, data.sumEntries(cut)))
+    poi.setVal(initial)
+    return yields
+
+def _category_names(cat):
+    try:
+        types = cat.typeIterator()
+    except AttributeError:
+        # newer ROOT versions dropped the iterator
+        return [name for name, _ in cat.states()]
+    names = []
+    cat_type = types.Next()
+    while cat_type:
+        names.append(cat_type.GetName())
+        cat_type = types.Next()
+    return names
+
+def _set_start_values(workspace, start):
+    """
+    Set the floating parameters to the values in `start`, a dict keyed
+    by parameter name. Parameters that aren't in the workspace, and the
+    signal parameters (which don't carry over between signal points),
+    are skipped.
+    """
+    for name, value in (start or {}).iteritems():
+        var = workspace.var(name)
+        if not var or var.isConstant() or name in _signal_pars:
+            continue
+        var.setVal(min(max(value, var.getMin()), var.getMax()))
+
+def _fitted_values(workspace):
+    """
+    Current values of the floating nuisance parameters. Each hypothesis
+    test starts with a fit to data, so after the first test these are
+    close to the best fit.
+    """
+    model_config = workspace.obj('ModelConfig')
+    pars = model_config.GetNuisanceParameters()
+    values = {}
+    iterator = pars.createIterator()
+    par = iterator.Next()
+    while par:
+        name = par.GetName()
+        if not par.isConstant() and name not in _signal_pars:
+            values[name] = par.getVal()
+        par = iterator.Next()
+    return values
 
-    def calculate_cls(self, workspace_name):
+def _load_workspace(workspace_name, interpolation_code):
+    """load HistFitter, then the workspace, and set the interpolation"""
+    from scharmfit import utils
+    utils.load_susyfit()
+    from ROOT import Util
+    if not isfile(workspace_name):
+        raise OSError("can't find workspace {}".format(workspace_name))
+    with stage('GetWorkspaceFromFile'):
+        workspace = Util.GetWorkspaceFromFile(workspace_name, 'combined')
+    Util.SetInterpolationCode(workspace, interpolation_code)
+    return workspace
+
+
+class CountingCLsCalc(object):
+    """
+    Calculates the CLs with the ROOT-free counting experiment likelihood
+    in `scharmfit.counting`. Rather than reading workspaces this works
+    from the yields and fit configuration used to book them.
+
+    As with the HistFactory calculators, fits start from the `start`
+    values if they're given, and the nominal fit to data is saved in
+    `best_fit`.
+
+    If `n_toys` is set the p-values come from toys (seeded from `seed`)
+    rather than the asymptotic formulae. With `n_reference` as well,
+    the upper limits reuse toys generated at that many signal strengths
+    across the initial bracket, rather than generating new ones for
+    every test (see `CountingModel.reweighted_toy_cls`). The expected
+    background in the most sensitive channel is saved in
+    `sr_background`.
+    """
+    def __init__(self, yields, fit_config, misc_config, n_toys=0, seed=1,
+                 n_reference=0):
+        from scharmfit.workspace import FitInputs
+        self._fit_config = fit_config
+        self._misc_config = misc_config
+        # the signal theory variations share the inputs, the models
+        # scale the signal yields up / down.
+        var_config = dict(
+            misc_config, signal_systematic=None, signal_theory_np=True)
+        self._inputs = FitInputs(yields, fit_config, var_config)
+        self._n_toys = n_toys
+        self._seed = seed
+        self._n_reference = n_reference
+        self.best_fit = None
+        self.sr_background = None
+
+    def calculate_cls(self, signal_point, start=None):
         """
         returns a dictionary of CLs values
         """
-        from scharmfit import utils
-        utils.load_susyfit()
-        from ROOT import Util
-        from ROOT import RooStats
-        if not isfile(workspace_name):
-            raise OSError("can't find workspace {}".format(workspace_name))
-        workspace = Util.GetWorkspaceFromFile(workspace_name, 'combined')
+        from scharmfit.counting import CountingModel
+        # keys are the suffix used for the observed CLs
+        variations = {'': 0}
+        if self._inputs.has_sigsysts:
+            variations.update({'_u1s': 1, '_d1s': -1})
+        cls_dict = {}
+        for suffix, sign in variations.iteritems():
+            model = CountingModel(
+                self._inputs, self._fit_config, self._misc_config,
+                signal_point, sigsyst_sign=sign, start=start)
+            cls = self._get_cls(model)
+            if suffix:
+                cls_dict['obs' + suffix] = cls['obs']
+            else:
+                self.best_fit = model.best_fit()
+                self.sr_background = _limit_start(
+                    _model_yields(model))[1]
+                cls_dict.update(cls)
+        return cls_dict
 
-        Util.SetInterpolationCode(workspace,4)
-        # NOTE: We're completely silencing the fitter. Add an empty string
-        # to the accept_strings to get all output.
-        with OutputFilter(accept_strings={}):
-            limit = RooStats.get_Pvalue(
-                workspace,
-                True,                   # doUL
-                1,                      # n_toys
-                2,                      # asymtotic calculator
-                3,                      # test type (3 is atlas standard)
-                )
-        ws_type = workspace_name.rsplit('_',1)[1].split('.')[0]
-        if ws_type == self.nominal:
-            return {
-                'obs':limit.GetCLs(),
-                'exp':limit.GetCLsexp(),
-                'exp_u1s':limit.GetCLsu1S(),
-                'exp_d1s':limit.GetCLsd1S(),
-                }
-        elif ws_type == self.up1s:
-            return {'obs_u1s':limit.GetCLs()}
-        elif ws_type == self.down1s:
-            return {'obs_d1s':limit.GetCLs()}
-        # should never get here
-        raise ValueError('can\'t classify {} as type of limit'.format(
-                workspace_name))
+    def upper_limits(self, signal_point, start=None):
+        """
+        returns a dict of the observed and expected upper limits
+        """
+        from scharmfit.counting import CountingModel
+        model = CountingModel(
+            self._inputs, self._fit_config, self._misc_config,
+            signal_point, sigsyst_sign=0, start=start)
+        bracket, self.sr_background = _limit_start(_model_yields(model))
+        # as for the workspaces, leave room above the expected limits
+        model.widen_poi(_poi_range_factor * bracket[1])
+        if self._n_toys and self._n_reference:
+            reference_mus = _reference_mus(bracket, self._n_reference)
+            def get_cls(mu):
+                return model.reweighted_toy_cls(
+                    mu, reference_mus, self._n_toys, self._seed)
+        else:
+            def get_cls(mu):
+                return self._get_cls(model, mu)
+        limits, _ = find_upper_limits(
+            get_cls, bracket, rel_tol=UpperLimitCalc._rel_tol)
+        self.best_fit = model.best_fit()
+        return limits
+
+    def _get_cls(self, model, mu=1.0):
+        if self._n_toys:
+            return model.toy_cls(mu, self._n_toys, self._seed)
+        return model.asymptotic_cls(mu)
+
+def _model_yields(model):
+    """(signal, background, observed) yields in each channel"""
+    return zip(
+        model.nominal[:,0], model.nominal[:,1:].sum(axis=1), model.data)
 
+def _reference_mus(bracket, n_reference):
+    """`n_reference` signal strengths spaced evenly in log(mu)"""
+    low, high = bracket
+    if n_reference == 1:
+        return [math.sqrt(low * high)]
+    ratio = high / low
+    return [low * ratio**(num / (n_reference - 1.0))
+            for num in xrange(n_reference)]
@@ -0,0 +1,182 @@
+"""
+Adaptive refinement of the exclusion contour over the mass grid.
+
+Only the points near the contour change what the exclusion plot looks
+like. Rather than fitting every (scharm, LSP) point we fit a coarse
+subset of the grid first, then halve the spacing and only fit the
+points whose fitted neighbours disagree on whether they're excluded.
+The other points are inferred from their neighbours. At each spacing
+this is repeated until no new point needs fitting, so a contour that
+shows up between fitted points still gets followed.
+
+The grid is indexed by the distinct scharm and LSP masses, so it
+doesn't have to be evenly spaced, or rectangular. Where the grid has
+gaps (e.g. along the kinematic limit) points are fit rather than
+inferred.
+"""
+
+import math
+
+# CLs below this is excluded
+_cls_cut = 0.05
+# upper limits on mu_Sig below this are excluded
+_ul_cut = 1.0
+# keys used to decide exclusion, for CLs and upper limit results
+_cls_keys = ('obs', 'exp')
+_ul_keys = ('ul', 'ul_exp')
+# these are copied rather than averaged for inferred points
+_mass_keys = {'scharm_mass', 'lsp_mass'}
+
+def _keys_and_cut(fit_dict):
+    """keys to decide exclusion with, and the cut to apply to them"""
+    if 'obs' in fit_dict:
+        return _cls_keys, _cls_cut
+    return _ul_keys, _ul_cut
+
+def exclusion(fit_dict):
+    """
+    Tuple of (observed, expected) exclusion for a fit result, from the
+    CLs values if there are any, otherwise from the upper limits.
+    Returns None if the fit failed, or has neither.
+    """
+    keys, cut = _keys_and_cut(fit_dict)
+    values = [fit_dict[key] for key in keys if key in fit_dict]
+    # the calculators give -1 when they fail
+    if not values or any(val < 0 for val in values):
+        return None
+    return tuple(val < cut for val in values)
+
+def boundary_distance(fit_dict):
+    """
+    How far a result is from the exclusion boundary: the smallest
+    |log(value / cut)| of the (observed, expected) CLs or limits. None
+    if the fit failed.
+    """
+    if exclusion(fit_dict) is None:
+        return None
+    keys, cut = _keys_and_cut(fit_dict)
+    values = [fit_dict[key] for key in keys if key in fit_dict]
+    # a CLs of zero is as far from the boundary as it gets
+    return min(abs(math.log(val / cut)) if val > 0 else float('inf')
+               for val in values)
+
+class ContourRefiner(object):
+    """
+    Picks the points to fit in one grid of (scharm, lsp) mass points.
+    Call `next_points` for a list of points to fit, and pass the
+    results back with `add_result` before asking again. Once it
+    returns an empty list `inferred` gives results for everything
+    that wasn't fit.
+
+    The first round fits every `coarse_step`-th point in each mass.
+    Results that are already known (e.g. saved from an earlier run)
+    can be added before the first round.
+    """
+    def __init__(self, mass_points, coarse_step=4):
+        scharm_masses = sorted({sch for sch, _ in mass_points})
+        lsp_masses = sorted({lsp for _, lsp in mass_points})
+        self._index = {
+            (sch, lsp): (scharm_masses.index(sch), lsp_masses.index(lsp))
+            for sch, lsp in mass_points}
+        self._points = {idx: pt for pt, idx in self._index.iteritems()}
+        self._step = coarse_step
+        self._coarse_step = coarse_step
+        self._results = {}      # index: fit result
+        self._classes = {}      # index: exclusion, fit or inferred
+
+    def add_result(self, mass_point, fit_dict):
+        """save the result for a point that was fit"""
+        idx = self._index[mass_point]
+        self._results[idx] = fit_dict
+        self._classes[idx] = exclusion(fit_dict)
+
+    def next_points(self):
+        """list of mass points to fit next, empty when we're done"""
+        while True:
+            if self._step == self._coarse_step:
+                todo = [idx for idx in self._level(self._step)
+                        if idx not in self._results]
+            else:
+                todo = self._refine(self._step)
+            if todo or self._step == 1:
+                return [self._points[idx] for idx in sorted(todo)]
+            self._step //= 2
+
+    def inferred(self):
+        """
+        dict of results for the points that weren't fit, keyed by mass
+        point. Each value is the geometric mean of the closest fitted
+        points that agree on the exclusion.
+        """
+        out = {}
+        for idx, pt in self._points.iteritems():
+            if idx in self._results:
+                continue
+            cls = self._classes.get(idx)
+            out[pt] = self._average(self._closest(idx, cls))
+        return out
+
+    def _level(self, step):
+        """indices of the points on the grid with spacing `step`"""
+        return [(i, j) for i, j in self._points
+                if i % step == 0 and j % step == 0]
+
+    def _neighbours(self, idx, dist, known):
+        """classes of `known` points within `dist` (in index) of `idx`"""
+        i, j = idx
+        classes = []
+        for di in xrange(-dist, dist + 1):
+            for dj in xrange(-dist, dist + 1):
+                other = (i + di, j + dj)
+                if other != idx and other in known:
+                    classes.append(known[other])
+        return classes
+
+    def _refine(self, step):
+        """
+        Infer the unfit points at spacing `step` where the neighbours
+        agree, return the ones where they don't (or where there are no
+        neighbours to go on).
+        """
+        # inferred points are decided again with the new neighbours,
+        # all from what was known before this round
+        known = dict(self._classes)
+        todo = []
+        for idx in self._level(step):
+            if idx in self._results:
+                continue
+            classes = set(self._neighbours(idx, step, known))
+            if len(classes) == 1 and None not in classes:
+                self._classes[idx] = classes.pop()
+            else:
+                self._classes.pop(idx, None)
+                todo.append(idx)
+        return todo
+
+    def _closest(self, idx, cls):
+        """closest fitted points with exclusion `cls`"""
+        i, j = idx
+        dist = 1
+        while dist <= 2 * self._coarse_step:
+            found = []
+            for other, result in self._results.iteritems():
+                close = max(abs(other[0] - i), abs(other[1] - j)) <= dist
+                if close and self._classes[other] == cls:
+                    found.append(result)
+            if found:
+                return found
+            dist *= 2
+        return []
+
+    def _average(self, results):
+        """geometric mean of every value the `results` have in common"""
+        if not results:
+            return {}
+        keys = set.intersection(*(set(res) for res in results))
+        out = {}
+        for key in keys - _mass_keys:
+            values = [res[key] for res in results]
+            if all(isinstance(val, float) and val > 0 for val in values):
+                out[key] = math.exp(
+                    sum(math.log(val) for val in values) / len(values))
+        return out
@@ -0,0 +1,755 @@
+"""
+ROOT-free version of the likelihood HistFactory builds from a `Workspace`.
+
+Every channel in our workspaces is a single bin, so the whole model is a
+product of Poisson terms (one per channel) and Gaussian constraints (one
+per nuisance parameter). Here it's written down directly with numpy
+arrays, and fit with scipy. The model follows what HistFactory does with
+the samples `Workspace` creates:
+
+ - Each sample is scaled by its norm factor (`mu_Sig` for the signal,
+   `mu_<background>` for floating backgrounds), by the luminosity, and by
+   one `OverallSys` factor per systematic.
+ - The `OverallSys` factors use interpolation code 4 (polynomial inside
+   +-1 sigma, exponential outside), as set by the calculators.
+ - The stat errors of all the samples in a channel are combined into one
+   gamma parameter per channel, which is only floated if the relative
+   error is above the HistFactory threshold (5%).
+
+The CLs values use the asymptotic formulae for the one-sided `qmu-tilde`
+test statistic, in the same way as the RooStats `AsymptoticCalculator`,
+or toys. Since a toy is just a vector of Poisson counts and Gaussian
+global observables, the toys are generated and fit in batches, as
+arrays with one row per toy. The batches are fit with Newton steps
+(using the Fisher information), where every toy takes its own step.
+"""
+
+import numpy as np
+from scipy import optimize
+from scipy.special import ndtr, ndtri
+from scharmfit import toys
+
+# HistFactory settings used by `Workspace`
+_lumi_rel_err = 0.028
+_stat_err_threshold = 0.05
+_poi_name = 'mu_Sig'
+_poi_range = (0.0, 2.0)
+_bg_norm_range = (0.0, 2.0)
+# alpha, gamma, and lumi parameters are bounded at +- this many sigma
+_n_sigma_range = 5.0
+# the same `dirty hack` as used in get_Pvalue, to avoid zero CLs
+_min_cls = 0.000001
+# HistFitter generates half as many background only toys
+_bg_toy_ratio = 2
+# batched fits stop once the expected NLL decrease is below this
+_newton_tol = 1e-9
+_max_newton_steps = 100
+_max_step_halvings = 20
+
+class CountingModel(object):
+    """
+    Likelihood for one signal point in one fit configuration. Takes a
+    `FitInputs` instance (which can be shared between signal points)
+    and a fit configuration. If given, `sigsyst_sign` overrides the
+    direction of the signal theory variation set in the inputs.
+    Fits start from the parameter values in the `start` dict, where
+    they're given (e.g. the best fit of a neighbouring signal point).
+
+    The parameters are stored as one array, the names are given by
+    `par_names`. The POI (`mu_Sig`) is always the first parameter.
+    Its range starts out as [0, 2], as in the workspaces, and is
+    widened (see `widen_poi`) when a higher signal strength is tested.
+    """
+    # number and error are stored as first and second entry
+    _nkey = 0
+    _errkey = 1
+    def __init__(self, inputs, fit_config, misc_config, signal_point,
+                 sigsyst_sign=None, start=None):
+        self._inputs = inputs
+        self.signal_point = signal_point
+        self._sigsyst_sign = sigsyst_sign
+        self.regions = list(fit_config['signal_regions'])
+        self.regions += list(fit_config['control_regions'])
+        blinded = misc_config['blind'] or misc_config['injection']
+        self._pseudodata_regions = set(fit_config['signal_regions'])
+        if not blinded:
+            self._pseudodata_regions = set()
+        self._inject = misc_config['injection']
+
+        self._build_samples()
+        self._build_systematics()
+        self._build_parameters()
+        self._set_start(start or {})
+        self.data = self._get_data()
+        # built on the first hypothesis test, they don't depend on mu
+        self._data_fit = None
+        self._bg_asimov = None
+        # toys for `reweighted_toy_cls`, by (reference mus, toys, seed)
+        self._reference_sets = {}
+
+    # ____________________________________________________________________
+    # building routines (called by the constructor)
+
+    def _build_samples(self):
+        """
+        Fill (channel x sample) arrays of nominal yields and stat
+        errors. The first sample is the signal.
+        """
+        inputs = self._inputs
+        sp = self.signal_point
+        self.samples = [sp] + sorted(inputs.backgrounds)
+        shape = (len(self.regions), len(self.samples))
+        self.nominal = np.zeros(shape)
+        self.stat_err = np.zeros(shape)
+        for cnum, region in enumerate(self.regions):
+            reg_yields = inputs.yields[region]
+            if sp in reg_yields:
+                sig_yield = reg_yields[sp]
+                sig_syst = inputs.get_rel_sigsyst(
+                    region, sp, self._sigsyst_sign)
+                self.nominal[cnum, 0] = sig_yield[self._nkey] * sig_syst
+                self.stat_err[cnum, 0] = sig_yield[self._errkey] * sig_syst
+            for snum, bg in enumerate(self.samples[1:], 1):
+                base_vals = reg_yields.get(bg, [0.0, 0.0])
+                self.nominal[cnum, snum] = base_vals[self._nkey]
+                self.stat_err[cnum, snum] = base_vals[self._errkey]
+
+    def _build_systematics(self):
+        """
+        Fill (channel x sample x systematic) arrays with the down / up
+        variations, and precompute the interpolation coefficients.
+        """
+        table = self._inputs.systematics
+        reg_idx, proc_idx = table.get_index(self.regions, self.samples)
+        chans = np.flatnonzero(reg_idx >= 0)
+        samples = np.flatnonzero(proc_idx >= 0)
+        picked = np.ix_(reg_idx[chans], proc_idx[samples])
+
+        shape = self.nominal.shape + (len(table.names),)
+        present = np.zeros(shape, dtype=bool)
+        variations = np.ones(shape + (2,))
+        present[np.ix_(chans, samples)] = table.present[picked]
+        variations[np.ix_(chans, samples)] = table.variations[picked]
+        # the signal sample is only added where there's a signal yield
+        has_signal = np.array([
+                self.signal_point in self._inputs.yields[region]
+                for region in self.regions], dtype=bool)
+        present[~has_signal, 0] = False
+
+        used = present.any(axis=(0, 1))
+        self.systematics = [n for n, u in zip(table.names, used) if u]
+        present = present[:, :, used]
+        variations = variations[:, :, used]
+        # missing variations (possible for asymmetric systematics)
+        # mean no variation
+        set_vals = present[..., None] & ~np.isnan(variations)
+        variations = np.where(set_vals, variations, 1.0)
+        self._interp = _Code4Interpolation(
+            variations[..., 0], variations[..., 1])
+
+    def _build_parameters(self):
+        """
+        Set up the parameter vector: POI, background norm factors,
+        lumi, one alpha per systematic, and the floating stat gammas.
+        """
+        inputs = self._inputs
+        floating = [
+            bg for bg in self.samples[1:]
+            if bg not in inputs.fixed_backgrounds]
+        names = [_poi_name] + ['mu_{}'.format(bg) for bg in floating]
+        bounds = [_poi_range] + [_bg_norm_range] * len(floating)
+
+        # which norm factor applies to each sample, -1 for none
+        norm_index = [0]
+        for bg in self.samples[1:]:
+            is_floating = bg in floating
+            norm_index.append(floating.index(bg) + 1 if is_floating else -1)
+        self._norm_index = np.array(norm_index)
+        self._n_norm = len(names)
+
+        self._lumi_index = len(names)
+        names.append('Lumi')
+        bounds.append(_sigma_bounds(1.0, _lumi_rel_err))
+
+        self._alpha_slice = slice(len(names), len(names) + len(
+                self.systematics))
+        names += ['alpha_{}'.format(syst) for syst in self.systematics]
+        bounds += [(-_n_sigma_range, _n_sigma_range)] * len(self.systematics)
+
+        # the stat errors are combined per channel
+        tot = self.nominal.sum(axis=1)
+        rel_err = np.sqrt((self.stat_err**2).sum(axis=1))
+        rel_err = np.where(tot > 0, rel_err / np.where(tot > 0, tot, 1), 0)
+        gamma_chan = np.flatnonzero(rel_err >= _stat_err_threshold)
+        self._gamma_chan = gamma_chan
+        self._gamma_err = rel_err[gamma_chan]
+        self._gamma_slice = slice(len(names), len(names) + len(gamma_chan))
+        names += ['gamma_stat_{}_bin_0'.format(self.regions[c])
+                  for c in gamma_chan]
+        bounds += [_sigma_bounds(1.0, err) for err in self._gamma_err]
+
+        self.par_names = names
+        self.bounds = bounds
+        self.init_pars = np.array(
+            [1.0] * self._n_norm + [1.0] + [0.0] * len(self.systematics) +
+            [1.0] * len(gamma_chan))
+        # constraint widths and nominal global observables
+        self._constraint_err = np.ones(len(names))
+        self._constraint_err[self._lumi_index] = _lumi_rel_err
+        self._constraint_err[self._gamma_slice] = self._gamma_err
+        self._constrained = np.zeros(len(names), dtype=bool)
+        self._constrained[self._n_norm:] = True
+        self.nominal_globs = self.init_pars.copy()
+
+    def widen_poi(self, high):
+        """
+        Raise the upper bound on the POI to at least `high`. The free
+        fits are capped at this bound, so everything that depends on
+        them is redone.
+        """
+        low, old_high = self.bounds[0]
+        if high <= old_high:
+            return
+        self.bounds[0] = (low, high)
+        self._data_fit = None
+        self._bg_asimov = None
+        self._reference_sets = {}
+
+    def _check_poi(self, mu):
+        # the free fits need room above the signal strength tested
+        if mu > self.bounds[0][1]:
+            self.widen_poi(2 * mu)
+
+    def _set_start(self, start):
+        """start fits from the values in `start` (except the POI)"""
+        for num, name in enumerate(self.par_names[1:], 1):
+            if name in start:
+                low, high = self.bounds[num]
+                self.init_pars[num] = min(max(start[name], low), high)
+
+    def _get_data(self):
+        """get observed counts, or pseudodata where we're blinded"""
+        counts = []
+        for cnum, region in enumerate(self.regions):
+            if region in self._pseudodata_regions:
+                # sum of backgrounds (plus the signal for injection)
+                count = self.nominal[cnum, 1:].sum()
+                if self._inject:
+                    count += self.nominal[cnum, 0]
+            else:
+                count = self._inputs.yields[region]['data'][self._nkey]
+            counts.append(count)
+        return np.array(counts, dtype=float)
+
+    # ____________________________________________________________________
+    # likelihood
+
+    def expected(self, pars):
+        """expected counts in each channel"""
+        return self._expected_parts(pars)[0]
+
+    def _expected_parts(self, pars):
+        norms = np.append(pars[:self._n_norm], 1.0)[self._norm_index]
+        interp, dinterp = self._interp(pars[self._alpha_slice])
+        gamma = np.ones(len(self.regions))
+        gamma[self._gamma_chan] = pars[self._gamma_slice]
+        chan_scale = gamma * pars[self._lumi_index]
+        # (channel x sample) yields, before norm factors, lumi and gammas
+        unnormed = self.nominal * interp.prod(axis=2)
+        nu = (unnormed * norms).sum(axis=1) * chan_scale
+        return nu, unnormed, norms, chan_scale, interp, dinterp
+
+    def nll(self, pars, data, globs):
+        """
+        Negative log likelihood (dropping the constant terms) and its
+        gradient, for the given `data` and global observables `globs`.
+        """
+        nu, unnormed, norms, chan_scale, interp, dinterp = (
+            self._expected_parts(pars))
+        nu = np.maximum(nu, 1e-12)
+        pull = (pars - globs) / self._constraint_err
+        pull[~self._constrained] = 0.0
+        value = (nu - data * np.log(nu)).sum() + 0.5 * (pull**2).sum()
+
+        # gradient, first the constraint terms
+        grad = pull / self._constraint_err
+        # then the poisson terms, via the derivative wrt each channel yield
+        dnu = (1.0 - data / nu)
+        weighted = unnormed * (dnu * chan_scale)[:,None]
+        has_norm = self._norm_index >= 0
+        grad[:self._n_norm] += np.bincount(
+            self._norm_index[has_norm],
+            weights=weighted.sum(axis=0)[has_norm],
+            minlength=self._n_norm)
+        grad[self._lumi_index] += (dnu * nu).sum() / pars[self._lumi_index]
+        grad[self._alpha_slice] += np.einsum(
+            'cs,csk->k', weighted * norms, dinterp / interp)
+        grad[self._gamma_slice] += (
+            dnu * nu)[self._gamma_chan] / pars[self._gamma_slice]
+        return value, grad
+
+    def fit(self, data=None, globs=None, poi=None, init=None):
+        """
+        Minimize the NLL, return (best fit parameters, nll). If `poi`
+        is given, it's fixed to this value (conditional fit).
+        """
+        if data is None:
+            data = self.data
+        if globs is None:
+            globs = self.nominal_globs
+        pars = np.array(self.init_pars if init is None else init, float)
+        free = np.ones(len(pars), dtype=bool)
+        if poi is not None:
+            pars[0] = poi
+            free[0] = False
+        bounds = [b for b, f in zip(self.bounds, free) if f]
+        pars[free] = np.clip(pars[free], *zip(*bounds))
+
+        def nll(free_pars):
+            pars[free] = free_pars
+            value, grad = self.nll(pars, data, globs)
+            return value, grad[free]
+        result = optimize.minimize(
+            nll, pars[free], jac=True, method='L-BFGS-B', bounds=bounds,
+            options={'ftol':1e-12, 'gtol':1e-8, 'maxiter':1000})
+        pars[free] = result.x
+        return pars, result.fun
+
+    def asimov(self, pars):
+        """
+        Return (data, globs) for the Asimov dataset with parameters
+        `pars`. Like RooStats, the global observables are set to the
+        values of the nuisance parameters.
+        """
+        globs = self.nominal_globs.copy()
+        globs[self._constrained] = pars[self._constrained]
+        return self.expected(pars), globs
+
+    def fit_data(self):
+        """free fit to the observed data, (parameters, nll)"""
+        if self._data_fit is None:
+            self._data_fit = self.fit()
+        return self._data_fit
+
+    def best_fit(self):
+        """dict of best fit values of everything but the POI"""
+        pars, _ = self.fit_data()
+        return {n: float(v) for n, v in zip(self.par_names[1:], pars[1:])}
+
+    # ____________________________________________________________________
+    # hypothesis tests
+
+    def qmu_tilde(self, mu, data=None, globs=None):
+        """
+        The one-sided profile likelihood test statistic. Since the POI
+        is bounded at zero this is `qmu-tilde`.
+        """
+        if data is None and globs is None:
+            free_pars, free_nll = self.fit_data()
+        else:
+            free_pars, free_nll = self.fit(data, globs)
+        if free_pars[0] > mu:
+            return 0.0
+        cond_pars, cond_nll = self.fit(data, globs, poi=mu, init=free_pars)
+        return max(2.0 * (cond_nll - free_nll), 0.0)
+
+    def asymptotic_cls(self, mu=1.0):
+        """
+        Return a dict with the observed CLs and the expected CLs at
+        the median, +-1 and +-2 sigma, for signal strength `mu`.
+        """
+        self._check_poi(mu)
+        qmu = self.qmu_tilde(mu)
+        # the asimov data is built from a background only fit to data
+        if self._bg_asimov is None:
+            bg_pars, _ = self.fit(poi=0.0, init=self.fit_data()[0])
+            self._bg_asimov = self.asimov(bg_pars)
+        asimov_data, asimov_globs = self._bg_asimov
+        qmu_a = self.qmu_tilde(mu, asimov_data, asimov_globs)
+        return asymptotic_cls_values(qmu, qmu_a)
+
+    def toy_cls(self, mu=1.0, n_toys=2000, seed=1):
+        """
+        Same as `asymptotic_cls`, but the p-values come from toys. Like
+        the RooStats `FrequentistCalculator`, the signal plus background
+        toys are generated from a fit to data with the POI fixed to
+        `mu`, the background only toys with it fixed to zero. The toys
+        are reproducible for a given `seed`.
+        """
+        self._check_poi(mu)
+        observed = self.qmu_tilde(mu)
+        free_pars = self.fit_data()[0]
+        null_pars, _ = self.fit(poi=mu, init=free_pars)
+        bg_pars, _ = self.fit(poi=0.0, init=free_pars)
+        null, alt = [], []
+        key = [self.signal_point, mu]
+        for chunk_seed, n_chunk in toys.chunk_seeds(seed, key, n_toys):
+            random = np.random.RandomState(chunk_seed)
+            data, globs = self.generate_toys(null_pars, n_chunk, random)
+            null.append(self.qmu_tilde_toys(mu, data, globs))
+            n_bg = max(n_chunk // _bg_toy_ratio, 1)
+            data, globs = self.generate_toys(bg_pars, n_bg, random)
+            alt.append(self.qmu_tilde_toys(mu, data, globs))
+        cls_dict = toys.toy_cls(
+            toys.TestStatDist(np.concatenate(null).tolist()),
+            toys.TestStatDist(np.concatenate(alt).tolist()),
+            observed)
+        return {k: max(float(v), _min_cls) for k, v in cls_dict.items()}
+
+    def reweighted_toy_cls(self, mu, reference_mus, n_toys=2000, seed=1):
+        """
+        Same as `toy_cls`, but the toys are reused between signal
+        strengths. The signal plus background toys are generated once,
+        split between the `reference_mus`, and weighted to `mu` by the
+        ratio of their likelihood at `mu` to that of the mixture they
+        were drawn from. The background only toys don't depend on `mu`.
+        Only the conditional fits are redone for each `mu`.
+
+        The weights get broad far from every reference, so the
+        `reference_mus` should span the signal strengths that are
+        tested.
+        """
+        self._check_poi(mu)
+        null, alt = self._reference_toys(tuple(reference_mus), n_toys, seed)
+        null_pars, _ = self.fit(poi=mu, init=self.fit_data()[0])
+        log_weights = -null.nll(self, null_pars) - null.log_mixture
+        weights = np.exp(log_weights - log_weights.max())
+        cls_dict = toys.toy_cls(
+            toys.TestStatDist(null.qmu_tilde(self, mu).tolist(),
+                              weights.tolist()),
+            toys.TestStatDist(alt.qmu_tilde(self, mu).tolist()),
+            self.qmu_tilde(mu))
+        return {k: max(float(v), _min_cls) for k, v in cls_dict.items()}
+
+    def _reference_toys(self, reference_mus, n_toys, seed):
+        """
+        (signal plus background, background only) `_ToySet`s used by
+        `reweighted_toy_cls`, generated on the first call.
+        """
+        key = reference_mus, n_toys, seed
+        if key in self._reference_sets:
+            return self._reference_sets[key]
+        free_pars = self.fit_data()[0]
+        ref_pars = [self.fit(poi=mu, init=free_pars)[0]
+                    for mu in reference_mus]
+        n_each = max(n_toys // len(reference_mus), 1)
+        parts = [self._generate_chunks(pars, n_each, seed,
+                                       [self.signal_point, 'reference', mu])
+                 for mu, pars in zip(reference_mus, ref_pars)]
+        null = _ToySet(self, np.vstack([data for data, _ in parts]),
+                       np.vstack([globs for _, globs in parts]))
+        # the mixture has an equal share of toys from each reference
+        log_pdfs = np.array([-null.nll(self, pars) for pars in ref_pars])
+        top = log_pdfs.max(axis=0)
+        null.log_mixture = top + np.log(np.exp(log_pdfs - top).mean(axis=0))
+
+        bg_pars, _ = self.fit(poi=0.0, init=free_pars)
+        n_bg = max(n_toys // _bg_toy_ratio, 1)
+        alt = _ToySet(self, *self._generate_chunks(
+                bg_pars, n_bg, seed, [self.signal_point, 'background']))
+        self._reference_sets[key] = null, alt
+        return null, alt
+
+    def _generate_chunks(self, pars, n_toys, seed, key):
+        """`generate_toys` in chunks seeded from `seed` and `key`"""
+        data, globs = [], []
+        for chunk_seed, n_chunk in toys.chunk_seeds(seed, key, n_toys):
+            random = np.random.RandomState(chunk_seed)
+            chunk_data, chunk_globs = self.generate_toys(
+                pars, n_chunk, random)
+            data.append(chunk_data)
+            globs.append(chunk_globs)
+        return np.vstack(data), np.vstack(globs)
+
+    # ____________________________________________________________________
+    # toys, as arrays with one row per toy
+
+    def generate_toys(self, pars, n_toys, random):
+        """
+        Return (data, globs) arrays for `n_toys` toys generated with
+        parameters `pars`, using the numpy `RandomState` `random`. The
+        global observables are drawn around the values in `pars`.
+        """
+        data = random.poisson(self.expected(pars), size=(
+                n_toys, len(self.regions))).astype(float)
+        globs = np.tile(self.nominal_globs, (n_toys, 1))
+        con = self._constrained
+        globs[:, con] = random.normal(
+            pars[con], self._constraint_err[con], size=(n_toys, con.sum()))
+        return data, globs
+
+    def qmu_tilde_toys(self, mu, data, globs, free_fit=None):
+        """
+        `qmu_tilde` for each toy. If the free fits are already done
+        their (parameters, nll) can be passed as `free_fit`.
+        """
+        if free_fit is None:
+            free_fit = self.fit_toys(data, globs)
+        return self._qmu_tilde_fits(mu, data, globs, free_fit)[0]
+
+    def _qmu_tilde_fits(self, mu, data, globs, free_fit, init=None):
+        """
+        (`qmu_tilde`, conditional fit parameters) for each toy. The
+        conditional fits start from `init` (default: the free fits),
+        and are only run where the free fit is below `mu`, since the
+        rest have `qmu_tilde` of zero anyway.
+        """
+        free_pars, free_nll = free_fit
+        cond_pars = np.array(free_pars if init is None else init)
+        qmu = np.zeros(len(data))
+        below = free_pars[:, 0] <= mu
+        if below.any():
+            cond_pars[below], cond_nll = self.fit_toys(
+                data[below], globs[below], poi=mu, init=cond_pars[below])
+            qmu[below] = np.maximum(2.0 * (cond_nll - free_nll[below]), 0.0)
+        cond_pars[:, 0] = mu
+        return qmu, cond_pars
+
+    def fit_toys(self, data, globs, poi=None, init=None):
+        """
+        Minimize the NLL for every toy, return (best fit parameters,
+        nll) arrays, as `fit` does for one dataset. Parameters at their
+        bounds that are pushed outwards stay there for that step. The
+        odd toy that doesn't converge is refit with `fit`.
+        """
+        n_toys, n_pars = len(data), len(self.par_names)
+        if init is None:
+            init = self.init_pars
+        pars = np.array(np.broadcast_to(init, (n_toys, n_pars)), float)
+        free = np.ones(n_pars, dtype=bool)
+        if poi is not None:
+            pars[:, 0] = poi
+            free[0] = False
+        low, high = np.array(self.bounds, dtype=float).T
+        low = np.where(free, low, -np.inf)
+        high = np.where(free, high, np.inf)
+        pars = np.clip(pars, low, high)
+
+        value, grad, fisher = self._nll_toys(pars, data, globs)
+        todo = np.ones(n_toys, dtype=bool)
+        stuck = np.zeros(n_toys, dtype=bool)
+        diag = np.arange(n_pars)
+        for _ in xrange(_max_newton_steps):
+            # only the toys that haven't converged are worked on
+            active = np.flatnonzero(todo)
+            act_pars, act_grad = pars[active], grad[active]
+            fixed = ~free | ((act_pars <= low) & (act_grad > 0))
+            fixed |= (act_pars >= high) & (act_grad < 0)
+            grad_free = np.where(fixed, 0.0, act_grad)
+            matrix = fisher[active] * ~(fixed[:, :, None] | fixed[:, None, :])
+            matrix[:, diag, diag] += fixed
+            step = -np.linalg.solve(matrix, grad_free[..., None])[..., 0]
+            # the newton decrement, i.e. the expected decrease in NLL
+            going = -(grad_free * step).sum(axis=1) > _newton_tol
+            todo[active[~going]] = False
+            active, step = active[going], step[going]
+            if not len(active):
+                break
+            scale = np.ones(len(active))
+            for _ in xrange(_max_step_halvings):
+                trial = np.clip(
+                    pars[active] + scale[:, None] * step, low, high)
+                trial_value = self._nll_toys(
+                    trial, data[active], globs[active])[0]
+                worse = trial_value > value[active]
+                if not worse.any():
+                    break
+                scale[worse] *= 0.5
+            # toys that can't go downhill are left for `fit`
+            stuck[active[worse]] = True
+            todo[active[worse]] = False
+            moved = active[~worse]
+            if len(moved):
+                pars[moved] = trial[~worse]
+                value[moved], grad[moved], fisher[moved] = self._nll_toys(
+                    pars[moved], data[moved], globs[moved])
+
+        for toy in np.flatnonzero(todo | stuck):
+            pars[toy], value[toy] = self.fit(
+                data[toy], globs[toy], poi=poi, init=pars[toy])
+        return pars, value
+
+    def _nll_toys(self, pars, data, globs):
+        """
+        NLL for each toy, with its gradient and the Fisher information
+        (the expected second derivatives) for every parameter.
+        """
+        n_toys, n_pars = pars.shape
+        norms = np.hstack([pars[:, :self._n_norm], np.ones((n_toys, 1))])
+        norms = norms[:, self._norm_index]
+        interp, dinterp = self._interp(
+            pars[:, None, None, self._alpha_slice])
+        gamma = np.ones((n_toys, len(self.regions)))
+        gamma[:, self._gamma_chan] = pars[:, self._gamma_slice]
+        lumi = pars[:, self._lumi_index]
+        chan_scale = gamma * lumi[:, None]
+        # (toy x channel x sample) yields, before norm factors
+        unnormed = self.nominal * interp.prod(axis=3) * chan_scale[..., None]
+        raw_nu = (unnormed * norms[:, None, :]).sum(axis=2)
+        nu = np.maximum(raw_nu, 1e-12)
+
+        # derivatives of the expected counts (toy x channel x parameter)
+        jac = np.zeros(nu.shape + (n_pars,))
+        has_norm = self._norm_index >= 0
+        norm_map = np.zeros((len(self.samples), self._n_norm))
+        norm_map[has_norm, self._norm_index[has_norm]] = 1.0
+        jac[..., :self._n_norm] = unnormed.dot(norm_map)
+        jac[..., self._lumi_index] = raw_nu / lumi[:, None]
+        jac[..., self._alpha_slice] = np.einsum(
+            'tcs,tcsk->tck', unnormed * norms[:, None, :], dinterp / interp)
+        gamma_index = np.arange(n_pars)[self._gamma_slice]
+        jac[:, self._gamma_chan, gamma_index] = (
+            raw_nu[:, self._gamma_chan] / pars[:, self._gamma_slice])
+
+        pull = (pars - globs) / self._constraint_err
+        pull[:, ~self._constrained] = 0.0
+        value = (nu - data * np.log(nu)).sum(axis=1)
+        value += 0.5 * (pull**2).sum(axis=1)
+        grad = np.einsum('tc,tcp->tp', 1.0 - data / nu, jac)
+        grad += pull / self._constraint_err
+        fisher = np.einsum('tcp,tc,tcq->tpq', jac, 1.0 / nu, jac)
+        diag = np.arange(n_pars)
+        fisher[:, diag, diag] += self._constrained / self._constraint_err**2
+        return value, grad, fisher
+
+class _ToySet(object):
+    """
+    Toys kept to be reused for several signal strengths, along with
+    their free fits (which don't depend on the signal strength).
+    """
+    def __init__(self, model, data, globs):
+        self.data = data
+        self.globs = globs
+        self.free_fit = model.fit_toys(data, globs)
+        # log density the toys were drawn from, for reweighting
+        self.log_mixture = None
+        # conditional fit parameters, by signal strength
+        self._cond_pars = {}
+
+    def nll(self, model, pars):
+        """NLL of every toy for parameters `pars`"""
+        all_pars = np.tile(pars, (len(self.data), 1))
+        return model._nll_toys(all_pars, self.data, self.globs)[0]
+
+    def qmu_tilde(self, model, mu):
+        """
+        `qmu_tilde` for every toy, the conditional fits start from
+        those at the closest signal strength already tested
+        """
+        init = None
+        if self._cond_pars:
+            closest = min(self._cond_pars, key=lambda done: abs(done - mu))
+            init = self._cond_pars[closest]
+        qmu, self._cond_pars[mu] = model._qmu_tilde_fits(
+            mu, self.data, self.globs, self.free_fit, init)
+        return qmu
+
+# __________________________________________________________________________
+# asymptotic formulae
+
+def asymptotic_cls_values(qmu, qmu_a):
+    """
+    Turn the observed and asimov `qmu-tilde` into a dict of CLs values,
+    as reported by `CLsCalc`.
+    """
+    pnull, palt = asymptotic_pvalues(qmu, qmu_a)
+    cls_dict = {
+        'obs': pnull / palt if palt > 0 else -1,
+        'exp': expected_cls(pnull, palt, 0),
+        'exp_u1s': expected_cls(pnull, palt, 1),
+        'exp_d1s': expected_cls(pnull, palt, -1),
+        'exp_u2s': expected_cls(pnull, palt, 2),
+        'exp_d2s': expected_cls(pnull, palt, -2),
+        }
+    return {k: max(float(v), _min_cls) for k, v in cls_dict.items()}
+
+def asymptotic_pvalues(qmu, qmu_a):
+    """
+    Return the (CLs+b, CLb) p-values for `qmu-tilde`, following the
+    RooStats AsymptoticCalculator.
+    """
+    sqrtq = qmu**0.5
+    sqrtq_a = qmu_a**0.5
+    if qmu > qmu_a and qmu_a > 0:
+        pnull = ndtr(-(qmu + qmu_a) / (2 * sqrtq_a))
+        palt = ndtr((qmu_a - qmu) / (2 * sqrtq_a))
+    else:
+        pnull = ndtr(-sqrtq)
+        palt = ndtr(sqrtq_a - sqrtq)
+    return pnull, palt
+
+def expected_cls(pnull, palt, nsigma):
+    """expected CLs at `nsigma` (positive is weaker exclusion)"""
+    sqrtq = -ndtri(pnull)
+    sqrtq_a = ndtri(palt) + sqrtq
+    clsplusb = ndtr(-(sqrtq_a - nsigma))
+    clb = ndtr(nsigma)
+    return clsplusb / clb
+
+# __________________________________________________________________________
+# helpers
+
+class _Code4Interpolation(object):
+    """
+    HistFactory interpolation code 4 for `OverallSys`: exponential
+    outside +-1 sigma, 6th order polynomial inside (matching the value,
+    first and second derivatives at the boundary).
+    """
+    def __init__(self, low, high):
+        # guard against non-positive variations, the log is undefined
+        self.low = np.maximum(low, 1e-12)
+        self.high = np.maximum(high, 1e-12)
+        log_hi = np.log(self.high)
+        log_lo = np.log(self.low)
+        pow_up, pow_down = self.high, self.low
+        pow_up_log = pow_up * log_hi
+        pow_down_log = -pow_down * log_lo
+        pow_up_log2 = pow_up_log * log_hi
+        pow_down_log2 = -pow_down_log * log_lo
+        s0 = (pow_up + pow_down) / 2
+        a0 = (pow_up - pow_down) / 2
+        s1 = (pow_up_log + pow_down_log) / 2
+        a1 = (pow_up_log - pow_down_log) / 2
+        s2 = (pow_up_log2 + pow_down_log2) / 2
+        a2 = (pow_up_log2 - pow_down_log2) / 2
+        # polynomial coefficients, for x^1 ... x^6
+        self.coef = np.array([
+                1. / 8 * (15 * a0 - 7 * s1 + a2),
+                1. / 8 * (-24 + 24 * s0 - 9 * a1 + s2),
+                1. / 4 * (-5 * a0 + 5 * s1 - a2),
+                1. / 4 * (12 - 12 * s0 + 7 * a1 - s2),
+                1. / 8 * (3 * a0 - 3 * s1 + a2),
+                1. / 8 * (-8 + 8 * s0 - 5 * a1 + s2)])
+        self.log_hi = log_hi
+        self.log_lo = log_lo
+
+    def __call__(self, alpha):
+        """
+        return the interpolated values and their derivatives, `alpha`
+        can have extra leading dimensions (e.g. one per toy)
+        """
+        shape = np.broadcast(alpha, self.low).shape
+        x = np.broadcast_to(alpha, shape)
+        # polynomial (and its derivative) by Horner's method
+        poly = self.coef[5]
+        dpoly = 6 * self.coef[5]
+        for power in xrange(5, 0, -1):
+            poly = self.coef[power - 1] + x * poly
+            dpoly = power * self.coef[power - 1] + x * dpoly
+        value = 1 + x * poly
+        deriv = dpoly
+
+        up = x >= 1
+        exp_up = self.high**x
+        value = np.where(up, exp_up, value)
+        deriv = np.where(up, exp_up * self.log_hi, deriv)
+        down = x <= -1
+        exp_down = self.low**(-x)
+        value = np.where(down, exp_down, value)
+        deriv = np.where(down, -exp_down * self.log_lo, deriv)
+        return value, deriv
+
+def _sigma_bounds(central, err):
+    # these parameters multiply yields, keep them (just) positive
+    low = max(central - _n_sigma_range * err, 1e-6)
+    return low, central + _n_sigma_range * err
@@ -0,0 +1,365 @@
+"""
+A local server that keeps ROOT and libSusyFitter loaded, so the
+booking and fitting scripts don't have to load them every time.
+
+`serve` loads ROOT, libSusyFitter, and the scharmfit modules once,
+then waits for scripts on a unix socket. The scripts call `forward`
+first thing: if a server is running, the script is run there instead,
+in a process forked from the server. It gets the same arguments,
+working directory, environment, and standard input / output (the file
+descriptors are passed over the socket), and the exit code is handed
+back. If no server is running, `forward` returns and the script runs
+as usual.
+
+The server itself never books or fits anything, every script gets a
+fresh fork. None of the global state (or leaked memory) from one
+script can leak into the next.
+
+Only the user running the server can use it: the socket sits in a
+directory only they can get into (which is checked before connecting),
+and both ends check who is on the other end (with SO_PEERCRED).
+
+The forked process has the modules the server loaded, not what's on
+disk now. If any of them (or libSusyFitter) changed since the server
+started, it refuses the script, which then runs locally. Restart the
+server to pick up the changes.
+"""
+
+import os, sys, stat, signal, socket, struct, json, tempfile, traceback
+import runpy
+from os.path import join, dirname, basename, realpath, isfile, exists
+from multiprocessing.reduction import send_handle, recv_handle
+
+# set to the socket path to use another server, or to 'off' to not
+# use one at all
+_address_env = 'SUSYFIT_DAEMON'
+_off = {'off', '0'}
+
+# python 2 doesn't have this one, it's the linux value
+_so_peercred = getattr(socket, 'SO_PEERCRED', 17)
+_ucred = struct.Struct('3i')
+
+# seconds the server waits for a request before giving up on a client
+_request_timeout = 10.0
+
+# the scripts the server will run
+_scripts = {
+    'susy-fit-workspace.py', 'susy-fit-runfit.py', 'susy-fit-discovery.py'}
+_scripts_dir = join(dirname(realpath(__file__)), '..', '..', 'scripts')
+
+# set in the processes forked from the server, so they don't forward
+# the script back to it
+_in_server = False
+
+def default_address():
+    address = os.environ.get(_address_env)
+    if address and address not in _off:
+        return address
+    run_dir = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+    return join(run_dir, 'scharmfit-{}'.format(os.getuid()), 'daemon.sock')
+
+def forward(script_path, address=None):
+    """
+    If a server is running, run the script at `script_path` (with the
+    arguments in `sys.argv`) there and exit with its exit code.
+    Otherwise just return.
+    """
+    if _in_server or os.environ.get(_address_env) in _off:
+        return
+    address = address or default_address()
+    conn = _connect(address)
+    if conn is None:
+        return
+    _send(conn, {'script': realpath(script_path), 'argv': sys.argv[1:],
+                 'cwd': os.getcwd(), 'env': dict(os.environ)})
+    reply = _recv(conn) or {'refused': 'it hung up'}
+    if 'refused' in reply:
+        sys.stderr.write('not using the server at {}: {}\n'.format(
+                address, reply['refused']))
+        conn.close()
+        return
+    for fd in [0, 1, 2]:
+        send_handle(conn, fd, reply['pid'])
+    try:
+        result = _recv(conn)
+    except KeyboardInterrupt:
+        os.kill(reply['pid'], signal.SIGINT)
+        result = _recv(conn)
+    if result is None:
+        sys.stderr.write('server process {} died\n'.format(reply['pid']))
+        sys.exit(1)
+    sys.exit(result['exit'])
+
+def is_running(address=None):
+    """
+    True if a server is listening on `address`. If the socket is left
+    over from one that died, it's removed.
+    """
+    address = address or default_address()
+    if _check_dir(address) or not exists(address):
+        return False
+    conn = _connect(address)
+    if conn is None:
+        os.remove(address)
+        return False
+    conn.close()
+    return True
+
+def stop(address=None):
+    """stop the server at `address`, return False if there isn't one"""
+    conn = _connect(address or default_address())
+    if conn is None:
+        return False
+    _send(conn, {'stop': True})
+    conn.close()
+    return True
+
+# __________________________________________________________________________
+# server side
+
+def serve(address=None, preload=True):
+    """load everything, then run scripts sent to `address` until stopped"""
+    address = address or default_address()
+    if is_running(address):
+        raise OSError('a server is already running at {}'.format(address))
+    _make_dir(dirname(address) or '.')
+    if preload:
+        _preload()
+    sources = _loaded_sources()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only this user can connect
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(address)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+    print 'serving on {} (pid {})'.format(address, os.getpid())
+    sys.stdout.flush()
+    try:
+        while True:
+            conn, _ = listener.accept()
+            # don't let a client that says nothing hang the server
+            conn.settimeout(_request_timeout)
+            try:
+                request = _recv(conn) if _peer_is_us(conn) else None
+            except (ValueError, socket.error):
+                request = None
+            if request is None:
+                # someone checking if we're here (or talking nonsense,
+                # or someone else)
+                conn.close()
+                continue
+            if request.get('stop'):
+                conn.close()
+                break
+            refused = _check_request(request, sources)
+            if refused:
+                _send(conn, {'refused': refused})
+                conn.close()
+                continue
+            # forked twice, so the script's process belongs to init,
+            # which cleans it up when it's done
+            pid = os.fork()
+            if pid == 0:
+                listener.close()
+                if os.fork() == 0:
+                    _run_script(conn, request)
+                os._exit(0)
+            os.waitpid(pid, 0)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if exists(address):
+            os.remove(address)
+    print 'stopped'
+
+def _preload():
+    """load everything the scripts would load"""
+    import ROOT
+    from scharmfit import utils
+    utils.load_susyfit()
+    # the dictionaries are set up the first time something is used
+    ROOT.RooWorkspace, ROOT.RooStats.HistFactory.Measurement
+    ROOT.ConfigMgr, ROOT.Util, ROOT.RooStats.HypoTestTool
+    import scharmfit.workspace, scharmfit.calculators, scharmfit.systematics
+    import scharmfit.yieldcache, scharmfit.results, yaml
+    try:
+        import scharmfit.counting
+    except ImportError:
+        # no scipy, so no counting backend
+        pass
+
+def _loaded_sources():
+    """modification times of the loaded scharmfit code and the library"""
+    paths = [mod.__file__ for name, mod in sys.modules.items()
+             if name.startswith('scharmfit') and mod is not None]
+    paths = [p[:-1] if p.endswith(('.pyc', '.pyo')) else p for p in paths]
+    lib = join(dirname(realpath(__file__)), '..', '..', 'lib',
+               'libSusyFitter.so')
+    if isfile(lib):
+        paths.append(lib)
+    return {path: _mtime(path) for path in paths}
+
+def _check_request(request, sources):
+    """the reason to refuse `request`, or None"""
+    if not {'script', 'argv', 'cwd', 'env'} <= set(request):
+        return 'incomplete request'
+    name = basename(request['script'])
+    if name not in _scripts:
+        return "won't run {}".format(name)
+    if realpath(join(_scripts_dir, name)) != request['script']:
+        return 'it runs the scripts in {}'.format(realpath(_scripts_dir))
+    changed = [p for p, mtime in sources.iteritems() if _mtime(p) != mtime]
+    if changed:
+        return '{} changed since it started, restart it'.format(
+            basename(changed[0]))
+    return None
+
+def _run_script(conn, request):
+    """run the script, in a process forked from the server"""
+    global _in_server
+    _in_server = True
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    exit_code = 1
+    try:
+        # passing file descriptors needs a blocking socket
+        conn.settimeout(None)
+        _send(conn, {'pid': os.getpid()})
+        for fd in [0, 1, 2]:
+            handle = recv_handle(conn)
+            os.dup2(handle, fd)
+            os.close(handle)
+        # json gives back unicode
+        request = _to_str(request)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = [request['script']] + request['argv']
+        try:
+            runpy.run_path(request['script'], run_name='__main__')
+            exit_code = 0
+        except SystemExit as exit:
+            exit_code = _exit_code(exit.code)
+        except BaseException:
+            traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send(conn, {'exit': exit_code})
+    finally:
+        os._exit(exit_code)
+
+def _exit_code(code):
+    """what the exit code of `sys.exit(code)` would be"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('{}\n'.format(code))
+    return 1
+
+def _to_str(obj):
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [_to_str(item) for item in obj]
+    if isinstance(obj, dict):
+        return {_to_str(k): _to_str(v) for k, v in obj.iteritems()}
+    return obj
+
+# __________________________________________________________________________
+# messages are json, after their length
+
+_header = struct.Struct('!I')
+
+def _connect(address):
+    """connect to the server, or return None if there isn't one"""
+    problem = _check_dir(address)
+    if problem:
+        # no directory just means no server
+        if exists(dirname(address) or '.'):
+            sys.stderr.write('not using the server at {}: {}\n'.format(
+                    address, problem))
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(address)
+    except socket.error:
+        # no server, or a stale socket from one that died
+        conn.close()
+        return None
+    if not _peer_is_us(conn):
+        sys.stderr.write(
+            'not using the server at {}: it runs as another user\n'.format(
+                address))
+        conn.close()
+        return None
+    return conn
+
+def _peer_is_us(conn):
+    """true if the process on the other end runs as this user"""
+    creds = conn.getsockopt(socket.SOL_SOCKET, _so_peercred, _ucred.size)
+    pid, uid, gid = _ucred.unpack(creds)
+    return uid == os.getuid()
+
+def _check_dir(address):
+    """
+    The reason not to trust the directory `address` is in, or None.
+    It has to belong to this user, and nobody else can get into it.
+    """
+    run_dir = dirname(address) or '.'
+    try:
+        info = os.lstat(run_dir)
+    except OSError:
+        return 'there is no {}'.format(run_dir)
+    if not stat.S_ISDIR(info.st_mode):
+        return '{} is not a directory'.format(run_dir)
+    if info.st_uid != os.getuid():
+        return '{} belongs to another user'.format(run_dir)
+    if info.st_mode & 0o077:
+        return 'other users can get into {}'.format(run_dir)
+    return None
+
+def _make_dir(run_dir):
+    """make the directory for the socket, or check the one that's there"""
+    try:
+        os.mkdir(run_dir, 0o700)
+    except OSError:
+        if not os.path.isdir(run_dir):
+            raise
+    problem = _check_dir(join(run_dir, 'daemon.sock'))
+    if problem:
+        raise OSError("won't serve there: {}".format(problem))
+
+def _send(conn, message):
+    data = json.dumps(message)
+    conn.sendall(_header.pack(len(data)) + data)
+
+def _recv(conn):
+    """
+    The next message, or None if the other side hung up. Reads exactly
+    the message, so passed file descriptors aren't read as data.
+    """
+    header = _recv_exactly(conn, _header.size)
+    if header is None:
+        return None
+    data = _recv_exactly(conn, _header.unpack(header)[0])
+    return None if data is None else json.loads(data)
+
+def _recv_exactly(conn, n_bytes):
+    chunks = []
+    while n_bytes:
+        chunk = conn.recv(n_bytes)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n_bytes -= len(chunk)
+    return ''.join(chunks)
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
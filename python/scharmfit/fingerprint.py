@@ -0,0 +1,108 @@
+"""
+Fingerprints of the inputs that went into an output file, so that reruns
+can skip anything that's already up to date.
+
+A fingerprint is a hash of (a json dump of) everything the output
+depends on. It's stored next to the output, in a file with the
+`.fingerprint` suffix added, and only written once the output is
+complete. If the output is missing, or the stored fingerprint doesn't
+match, the output needs rebuilding.
+"""
+
+import os, json, hashlib
+from os.path import isfile
+from scharmfit.workspace import FitInputs
+
+_suffix = '.fingerprint'
+
+def get_fingerprint(*parts):
+    """hash any number of json-able things"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True))
+    return digest.hexdigest()
+
+def file_hash(path, block_size=2**20):
+    """hash of the contents of `path`"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as in_file:
+        for block in iter(lambda: in_file.read(block_size), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def code_version(*paths):
+    """hash of the source files in `paths` (e.g. `module.__file__`)"""
+    # the module may have been loaded from a compiled file
+    sources = [p[:-1] if p.endswith(('.pyc', '.pyo')) else p for p in paths]
+    return get_fingerprint([file_hash(p) for p in sources])
+
+def is_current(out_path, fingerprint):
+    """true if `out_path` exists and was built with `fingerprint`"""
+    fp_path = out_path + _suffix
+    if not isfile(out_path) or not isfile(fp_path):
+        return False
+    with open(fp_path) as fp_file:
+        return fp_file.read().strip() == fingerprint
+
+def record(out_path, fingerprint):
+    """store the fingerprint for `out_path`, call once it's written"""
+    fp_path = out_path + _suffix
+    tmp_path = '{}.tmp{}'.format(fp_path, os.getpid())
+    with open(tmp_path, 'w') as fp_file:
+        fp_file.write(fingerprint + '\n')
+    os.rename(tmp_path, fp_path)
+
+def clear(out_path):
+    """remove the fingerprint, call before rewriting `out_path`"""
+    fp_path = out_path + _suffix
+    if isfile(fp_path):
+        os.remove(fp_path)
+
+def split_yields(yields, regions, is_signal):
+    """
+    Slice the `yields` dict to only include `regions`, and split off
+    the processes where `is_signal(process)` is true. Returns a tuple
+    `(common, {signal: slice, ...})` where each slice has the same
+    structure as `yields`. Systematics that don't touch any of the
+    regions are dropped.
+
+    The numbers are converted to floats, so the slices (and their
+    fingerprints) are the same whether or not the yields came through
+    the yields cache.
+    """
+    regions = set(regions)
+    common = {}
+    signals = {}
+    def add(key, syst, region, proc, vals):
+        vals = [float(val) for val in vals]
+        if is_signal(proc):
+            out = signals.setdefault(proc, {})
+        else:
+            out = common
+        section = out.setdefault(key, {})
+        if syst is not None:
+            section = section.setdefault(syst, {})
+        if proc is None:
+            section[region] = vals
+        else:
+            section.setdefault(region, {})[proc] = vals
+
+    def add_regions(key, syst, regdict):
+        for region, procdict in regdict.iteritems():
+            if region not in regions:
+                continue
+            # relative systematics can apply to a full region
+            if not isinstance(procdict, dict):
+                add(key, syst, region, None, procdict)
+                continue
+            for proc, vals in procdict.iteritems():
+                add(key, syst, region, proc, vals)
+
+    for key, section in yields.iteritems():
+        if key == FitInputs.baseline_yields_key:
+            add_regions(key, None, section)
+        else:
+            # systematics are keyed by systematic first
+            for syst, regdict in section.iteritems():
+                add_regions(key, syst, regdict)
+    return common, signals
@@ -0,0 +1,39 @@
+"""
+Picks the points where asymptotic results should be redone with toys.
+
+The asymptotic formulae are cheap, but they get unreliable with few
+events in the signal region. Toys are reliable, but far too slow to
+run everywhere. Only the points close to the exclusion boundary can
+change the contour, so those get toys, along with any point with a
+small expected background in its most sensitive channel. The closest
+points to the boundary go first, up to a budget.
+"""
+
+import math
+from scharmfit.contour import boundary_distance
+
+# within this factor of the CLs (or limit) cut counts as near
+_boundary_factor = 3.0
+# fewer expected background events than this is a small count
+_small_background = 10.0
+
+def pick_toy_points(results, budget=None):
+    """
+    Takes a {key: fit result} dict, returns the keys of the results
+    to redo with toys, at most `budget` of them, closest to the
+    boundary first. Inferred results and failed fits are skipped.
+    """
+    ranked = []
+    for key, fit_dict in results.iteritems():
+        if fit_dict.get('inferred'):
+            continue
+        distance = boundary_distance(fit_dict)
+        if distance is None:
+            continue
+        near = distance < math.log(_boundary_factor)
+        background = fit_dict.get('sr_background')
+        small = background is not None and background < _small_background
+        if near or small:
+            ranked.append((distance, key))
+    ranked.sort()
+    return [key for _, key in ranked[:budget]]
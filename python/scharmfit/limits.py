@@ -0,0 +1,159 @@
+"""
+Upper limits from bracketed root-finding on CLs(mu).
+
+Rather than testing a fixed grid of signal strengths, the limit
+finder starts from a bracket estimated from the yields and converges
+on the signal strength where CLs crosses 0.05. Every hypothesis test
+gives the observed and all the expected CLs values at once, so the
+tests are cached and shared between the observed limit and each
+expected quantile. Later quantiles start from the tightest bracket
+the earlier tests give them.
+
+Nothing here depends on ROOT, the calculators pass in a function that
+runs one hypothesis test.
+"""
+
+import math
+
+# CLs value defining the limit
+_cls_target = 0.05
+# factor between the rough limit estimate and the ends of the bracket
+_bracket_factor = 2.0
+# the bracket is widened by this factor until it contains the crossing
+_expand_factor = 4.0
+_min_mu = 1e-4
+_max_mu = 1e4
+
+# limit names for each CLs value returned by the calculators
+limit_keys = [
+    ('obs', 'ul'),
+    ('exp', 'ul_exp'),
+    ('exp_u1s', 'ul_exp_u1s'),
+    ('exp_d1s', 'ul_exp_d1s'),
+    ('exp_u2s', 'ul_exp_u2s'),
+    ('exp_d2s', 'ul_exp_d2s'),
+    ]
+
+def estimate_bracket(channel_yields):
+    """
+    Rough (low, high) bracket on the upper limit on the signal
+    strength, from a list of (signal, background, observed) yields,
+    one entry per channel. The most sensitive channel is used.
+    """
+    est = _rough_limit(*sensitive_channel(channel_yields))
+    return est / _bracket_factor, est * _bracket_factor
+
+def sensitive_channel(channel_yields):
+    """
+    The (signal, background, observed) yields of the channel that
+    gives the tightest rough limit (usually the signal region).
+    """
+    with_signal = [chan for chan in channel_yields if chan[0] > 0]
+    if not with_signal:
+        raise ValueError('no signal in any channel, no limit to set')
+    sig, bg, obs = min(with_signal, key=lambda chan: _rough_limit(*chan))
+    return float(sig), float(bg), float(obs)
+
+def _rough_limit(sig, bg, obs):
+    # roughly two sigma above any excess
+    n_up = max(obs - bg, 0.0) + 2.0 * math.sqrt(max(obs, bg) + 1.0)
+    return n_up / sig
+
+def find_upper_limits(get_cls, bracket, keys=None, rel_tol=0.005,
+                      max_tests=50, tested=None):
+    """
+    Find the upper limits for each CLs value in `keys` (defaults to
+    all of them). `get_cls(mu)` should return a dict of CLs values
+    (as given by the calculators) for signal strength `mu`. Tests that
+    have already been run can be passed in as a {mu: CLs dict} dict
+    with `tested`.
+
+    Returns a tuple `(limits, n_tests)`, where `limits` is keyed by
+    the limit names in `limit_keys`. Limits that can't be found
+    (including those below `_min_mu` or above `_max_mu`) are set to
+    -1.
+    """
+    if keys is None:
+        keys = [key for key, _ in limit_keys]
+    names = dict(limit_keys)
+    tested = dict(tested or {})
+    def cls_at(mu):
+        if mu not in tested:
+            if len(tested) >= max_tests:
+                raise _TooManyTests()
+            tested[mu] = get_cls(mu)
+        return tested[mu]
+
+    limits = {}
+    for key in keys:
+        try:
+            limits[names[key]] = float(_find_crossing(
+                key, cls_at, tested, bracket, rel_tol))
+        except _TooManyTests:
+            limits[names[key]] = -1
+    return limits, len(tested)
+
+class _TooManyTests(Exception):
+    pass
+
+def _find_crossing(key, cls_at, tested, bracket, rel_tol):
+    """
+    Find where CLs `key` crosses the target, using the Illinois
+    variant of regula falsi on log(CLs), which is close to linear in
+    the signal strength.
+    """
+    def log_ratio(mu):
+        # the calculators give -1 if they fail, treat that as tiny
+        return math.log(max(cls_at(mu)[key], 1e-12) / _cls_target)
+
+    low, high = _get_bracket(key, cls_at, tested, bracket)
+    if low is None or high is None:
+        return -1
+    g_low, g_high = log_ratio(low), log_ratio(high)
+    # the Illinois weights, these get halved when one side sticks
+    w_low, w_high = g_low, g_high
+    side = 0
+    while high - low > rel_tol * high:
+        mu = (low * w_high - high * w_low) / (w_high - w_low)
+        if not low < mu < high:
+            mu = 0.5 * (low + high)
+        g_mu = log_ratio(mu)
+        if abs(g_mu) < rel_tol:
+            return mu
+        if g_mu > 0:
+            low, g_low, w_low = mu, g_mu, g_mu
+            if side == 1:
+                w_high *= 0.5
+            side = 1
+        else:
+            high, g_high, w_high = mu, g_mu, g_mu
+            if side == -1:
+                w_low *= 0.5
+            side = -1
+    return (low * g_high - high * g_low) / (g_high - g_low)
+
+def _get_bracket(key, cls_at, tested, bracket):
+    """
+    Return (low, high) where CLs `key` is above the target at `low`
+    and below it at `high`. Starts from the tightest bracket given by
+    earlier tests if there is one, otherwise widens `bracket` as
+    needed. `low` is None if the limit is below the smallest signal
+    strength we try, `high` is None if it's above the largest.
+    """
+    above = [mu for mu, cls in tested.items() if cls[key] > _cls_target]
+    below = [mu for mu, cls in tested.items() if cls[key] <= _cls_target]
+    if above and below and max(above) < min(below):
+        return max(above), min(below)
+
+    low, high = bracket
+    while cls_at(low)[key] <= _cls_target:
+        high = low
+        low /= _expand_factor
+        if low < _min_mu:
+            return None, low
+    while cls_at(high)[key] > _cls_target:
+        low = high
+        high *= _expand_factor
+        if high > _max_mu:
+            return low, None
+    return low, high
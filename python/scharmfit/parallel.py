@@ -0,0 +1,183 @@
+"""
+Routines to spread independent jobs (booking workspaces, running fits)
+over several worker processes.
+
+Every worker is a separate process, so each one gets its own ROOT
+instance (and its own copy of all the global state HistFitter likes to
+keep around). Nothing ROOT related should be imported in the parent
+before the workers are started.
+
+HistFactory leaks memory with every workspace, so workers can be
+retired after a fixed number of jobs, or once their memory use passes
+a budget. A fresh worker takes over the remaining jobs.
+"""
+
+import multiprocessing
+import traceback
+import select
+import resource
+import sys, os
+from collections import deque
+
+def run_jobs(func, arg_list, n_jobs, initializer=None, initargs=(),
+             max_tasks=None, max_rss=None, report=None, prepare=None,
+             monitor=None):
+    """
+    Call `func(*args)` for every `args` in `arg_list`, using `n_jobs`
+    worker processes. Yields an `(args, result, error)` tuple as each
+    job finishes. If the job raised, `result` is None and `error` is
+    the formatted traceback, otherwise `error` is None.
+
+    Workers are replaced after `max_tasks` jobs, or after a job leaves
+    them with more than `max_rss` MB resident. When a worker exits,
+    `report(worker_stats)` is called, if given. If `monitor` is given,
+    `monitor(worker_stats)` is called each time a worker finishes a job.
+
+    If `prepare` is given, each `args` is replaced with `prepare(args)`
+    just before it's sent to a worker, so jobs can use the results of
+    the jobs that finished before them. The yielded `args` are the
+    prepared ones.
+
+    Jobs finish in whatever order they finish, don't rely on it.
+    """
+    pending = deque(arg_list)
+    idle = []
+    busy = {}                   # connection: (worker, args)
+    worker_args = (func, initializer, initargs, max_tasks, max_rss)
+    try:
+        while pending or busy:
+            while pending and len(busy) < n_jobs:
+                worker = idle.pop() if idle else _Worker(*worker_args)
+                args = pending.popleft()
+                if prepare:
+                    args = prepare(args)
+                worker.send(args)
+                busy[worker.conn] = worker, args
+            ready, _, _ = select.select(list(busy), [], [])
+            for conn in ready:
+                worker, args = busy.pop(conn)
+                result, error, retired = worker.receive()
+                if monitor:
+                    monitor(worker.stats)
+                if retired:
+                    worker.join()
+                    if report:
+                        report(worker.stats)
+                else:
+                    idle.append(worker)
+                yield args, result, error
+        while idle:
+            worker = idle.pop()
+            worker.stop()
+            if report:
+                report(worker.stats)
+    finally:
+        for worker, _ in busy.values():
+            worker.terminate()
+        for worker in idle:
+            worker.terminate()
+
+class WorkerStats(object):
+    """what we know about a worker: pid, jobs done, peak RSS in MB"""
+    def __init__(self, pid):
+        self.pid = pid
+        self.n_done = 0
+        self.peak_rss = 0.0
+        self.exit_code = None
+    def __str__(self):
+        tmp = 'worker {} did {} jobs, peak RSS {:.0f} MB'
+        out = tmp.format(self.pid, self.n_done, self.peak_rss)
+        if self.exit_code:
+            out += ', died with exit code {}'.format(self.exit_code)
+        return out
+
+# __________________________________________________________________________
+# parent side of the worker
+
+class _Worker(object):
+    def __init__(self, *worker_args):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # forked, so none of the arguments need to be pickled
+        self._proc = multiprocessing.Process(
+            target=_work, args=(child_conn,) + worker_args)
+        self._proc.daemon = True
+        self._proc.start()
+        child_conn.close()
+        self.stats = WorkerStats(self._proc.pid)
+
+    def send(self, args):
+        self.conn.send(args)
+
+    def receive(self):
+        """return (result, error, retired) for the job that was sent"""
+        try:
+            result, error, retired, peak_rss = self.conn.recv()
+        except EOFError:
+            # segfaults are not unheard of in ROOT
+            self.join()
+            error = 'worker {} died with exit code {}\n'.format(
+                self.stats.pid, self.stats.exit_code)
+            return None, error, True
+        self.stats.n_done += 1
+        self.stats.peak_rss = peak_rss
+        return result, error, retired
+
+    def stop(self):
+        self.conn.send(None)
+        self.join()
+
+    def join(self):
+        if not self.conn.closed:
+            self.conn.close()
+        self._proc.join()
+        self.stats.exit_code = self._proc.exitcode
+
+    def terminate(self):
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._proc.join()
+
+# __________________________________________________________________________
+# child side of the worker
+
+def _work(conn, func, initializer, initargs, max_tasks, max_rss):
+    """run jobs sent over `conn` until told to stop (or time to retire)"""
+    if initializer is not None:
+        initializer(*initargs)
+    n_done = 0
+    while True:
+        args = conn.recv()
+        if args is None:
+            break
+        try:
+            result, error = func(*args), None
+        except Exception:
+            result, error = None, traceback.format_exc()
+        # any output should be written before the parent hears back
+        sys.stdout.flush()
+        sys.stderr.flush()
+        n_done += 1
+        retire = max_tasks and n_done >= max_tasks
+        retire = retire or (max_rss and get_rss() > max_rss)
+        conn.send((result, error, bool(retire), get_peak_rss()))
+        if retire:
+            break
+    conn.close()
+
+def get_rss():
+    """current resident memory of this process, in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2.0**20
+    except (IOError, OSError):
+        # no procfs (e.g. OSX), the peak is the best we can do
+        return get_peak_rss()
+
+def get_peak_rss():
+    """peak resident memory of this process, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # OSX gives bytes, linux kB
+    if sys.platform == 'darwin':
+        return peak / 2.0**20
+    return peak / 2.0**10
@@ -0,0 +1,135 @@
+"""
+Per-stage timing for the booking and fitting scripts.
+
+The slow parts of the code are wrapped in `stage(name)` blocks. Nothing
+is recorded unless `enable` has been called: a disabled `stage` just
+returns a shared context manager that does nothing, so the blocks can
+stay in the code.
+
+Each stage records its wall time, the CPU time of the process, and the
+change in resident memory, along with any labels (e.g. the workspace)
+given to it or to the stages around it. Worker processes forked after
+`enable` inherit the recording. Every process appends its stages to
+one spool file as they finish, and `finish` turns the spool into a
+Chrome trace (load it in chrome://tracing or Perfetto) and prints the
+stages that took the most time.
+"""
+
+import os, sys, json, time
+from scharmfit.parallel import get_rss
+
+# stages shown in the summary
+_n_hottest = 15
+
+class _NullStage(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, exe_type, exe_val, tb):
+        return False
+
+_null_stage = _NullStage()
+_recorder = None
+
+def enable(trace_path):
+    """start recording, the trace will be written to `trace_path`"""
+    global _recorder
+    _recorder = _Recorder(trace_path)
+
+def stage(name, **labels):
+    """context manager to time the stage `name`, if recording"""
+    if _recorder is None:
+        return _null_stage
+    return _Stage(_recorder, name, labels)
+
+def finish():
+    """
+    Stop recording, write the trace, and print a summary. Only call
+    this from the process that called `enable`.
+    """
+    global _recorder
+    if _recorder is None:
+        return
+    recorder, _recorder = _recorder, None
+    events = recorder.close()
+    with open(recorder.trace_path, 'w') as trace:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace)
+    print 'wrote {} stages to {}'.format(len(events), recorder.trace_path)
+    print_summary(events)
+
+def print_summary(events, out=sys.stdout):
+    """table of the stages with the most total wall time"""
+    totals = {}
+    for event in events:
+        name = event['name']
+        calls, wall, cpu, rss = totals.get(name, (0, 0.0, 0.0, 0.0))
+        args = event['args']
+        totals[name] = (calls + 1, wall + event['dur'] / 1e6,
+                        cpu + args['cpu_s'], max(rss, args['rss_delta_mb']))
+    hottest = sorted(totals.iteritems(), key=lambda item: -item[1][1])
+    row = '{:<34} {:>6} {:>10} {:>10} {:>10} {:>10}\n'
+    out.write(row.format('stage', 'calls', 'wall [s]', 'cpu [s]',
+                         'mean [s]', 'max dRSS'))
+    for name, (calls, wall, cpu, rss) in hottest[:_n_hottest]:
+        out.write(row.format(
+                name[:34], calls, '{:.2f}'.format(wall), '{:.2f}'.format(cpu),
+                '{:.3f}'.format(wall / calls), '{:+.0f} MB'.format(rss)))
+
+# __________________________________________________________________________
+# recording
+
+class _Recorder(object):
+    """
+    Writes each finished stage as a line of json to a spool file. The
+    file is opened for appending, so the processes sharing it don't
+    overwrite each other.
+    """
+    def __init__(self, trace_path):
+        self.trace_path = trace_path
+        self._spool_path = trace_path + '.spool'
+        self._fd = os.open(self._spool_path,
+                           os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND)
+        self.labels = {}
+
+    def add(self, event):
+        os.write(self._fd, json.dumps(event) + '\n')
+
+    def close(self):
+        """return all the events in the spool, and remove it"""
+        os.close(self._fd)
+        with open(self._spool_path) as spool:
+            events = [json.loads(line) for line in spool]
+        os.remove(self._spool_path)
+        return sorted(events, key=lambda event: event['ts'])
+
+class _Stage(object):
+    def __init__(self, recorder, name, labels):
+        self._recorder = recorder
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        # nested stages inherit the labels
+        self._outer_labels = self._recorder.labels
+        self._recorder.labels = dict(self._outer_labels, **self._labels)
+        self._rss = get_rss()
+        self._cpu = _cpu_time()
+        self._start = time.time()
+
+    def __exit__(self, exe_type, exe_val, tb):
+        end = time.time()
+        args = dict(self._recorder.labels)
+        args.update(cpu_s=_cpu_time() - self._cpu,
+                    rss_delta_mb=get_rss() - self._rss)
+        if exe_type is not None:
+            args['error'] = exe_type.__name__
+        self._recorder.labels = self._outer_labels
+        self._recorder.add({
+                'name': self._name, 'ph': 'X', 'pid': os.getpid(),
+                'tid': 0, 'ts': self._start * 1e6,
+                'dur': (end - self._start) * 1e6, 'args': args})
+        return False
+
+def _cpu_time():
+    """user plus system time of this process"""
+    times = os.times()
+    return times[0] + times[1]
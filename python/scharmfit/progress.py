@@ -0,0 +1,179 @@
+"""
+Progress of a booking or fitting run, for monitoring.
+
+The loops tell a `RunStatus` how many points there are and how each one
+ended (completed, failed, or skipped because it was already done). It
+keeps the throughput over the last few minutes, the ETA that implies,
+and the largest resident memory of this process or any worker.
+
+Every so often (when a point finishes, at most once per `interval`)
+it prints a progress line and, if it was given a path, writes the
+status there. Paths ending in `.prom` get the Prometheus textfile
+format (for the node exporter's textfile collector), anything else
+gets json. The file is replaced atomically, so a scraper never sees
+half of it. Nothing is written while a point is running, so a file
+that stops changing means the run is stuck (or dead).
+"""
+
+import os, json, time, socket
+from collections import deque
+from scharmfit.parallel import get_peak_rss
+
+# throughput is measured over this many seconds
+_window = 300.0
+_outcomes = ['completed', 'failed', 'skipped']
+
+class RunStatus(object):
+    """
+    Counts the points in a run called `run` (e.g. 'booking'), writing
+    the status to `path` (if given) at most every `interval` seconds.
+    """
+    def __init__(self, run, path=None, interval=30.0):
+        self.run = run
+        self.path = path
+        self.interval = interval
+        self.total = 0
+        self.counts = {outcome: 0 for outcome in _outcomes}
+        self.max_rss = get_peak_rss()
+        self._start = time.time()
+        self._last_progress = self._start
+        self._last_write = None
+        # times the recent (not skipped) points finished
+        self._recent = deque()
+
+    def add(self, n_points):
+        """`n_points` more points to get through"""
+        self.total += n_points
+
+    def completed(self, n_points=1):
+        self._finish('completed', n_points)
+
+    def failed(self, n_points=1):
+        self._finish('failed', n_points)
+
+    def skipped(self, n_points=1):
+        self._finish('skipped', n_points)
+
+    def retract(self, outcome, n_points=1):
+        """
+        Take back `n_points` that ended as `outcome`, for points that
+        are run again (and added again).
+        """
+        self.counts[outcome] -= n_points
+        self.total -= n_points
+
+    def add_rss(self, rss):
+        """memory use (in MB) of some worker"""
+        self.max_rss = max(self.max_rss, rss)
+
+    def throughput(self, now=None):
+        """points per second over the last few minutes (not skipped)"""
+        now = now or time.time()
+        while self._recent and self._recent[0] < now - _window:
+            self._recent.popleft()
+        elapsed = min(now - self._start, _window)
+        if elapsed <= 0:
+            return 0.0
+        return len(self._recent) / elapsed
+
+    def eta(self, now=None):
+        """seconds until all the points are done, None if unknown"""
+        remaining = self.total - sum(self.counts.itervalues())
+        if remaining <= 0:
+            return 0.0
+        rate = self.throughput(now)
+        return remaining / rate if rate > 0 else None
+
+    def finish(self):
+        """write the final status"""
+        self._write(time.time(), finished=True)
+
+    def get_status(self, now=None, finished=False):
+        now = now or time.time()
+        self.max_rss = max(self.max_rss, get_peak_rss())
+        status = {
+            'run': self.run,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'finished': finished,
+            'total': self.total,
+            'started': self._start,
+            'updated': now,
+            'last_progress': self._last_progress,
+            'throughput': self.throughput(now),
+            'eta': self.eta(now),
+            'max_rss_mb': self.max_rss,
+            }
+        status.update(self.counts)
+        return status
+
+    def _finish(self, outcome, n_points):
+        now = time.time()
+        self.counts[outcome] += n_points
+        self._last_progress = now
+        if outcome != 'skipped':
+            self._recent.extend([now] * n_points)
+        last = self._last_write
+        if last is None or now - last >= self.interval:
+            self._write(now)
+
+    def _write(self, now, finished=False):
+        self._last_write = now
+        status = self.get_status(now, finished)
+        print _progress_line(status)
+        if not self.path:
+            return
+        if self.path.endswith('.prom'):
+            text = _prometheus_text(status)
+        else:
+            text = json.dumps(status, indent=2, sort_keys=True) + '\n'
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as tmp:
+            tmp.write(text)
+        os.rename(tmp_path, self.path)
+
+def _progress_line(status):
+    n_done = sum(status[outcome] for outcome in _outcomes)
+    eta = status['eta']
+    eta_str = 'unknown' if eta is None else _duration(eta)
+    return ('{run}: {n_done} of {total} points ({completed} done, '
+            '{failed} failed, {skipped} skipped), {throughput:.2f} per '
+            'second, ETA {eta_str}, max RSS {max_rss_mb:.0f} MB').format(
+        n_done=n_done, eta_str=eta_str, **status)
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+# name, type, help, status key
+_metrics = [
+    ('points_expected', 'gauge', 'points in the run', 'total'),
+    ('throughput_points_per_second', 'gauge',
+     'points finished per second over the last few minutes', 'throughput'),
+    ('eta_seconds', 'gauge', 'estimated time to finish the run', 'eta'),
+    ('max_rss_megabytes', 'gauge',
+     'largest resident memory of the run or its workers', 'max_rss_mb'),
+    ('start_timestamp_seconds', 'gauge', 'when the run started', 'started'),
+    ('last_progress_timestamp_seconds', 'gauge',
+     'when a point last finished', 'last_progress'),
+    ('finished', 'gauge', '1 if the run is over', 'finished'),
+    ]
+
+def _prometheus_text(status):
+    labels = 'run="{}",host="{}",pid="{}"'.format(
+        status['run'], status['host'], status['pid'])
+    lines = [
+        '# HELP susyfit_points points finished, by outcome',
+        '# TYPE susyfit_points gauge']
+    for outcome in _outcomes:
+        lines.append('susyfit_points{{{},outcome="{}"}} {}'.format(
+                labels, outcome, status[outcome]))
+    for name, metric_type, help_text, key in _metrics:
+        value = status[key]
+        value = 'NaN' if value is None else repr(float(value))
+        lines += [
+            '# HELP susyfit_{} {}'.format(name, help_text),
+            '# TYPE susyfit_{} {}'.format(name, metric_type),
+            'susyfit_{}{{{}}} {}'.format(name, labels, value)]
+    return '\n'.join(lines) + '\n'
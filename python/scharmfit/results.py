@@ -0,0 +1,72 @@
+"""
+Persistent store for fit results.
+
+Results are saved in an sqlite database as soon as each fit finishes,
+keyed by a hash of the workspace file and the calculator settings. A
+fit campaign that crashes (or gets killed) can be restarted, and only
+the points that are missing get refit.
+"""
+
+import sqlite3, json, time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS results (
+    workspace_hash TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    config TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (workspace_hash, settings)
+)
+"""
+
+class ResultStore(object):
+    """
+    Wrapper on an sqlite database of fit results. The `settings` should
+    be a dict of everything that changes the result (calculator type,
+    number of toys, etc). Results are dicts of anything json can store,
+    and come back with `str` rather than `unicode` strings.
+    """
+    def __init__(self, path):
+        # long timeout in case several campaigns share a database
+        self._conn = sqlite3.connect(path, timeout=60)
+        with self._conn:
+            self._conn.execute(_schema)
+
+    def get(self, workspace_hash, settings):
+        """return the saved result, or None if there isn't one"""
+        row = self._conn.execute(
+            'SELECT result FROM results '
+            'WHERE workspace_hash = ? AND settings = ?',
+            (workspace_hash, _dump(settings))).fetchone()
+        if row is None:
+            return None
+        return _load(row[0])
+
+    def put(self, workspace_hash, settings, workspace, config, result):
+        """save a result (committed right away)"""
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (workspace_hash, _dump(settings), workspace, config,
+                 _dump(result), time.time()))
+
+    def close(self):
+        self._conn.close()
+
+def _dump(obj):
+    return json.dumps(obj, sort_keys=True)
+
+def _load(text):
+    # json gives back unicode, which yaml would write out as such
+    return _to_str(json.loads(text))
+
+def _to_str(obj):
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    if isinstance(obj, list):
+        return [_to_str(item) for item in obj]
+    if isinstance(obj, dict):
+        return {_to_str(k): _to_str(v) for k, v in obj.iteritems()}
+    return obj
@@ -0,0 +1,108 @@
+"""
+Synthetic yields, in the same form as the yields files read by the
+fit scripts (see `example_data/yields.yml`), for benchmarks.
+
+The yields are random but reproducible for a given seed. The first
+region is the signal region, the others are control regions. Every
+region has every background and signal point, and every yield
+systematic varies every sample. The relative systematics use the
+short form (one variation for a whole region).
+"""
+
+import random, math
+
+# name of the signal region, the control regions are cr_0, cr_1, ...
+_signal_region = 'signal'
+# relative size of the statistical errors
+_stat_error = 0.05
+# largest relative variation from a systematic
+_max_variation = 0.2
+# the lightest scharm, and the spacing of the mass grid
+_min_scharm = 200
+_mass_step = 50
+
+def make_yields(n_regions=4, n_backgrounds=4, n_yield_systs=4,
+                n_relative_systs=2, n_signal_points=10, seed=1):
+    """
+    Returns a yields dict, as `yaml.load` would give for a yields file.
+    The yield systematics are called `yieldN` (with `up` and `down`
+    variations), the relative ones `relativeN`.
+    """
+    rand = random.Random(seed)
+    regions = _region_names(n_regions)
+    backgrounds = ['bg{}'.format(num) for num in xrange(n_backgrounds)]
+    signal_points = _signal_points(n_signal_points)
+
+    nominal = {}
+    for region in regions:
+        procs = {}
+        for bg in backgrounds:
+            procs[bg] = _with_error(rand.uniform(1.0, 100.0))
+        total = sum(yld for yld, _ in procs.itervalues())
+        # signal is small outside the signal region
+        sig_scale = 20.0 if region == _signal_region else 1.0
+        for sp in signal_points:
+            procs[sp] = _with_error(sig_scale * rand.uniform(0.1, 1.0))
+        count = max(round(rand.gauss(total, math.sqrt(total))), 0.0)
+        procs['data'] = [count]
+        nominal[region] = procs
+
+    yield_systs = {}
+    for num in xrange(n_yield_systs):
+        name = 'yield{}'.format(num)
+        for direction in [1, -1]:
+            suffix = 'up' if direction > 0 else 'down'
+            yield_systs[name + suffix] = {
+                region: {
+                    proc: [yld[0] * (1 + direction * rand.uniform(
+                                0, _max_variation))]
+                    for proc, yld in procs.iteritems() if proc != 'data'}
+                for region, procs in nominal.iteritems()}
+
+    relative_systs = {}
+    for num in xrange(n_relative_systs):
+        relative_systs['relative{}'.format(num)] = {
+            region: [1 - rand.uniform(0, _max_variation),
+                     1 + rand.uniform(0, _max_variation)]
+            for region in regions}
+
+    return {
+        'nominal_yields': nominal,
+        'yield_systematics': yield_systs,
+        'relative_systematics': relative_systs,
+        }
+
+def make_fit_config(yields):
+    """fit configuration using every region and systematic in `yields`"""
+    regions = sorted(yields['nominal_yields'])
+    syst_names = {name.rsplit('up', 1)[0] for name in
+                  yields['yield_systematics'] if name.endswith('up')}
+    syst_names |= set(yields['relative_systematics'])
+    backgrounds = sorted({
+            proc for procs in yields['nominal_yields'].itervalues()
+            for proc in procs if proc.startswith('bg')})
+    return {
+        'signal_regions': [_signal_region],
+        'control_regions': [reg for reg in regions if reg != _signal_region],
+        'validation_regions': [],
+        'fixed_backgrounds': backgrounds[-1:],
+        'systematics': sorted(syst_names),
+        'signal_systematics': [],
+        }
+
+def _region_names(n_regions):
+    controls = ['cr_{}'.format(num) for num in xrange(n_regions - 1)]
+    return [_signal_region] + controls
+
+def _signal_points(n_points):
+    """the first `n_points` of a (scharm, lsp) grid, lightest first"""
+    points = []
+    scharm = _min_scharm
+    while len(points) < n_points:
+        for lsp in xrange(0, scharm - _mass_step, _mass_step):
+            points.append('scharm-{}-{}'.format(scharm, lsp))
+        scharm += _mass_step
+    return points[:n_points]
+
+def _with_error(yld):
+    return [yld, yld * _stat_error]
@@ -0,0 +1,236 @@
+"""
+Dense array storage for the systematic variations used in a fit.
+
+HistFactory wants every systematic as a relative (down, up) variation
+on each sample. The inputs give them either as varied absolute yields
+(`yield_systematics`) or directly as relative variations
+(`relative_systematics`). `SystematicsTable` converts everything to
+relative variations stored in one (region, process, systematic,
+{down, up}) array, so the conversion is done with a few array
+operations rather than a loop over every entry.
+
+Every fit configuration goes through this table, so numpy is needed
+to book and fit the HistFactory workspaces, not only for the counting
+backend.
+"""
+
+import numpy as np
+
+_asym_suffix_up = 'up'
+_asym_suffix_down = 'down'
+
+class SystematicsTable(object):
+    """
+    Relative systematic variations, indexed by the names in `regions`,
+    `processes`, and `names` (all sorted):
+
+     - `variations`: (region, process, systematic, {down, up}), NaN
+       where one side of an asymmetric variation is missing.
+     - `present`: (region, process, systematic) mask of the entries
+       that are set.
+     - `sigsyst_sumsq`: (region, process, {down, up}) sum of squares
+       of the signal theory variations, with `sigsyst_present` as mask.
+
+    Takes the nominal yields, the (already filtered) yield systematics
+    and relative systematics, the processes to apply region-wide
+    relative systematics to, and the signal theory systematics (a
+    {systematic: {region: {process: (down, up)}}} dict).
+    """
+    def __init__(self, base_yields, yield_systematics, rel_systematics,
+                 all_proc, signal_systematics={}):
+        sym, asym = split_systematics(yield_systematics)
+        names = set(sym) | set(asym) | set(rel_systematics)
+        regions, processes = set(base_yields), set(all_proc)
+        for procdict in base_yields.itervalues():
+            processes.update(procdict)
+        for regdict in _chain_values(rel_systematics, signal_systematics):
+            regions.update(regdict)
+            for procdict in regdict.itervalues():
+                if isinstance(procdict, dict):
+                    processes.update(procdict)
+        processes.discard('data')
+        self.regions = sorted(regions)
+        self.processes = sorted(processes)
+        self.names = sorted(names)
+        self._reg_idx = _index(self.regions)
+        self._proc_idx = _index(self.processes)
+        self._name_idx = _index(self.names)
+
+        shape = (len(self.regions), len(self.processes), len(self.names))
+        self.variations = np.full(shape + (2,), np.nan)
+        self.present = np.zeros(shape, dtype=bool)
+        self._add_yield_systematics(base_yields, yield_systematics, sym, asym)
+        self._add_rel_systematics(rel_systematics, all_proc)
+        self._add_signal_systematics(signal_systematics)
+
+    # ____________________________________________________________________
+    # building routines (called by the constructor)
+
+    def _add_yield_systematics(self, base_yields, yield_systematics,
+                               sym, asym):
+        """convert absolute variations to relative ones"""
+        nominal = self._region_array(base_yields)
+        has_nominal = ~np.isnan(nominal)
+        def varied(syst):
+            return self._region_array(yield_systematics[syst])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for syst in sym:
+                var = varied(syst)
+                present = has_nominal & ~np.isnan(var)
+                # cut in half because it's symmetric
+                rel = (var / nominal - 1.0) / 2.0
+                self._set(syst, present, 1 - rel, 1 + rel)
+
+            for syst in asym:
+                down = varied(syst + _asym_suffix_down)
+                up = varied(syst + _asym_suffix_up)
+                present = has_nominal & ~(np.isnan(down) & np.isnan(up))
+                self._set(syst, present, down / nominal, up / nominal)
+
+        # the division above doesn't complain about zero yields
+        zero = self.present.any(axis=2) & (nominal == 0)
+        if zero.any():
+            rnum, pnum = np.argwhere(zero)[0]
+            raise ZeroDivisionError(
+                'systematic variation on zero yield for {} in {}'.format(
+                    self.processes[pnum], self.regions[rnum]))
+
+    def _add_rel_systematics(self, rel_systematics, all_proc):
+        """add relative systematics, throw an exception on overwrite"""
+        all_proc_idx = [self._proc_idx[p] for p in all_proc if p != 'data']
+        for syst, regdict in rel_systematics.iteritems():
+            snum = self._name_idx[syst]
+            for region, procdict in regdict.iteritems():
+                rnum = self._reg_idx[region]
+                # we allow a list to be passed to the region directly
+                # in which case it's applied to all processes
+                if not isinstance(procdict, dict):
+                    if not len(procdict) == 2:
+                        raise ValueError(
+                            '{} not an up / down pair'.format(procdict))
+                    self.variations[rnum, all_proc_idx, snum] = procdict
+                    self.present[rnum, all_proc_idx, snum] = True
+                    continue
+                for proc, downup in procdict.iteritems():
+                    pnum = self._proc_idx[proc]
+                    if self.present[rnum, pnum, snum]:
+                        raise ValueError('tried to overwrite systematic')
+                    self.variations[rnum, pnum, snum] = downup
+                    self.present[rnum, pnum, snum] = True
+
+    def _add_signal_systematics(self, signal_systematics):
+        """
+        Sum the squares of the signal theory variations. We're assuming
+        the systematics aren't correlated (and using linear error prop).
+        """
+        shape = (len(self.regions), len(self.processes))
+        self.sigsyst_sumsq = np.zeros(shape + (2,))
+        self.sigsyst_present = np.zeros(shape, dtype=bool)
+        for syst, regdict in signal_systematics.iteritems():
+            downup = np.full(shape + (2,), np.nan)
+            for region, procdict in regdict.iteritems():
+                rnum = self._reg_idx[region]
+                for proc, vals in procdict.iteritems():
+                    downup[rnum, self._proc_idx[proc]] = vals
+            present = ~np.isnan(downup[:,:,0])
+            delta_sq = np.where(present[:,:,None], (downup - 1)**2, 0.0)
+            self.sigsyst_sumsq += delta_sq
+            self.sigsyst_present |= present
+
+    def _region_array(self, regdict):
+        """(region, process) array of yields, NaN if missing"""
+        out = np.full((len(self.regions), len(self.processes)), np.nan)
+        proc_idx = self._proc_idx
+        rows, cols, values = [], [], []
+        for region, procdict in regdict.iteritems():
+            rnum = self._reg_idx.get(region)
+            if rnum is None:
+                continue
+            for proc, vals in procdict.iteritems():
+                if proc in proc_idx:
+                    rows.append(rnum)
+                    cols.append(proc_idx[proc])
+                    values.append(vals[0])
+        out[rows, cols] = values
+        return out
+
+    def _set(self, syst, present, down, up):
+        snum = self._name_idx[syst]
+        self.present[:,:,snum] = present
+        self.variations[:,:,snum,0] = np.where(present, down, np.nan)
+        self.variations[:,:,snum,1] = np.where(present, up, np.nan)
+
+    # ____________________________________________________________________
+    # access
+
+    def get_variations(self, region, process):
+        """
+        Return a list of (systematic, down, up) for one sample. A
+        missing side of an asymmetric variation is given as None.
+        """
+        rnum = self._reg_idx.get(region)
+        pnum = self._proc_idx.get(process)
+        if rnum is None or pnum is None:
+            return []
+        out = []
+        for snum in np.flatnonzero(self.present[rnum, pnum]):
+            down, up = self.variations[rnum, pnum, snum].tolist()
+            out.append((self.names[snum], _none_if_nan(down),
+                        _none_if_nan(up)))
+        return out
+
+    def get_sigsyst_sumsq(self, region, process, sign):
+        """
+        Sum of squares of the signal theory variations for one sample,
+        in the down (`sign` < 0) or up direction.
+        """
+        rnum = self._reg_idx[region]
+        pnum = self._proc_idx[process]
+        if not self.sigsyst_present[rnum, pnum]:
+            raise KeyError((region, process))
+        return float(self.sigsyst_sumsq[rnum, pnum, int(sign > 0)])
+
+    def get_index(self, regions, processes):
+        """
+        Index arrays to pick (regions x processes) out of the arrays,
+        -1 where the region or process isn't in the table.
+        """
+        reg = np.array([self._reg_idx.get(r, -1) for r in regions])
+        proc = np.array([self._proc_idx.get(p, -1) for p in processes])
+        return reg, proc
+
+# __________________________________________________________________________
+# helpers
+
+def split_systematics(systematics):
+    """
+    Split into symmetric and asymmetric vairations and return a tuple
+    (symmetric, asymmetric).
+    Works by finding the systematics with an "up" and "down" suffix,
+    and calling these asymmetric.
+    """
+    asym = set()
+    for sys in systematics:
+        if sys.endswith(_asym_suffix_up):
+            stem = sys[:-len(_asym_suffix_up)]
+            if stem + _asym_suffix_down in systematics:
+                asym.add(stem)
+
+    asym_variations = set()
+    for sys in asym:
+        asym_variations.add(sys + _asym_suffix_down)
+        asym_variations.add(sys + _asym_suffix_up)
+    sym_systematics = set(systematics) - asym_variations
+    return sym_systematics, asym
+
+def _chain_values(*dicts):
+    for dic in dicts:
+        for value in dic.itervalues():
+            yield value
+
+def _index(names):
+    return {name: num for num, name in enumerate(names)}
+
+def _none_if_nan(value):
+    return None if value != value else value
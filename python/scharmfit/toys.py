@@ -0,0 +1,108 @@
+"""
+Toy based CLs from test statistic distributions generated in pieces.
+
+RooStats generates all the toys for a hypothesis test in one process.
+To spread them over several processes, the toys are split into chunks
+of a fixed size, and each chunk gets its own random seed, derived from
+a base seed and whatever identifies the test (workspace, signal
+strength). The results only depend on the base seed and the number of
+toys, not on how many processes ran them or in what order they
+finished.
+
+The chunks give back the sampled test statistics, which are merged
+here and turned into the observed and expected CLs values. Nothing
+here depends on ROOT.
+"""
+
+import hashlib, json, bisect, math
+
+# toys generated with one seed
+_toys_per_chunk = 200
+# the ROOT generators take a 32 bit seed, and 0 means "random"
+_max_seed = 2**31 - 1
+
+def chunk_seeds(seed, key, n_toys, chunk_size=_toys_per_chunk):
+    """
+    Split `n_toys` into chunks, return a list of (seed, n_toys) for
+    each chunk. The seeds are a hash of the base `seed`, the (json-able)
+    `key`, and the chunk number.
+    """
+    chunks = []
+    for number, first in enumerate(xrange(0, n_toys, chunk_size)):
+        digest = hashlib.sha1(json.dumps([seed, key, number])).hexdigest()
+        chunk_seed = int(digest, 16) % _max_seed + 1
+        chunks.append((chunk_seed, min(chunk_size, n_toys - first)))
+    return chunks
+
+class TestStatDist(object):
+    """
+    Weighted sample of a test statistic. Larger values are less
+    compatible with the hypothesis, so p-values are right tail
+    integrals.
+    """
+    def __init__(self, values=(), weights=None):
+        if weights is None:
+            weights = [1.0] * len(values)
+        pairs = sorted(zip(values, weights))
+        self.values = [val for val, _ in pairs]
+        self.weights = [wt for _, wt in pairs]
+        # weight at or above each value
+        self._tail = []
+        total = 0.0
+        for wt in reversed(self.weights):
+            total += wt
+            self._tail.append(total)
+        self._tail.reverse()
+        self.total = total
+
+    @classmethod
+    def merged(cls, dists):
+        """combine several samples into one"""
+        values, weights = [], []
+        for dist in dists:
+            values += dist.values
+            weights += dist.weights
+        return cls(values, weights)
+
+    def __len__(self):
+        return len(self.values)
+
+    def p_value(self, test_stat):
+        """fraction of the sample at or above `test_stat`"""
+        if not self.total:
+            return 0.0
+        first = bisect.bisect_left(self.values, test_stat)
+        if first == len(self.values):
+            return 0.0
+        return self._tail[first] / self.total
+
+def toy_cls(null, alt, observed):
+    """
+    Returns a dict of CLs values (keyed like the calculators do) from
+    the `null` (signal plus background) and `alt` (background only)
+    `TestStatDist`s, and the `observed` test statistic. The expected
+    values are quantiles of the CLs each background only toy would
+    give, with positive sigma for weaker exclusion.
+    """
+    def cls(test_stat):
+        clb = alt.p_value(test_stat)
+        return null.p_value(test_stat) / clb if clb > 0 else 1.0
+    toy_values = sorted(zip([cls(ts) for ts in alt.values], alt.weights))
+    def expected(nsig):
+        target = 0.5 * (1 + math.erf(nsig / math.sqrt(2))) * alt.total
+        running = 0.0
+        for value, weight in toy_values:
+            running += weight
+            if running >= target:
+                return value
+        return toy_values[-1][0]
+    if not toy_values:
+        raise ValueError("can't calculate expected CLs without toys")
+    return {
+        'obs': cls(observed),
+        'exp': expected(0),
+        'exp_u1s': expected(1),
+        'exp_d1s': expected(-1),
+        'exp_u2s': expected(2),
+        'exp_d2s': expected(-2),
+        }
@@ -40,6 +40,32 @@ def load_susyfit(use_histfitter_version=False):
     with OutputFilter(accept_re='ERROR'):
         ROOT.gSystem.Load('{}/libSusyFitter.so'.format(lib_path))
 
+# libSusyFitter only times its fits if this is set (to anything but 0)
+_timing_env = 'SUSYFIT_TIMING'
+
+def fit_timing_enabled():
+    return os.environ.get(_timing_env, '0') not in {'', '0'}
+
+def get_fit_timing(reset=True):
+    """
+    Timers and counters from libSusyFitter since the last reset, as
+    {'phases': {phase: {'calls', 'wall', 'cpu'}}, 'counters': {...}}.
+    Returns None unless timing is enabled. Only covers fits in this
+    process, not in any workers.
+    """
+    if not fit_timing_enabled():
+        return None
+    import ROOT, json
+    timing = json.loads(str(ROOT.FitTimer.Report()))
+    if reset:
+        ROOT.FitTimer.Reset()
+    return timing
+
+def reset_fit_timing():
+    if fit_timing_enabled():
+        import ROOT
+        ROOT.FitTimer.Reset()
+
 
 class OutputFilter(object):
     """
@@ -48,55 +74,140 @@ class OutputFilter(object):
      - accept_strings: print any lines that match any of these
      - accept_re: print any lines that match this regex
      - veto_strings: veto any lines that match these strings
+     - discard: throw everything away, even if there's an exception.
+       This is much cheaper, use it to wrap calls that happen a lot.
+
+    The output is captured in one in-memory file per process, which is
+    reused every time a filter is entered (filters can be nested).
     """
     def __init__(self, veto_strings={'TClassTable'}, accept_strings={},
-                 accept_re=''):
-        self.veto_words = set(veto_strings)
-        self.accept_words = set(accept_strings)
-        self.temp = tempfile.NamedTemporaryFile()
-        if accept_re:
-            self.re = re.compile(accept_re)
-        else:
-            self.re = None
+                 accept_re='', discard=False):
+        self._discard = discard
+        self._pattern = _get_line_pattern(
+            veto_strings, accept_strings, accept_re)
     def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if self._discard:
+            target = _get_null_fd()
+        else:
+            self._capture = _get_capture()
+            target = self._capture.fd
+            self._start = os.lseek(target, 0, os.SEEK_CUR)
         self.old_out, self.old_err = os.dup(1), os.dup(2)
-        os.dup2(self.temp.fileno(), 1)
-        os.dup2(self.temp.fileno(), 2)
+        os.dup2(target, 1)
+        os.dup2(target, 2)
     def __exit__(self, exe_type, exe_val, tb):
         sys.stdout.flush()
         sys.stderr.flush()
+        _flush_c_streams()
         os.dup2(self.old_out, 1)
         os.dup2(self.old_err, 2)
         os.close(self.old_out)
         os.close(self.old_err)
-        self.temp.seek(0)
+        if self._discard:
+            return False
+        text = self._capture.pop(self._start)
 
         # dump everything if an exception was thrown
         if exe_type is not None:
-            for line in self.temp:
-                sys.stderr.write(line)
+            sys.stderr.write(text)
             return False
 
         # if no exception is thrown only dump important lines
-        for line in self.temp:
-            if self._should_veto(line):
-                continue
-            accept = self._should_accept(line)
-            if self.re is not None:
-                re_found = self.re.search(line)
-            else:
-                re_found = False
-            if accept or re_found:
-                sys.stderr.write(line)
-
-    def _should_accept(self, line):
-        for phrase in self.accept_words:
-            if phrase in line:
-                return True
-        return False
-
-    def _should_veto(self, line):
-        for veto in self.veto_words:
-            if veto in line:
-                return True
-        return False
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                sys.stderr.write(match.group(0))
+
+def _get_line_pattern(veto_strings, accept_strings, accept_re):
+    """
+    Build one regex that matches full lines which contain an accepted
+    string (or match `accept_re`) and none of the vetoed strings.
+    Returns None if nothing can be accepted.
+    """
+    accept = [re.escape(s) for s in accept_strings]
+    if accept_re:
+        accept.append(accept_re)
+    if not accept:
+        return None
+    veto = '|'.join(re.escape(s) for s in veto_strings)
+    veto_check = '(?!.*(?:{}))'.format(veto) if veto else ''
+    line = r'^{}.*(?:{}).*\n?'.format(veto_check, '|'.join(accept))
+    return re.compile(line, re.MULTILINE)
+
+# __________________________________________________________________________
+# per-process state for OutputFilter
+
+class _CaptureFile(object):
+    """
+    In-memory file to collect output. fds 1 and 2 are pointed to this
+    file, so they share its offset: everything written since a filter
+    was entered sits between the offset at entry and the current one.
+    """
+    def __init__(self):
+        self.pid = os.getpid()
+        self.fd = _memfd('scharmfit-output')
+        if self.fd is None:
+            # no memfd, an unlinked temporary file is the next best thing
+            self._file = tempfile.TemporaryFile()
+            self.fd = self._file.fileno()
+
+    def pop(self, start):
+        """return everything written after `start`, and remove it"""
+        end = os.lseek(self.fd, 0, os.SEEK_CUR)
+        os.lseek(self.fd, start, os.SEEK_SET)
+        chunks = []
+        remaining = end - start
+        while remaining > 0:
+            chunk = os.read(self.fd, remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        os.ftruncate(self.fd, start)
+        os.lseek(self.fd, start, os.SEEK_SET)
+        return ''.join(chunks)
+
+_capture = None
+_null_fd = None
+_libc = None
+
+def _get_capture():
+    global _capture
+    # forked processes share the file offset, they need their own file
+    if _capture is None or _capture.pid != os.getpid():
+        _capture = _CaptureFile()
+    return _capture
+
+def _get_null_fd():
+    global _null_fd
+    if _null_fd is None:
+        _null_fd = os.open(os.devnull, os.O_WRONLY)
+    return _null_fd
+
+def _memfd(name):
+    """create an anonymous in-memory file, return None if we can't"""
+    try:
+        libc = _get_libc()
+        memfd_create = libc.memfd_create
+    except (OSError, AttributeError):
+        return None
+    fd = memfd_create(name, 1)  # MFD_CLOEXEC
+    return fd if fd >= 0 else None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        import ctypes
+        _libc = ctypes.CDLL(None)
+    return _libc
+
+def _flush_c_streams():
+    """
+    C stdio is fully buffered when it isn't writing to a terminal, flush
+    it so that output from compiled code ends up in the right place.
+    """
+    try:
+        _get_libc().fflush(None)
+    except (OSError, AttributeError):
+        pass
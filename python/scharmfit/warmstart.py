@@ -0,0 +1,40 @@
+"""
+Starting values for fits, taken from neighbouring signal points.
+
+Neighbouring (scharm, LSP) mass points have almost the same best fit
+nuisance parameters and background normalisations, so a fit started
+from a finished neighbour's values needs fewer Minuit iterations (and
+fails less often) than one started from the workspace defaults.
+
+The fitted values are kept as {parameter name: value} dicts, which
+both backends can read and which can be sent to worker processes.
+"""
+
+import math
+
+class FitSeeds(object):
+    """
+    Best fit parameters of the points fit so far, by configuration.
+    Points in different configurations have different models, so they
+    never seed each other.
+    """
+    def __init__(self):
+        self._points = {}       # config: {(scharm, lsp): parameters}
+
+    def add(self, config, mass_point, parameters):
+        """save the fitted `parameters` for a (scharm, lsp) mass point"""
+        if parameters:
+            self._points.setdefault(config, {})[mass_point] = parameters
+
+    def closest(self, config, mass_point):
+        """
+        returns the parameters of the closest point in mass space, or
+        None if nothing in this configuration has been fit yet
+        """
+        points = self._points.get(config)
+        if not points:
+            return None
+        def distance(other):
+            return math.hypot(other[0] - mass_point[0],
+                              other[1] - mass_point[1])
+        return points[min(points, key=distance)]
@@ -4,9 +4,12 @@ statistical analyiss stuff is done elsewhere.
 """
 
 from scharmfit.utils import OutputFilter
+from scharmfit.profiling import stage
+from scharmfit.systematics import SystematicsTable
+from scharmfit.systematics import _asym_suffix_up, _asym_suffix_down
 import os, re, glob, math
 from os.path import isdir, join, basename
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
 import warnings
 from itertools import chain, product
 
@@ -41,6 +44,119 @@ _relative_systematics_key = 'relative_systematics'
 # workspace
 DISCOVERY = 'discovery'
 
+# name of the signal theory systematic, when it's added as a nuisance
+# parameter (HistFactory calls the parameter `alpha_<name>`)
+SIGNAL_THEORY_NP = 'SigTheory'
+
+class FitInputs(object):
+    """
+    The ROOT-free part of setting up a fit: combines backgrounds,
+    converts all the systematics to relative ones, and figures out the
+    signal theory systematics. This only depends on the yields and the
+    fit configuration, so it can be shared by anything that builds a
+    likelihood for the configuration.
+    """
+    # input file schema
+    baseline_yields_key = _baseline_yields_key
+    yield_systematics_key = _yield_systematics_key
+    relative_systematics_key = _relative_systematics_key
+
+    def __init__(self, yields, fit_config, misc_config):
+        self.fixed_backgrounds = fit_config['fixed_backgrounds']
+
+        # load yields, only the requested systematics are combined (and
+        # looked up, which matters for the cached yields)
+        yields = _combine_backgrounds(
+            yields, fit_config.get('combined_backgrounds',{}),
+            fit_config['systematics'])
+        self.yields = yields[self.baseline_yields_key]
+
+        # load systematics and save list of backgrounds
+        all_sp, backgrounds = get_signal_points_and_backgrounds(yields)
+        _check_subset(fit_config['fixed_backgrounds'], backgrounds)
+        self._load_systematics(
+            yields, fit_config, misc_config, all_sp + backgrounds)
+        self.backgrounds = backgrounds
+        self.signal_points = all_sp
+        self._load_signal_systs(misc_config)
+
+    def _load_systematics(self, yields, config, misc_config, all_proc):
+        """
+        called by initialize routine, handle all the organization
+        and storing of the systematic variations
+        """
+        # filter out unwanted systematics, anything missing from the
+        # yields is assumed to be entered as a relative systematic further
+        # down.
+        requested_syst = config['systematics']
+        yield_systematics, missing_syst = _filter_systematics(
+            yields[self.yield_systematics_key], requested_syst)
+        base_yields = yields[self.baseline_yields_key]
+
+        # HistFactory actually wants all the systematics as relative
+        # systematics, they are converted (and stored as arrays) by
+        # the `SystematicsTable`.
+        all_rel_systs = yields.get(self.relative_systematics_key, {})
+        rel_systs = _filter_rel_systematics(all_rel_systs, missing_syst)
+
+        # signal theory systematics, only needed for up / down variations
+        # or to add the theory nuisance parameter
+        sig_systs = OrderedDict()
+        use_sigsyst = misc_config['signal_systematic']
+        use_sigsyst = use_sigsyst or misc_config.get('signal_theory_np')
+        if use_sigsyst:
+            for syst in config.get('signal_systematics',[]):
+                sig_systs[syst] = all_rel_systs[syst]
+        self.has_sigsysts = bool(sig_systs)
+
+        with stage('systematics conversion'):
+            self.systematics = SystematicsTable(
+                base_yields, yield_systematics, rel_systs, all_proc,
+                sig_systs)
+
+    def _load_signal_systs(self, misc_config):
+        """load signal systematic direction from misc config"""
+        updown = misc_config['signal_systematic']
+        self.sigsyst_sign = {'up':1, 'down':-1}.get(updown, 0)
+
+    def get_rel_sigsyst(self, region, signal_point, sign=None):
+        """
+        return the relative systematic on the signal sample, `sign`
+        overrides the direction given in the misc config
+        """
+        if sign is None:
+            sign = self.sigsyst_sign
+        if sign:
+            sys2 = self.systematics.get_sigsyst_sumsq(
+                region, signal_point, sign)
+            return 1 + math.copysign(sys2**0.5, sign)
+        return 1
+
+    def get_sigsyst_range(self, region, signal_point):
+        """return the (down, up) signal theory variation"""
+        return tuple(
+            self.get_rel_sigsyst(region, signal_point, sign)
+            for sign in [-1, 1])
+
+class WorkspaceTemplate(object):
+    """
+    Holds everything that doesn't depend on the signal point, so that it
+    can be shared by all the workspaces booked for one fit configuration:
+    the preprocessed `FitInputs` and the HistFactory background samples
+    (which are created the first time they are needed).
+    """
+    def __init__(self, yields, fit_config, misc_config):
+        self.fit_config = fit_config
+        self.misc_config = misc_config
+        self.inputs = FitInputs(yields, fit_config, misc_config)
+        # keyed by (region, background)
+        self.background_samples = {}
+
+    def get_workspace(self):
+        """return a new (empty) workspace built from this template"""
+        return Workspace(
+            None, self.fit_config, self.misc_config, template=self)
+
 class Workspace(object):
     """
     Organizes the building of workspaces, mainly by providing functions to
@@ -65,24 +181,21 @@ class Workspace(object):
     # number and error are stored as first and second entry
     _nkey = 0                  # yield
     _errkey = 1                # stat error
-    def __init__(self, yields, fit_config, misc_config):
+    def __init__(self, yields, fit_config, misc_config, template=None):
         self._fixed_backgrounds = fit_config['fixed_backgrounds']
         self._setup_misc_config(misc_config)
 
-        # load yields
-        yields = _combine_backgrounds(
-            yields, fit_config.get('combined_backgrounds',{}))
-        self._yields = yields[self.baseline_yields_key]
-
-        # load systematics and save list of backgrounds
-        all_sp, backgrounds = get_signal_points_and_backgrounds(yields)
-        _check_subset(fit_config['fixed_backgrounds'], backgrounds)
-        self._load_systematics(yields, fit_config, all_sp + backgrounds)
-        self._backgrounds = backgrounds
-
-        # load in signal systematics
-        rel_yields = yields[self.relative_systematics_key]
-        self._load_signal_systs(rel_yields, fit_config, misc_config)
+        # load yields, systematics, and signal systematics. If we're
+        # given a template these are already loaded (and `yields` is
+        # ignored).
+        if template is None:
+            template = WorkspaceTemplate(yields, fit_config, misc_config)
+        self._inputs = template.inputs
+        self._bg_samples = template.background_samples
+        self._yields = self._inputs.yields
+        self._systematics = self._inputs.systematics
+        self._backgrounds = self._inputs.backgrounds
+        self._sigsyst_sign = self._inputs.sigsyst_sign
 
         # create / configure the measurement
         import ROOT
@@ -112,45 +225,10 @@ class Workspace(object):
         """setup the stuff passed via command line"""
         self._blinded = misc_config['blind']
         self._inject = misc_config['injection']
+        self._sigsyst_np = misc_config.get('signal_theory_np', False)
         self.debug = misc_config['debug']
         self._do_pseudodata = False
 
-    def _load_systematics(self, yields, config, all_proc):
-        """
-        called by initialize routine, handle all the organization
-        and storing of the systematic variations
-        """
-        # filter out unwanted systematics, anything missing from the
-        # yields is assumed to be entered as a relative systematic further
-        # down.
-        requested_syst = config['systematics']
-        yield_systematics, missing_syst = _filter_systematics(
-            yields[self.yield_systematics_key], requested_syst)
-        base_yields = yields[self.baseline_yields_key]
-
-        # HistFactory actually wants all the systematics as relative
-        # systematics, we convert them here.  the relative systematics
-        # are keyed as
-        # {region: {process:{systematic: (down, up), ...}, ... }, ...}
-        self._systematics = _get_relative_from_abs_systematics(
-            base_yields, yield_systematics)
-
-        # add the relative systematics
-        rel_systs = _filter_rel_systematics(
-            yields.get(self.relative_systematics_key, {}), missing_syst)
-        _update_with_relative_systematics(
-            self._systematics, rel_systs, all_proc)
-
-    def _load_signal_systs(self, rel_syst, fit_config, misc_config):
-        """
-        load signal systematics from relative systematics, fit config,
-        and misc config files.
-        """
-        siglist = fit_config.get('signal_systematics',[])
-        updown = misc_config['signal_systematic']
-        self._sigsysts = _get_signal_systematics(rel_syst, siglist, updown)
-        self._sigsyst_sign = {'up':1, 'down':-1}.get(updown, 0)
-
     # ____________________________________________________________________
     # top level methods to set control / signal regions
     def add_cr(self, cr):
@@ -159,7 +237,7 @@ class Workspace(object):
             self._pseudodata_regions.add(cr)
         else:
             data_count = self._yields[cr]['data']
-            with OutputFilter():
+            with OutputFilter(discard=True):
                 chan.SetData(data_count[self._nkey])
         # ACHTUNG: not at all sure what this does
         # chan.SetStatErrorConfig(0.05, "Gaussian")
@@ -181,7 +259,7 @@ class Workspace(object):
         else:
             # print 'unblind!'
             data_count = self._yields[sr]['data']
-            with OutputFilter():
+            with OutputFilter(discard=True):
                 chan.SetData(data_count[self._nkey])
         # don't fit the SR if this is a BG only fit
         if fit:
@@ -215,39 +293,35 @@ class Workspace(object):
         if sp == DISCOVERY:
             if is_sr:
                 sname = '_'.join([self._signal_point,region])
-                signal = self.hf.Sample(sname)
-                _set_value(signal, 1.0, 0.0)
+                signal, = _make_samples(self.hf, [sname], [1.0], [0.0])
                 signal.SetNormalizeByTheory(True)
                 signal.AddNormFactor('mu_Sig',1,0,100)
                 chan.AddSample(signal)
         elif sp and sp in self._yields[region]:
             self._add_signal_to_channel(chan, region)
 
-        for bg in self._backgrounds:
-            self._add_background_to_channel(chan, region, bg)
+        self._add_backgrounds_to_channel(chan, region)
 
     def _get_rel_sigsyst(self, region):
         """return the relative systematic on the signal sample"""
-        if self._sigsyst_sign:
-            sys2 = self._sigsysts[region,self._signal_point]
-            return 1 + math.copysign(sys2**0.5, self._sigsyst_sign)
-        return 1
+        return self._inputs.get_rel_sigsyst(region, self._signal_point)
 
     def _add_signal_to_channel(self, chan, region):
         """should be called by _add_mc_to_channel"""
         # get yield / stat error in SR
         yields = self._yields
 
-        # If we're this far, we can create the signal sample
-        sname = '_'.join([self._signal_point,region])
-        signal = self.hf.Sample(sname)
-
         # I've kept the _nkey, and _errkey variables so it's easy to
         # change over to a dictionary. For now they are list indices.
         sig_yield = yields[region][self._signal_point]
         sig_syst = self._get_rel_sigsyst(region)
         signal_count = sig_yield[self._nkey] * sig_syst
-        _set_value(signal, signal_count, sig_yield[self._errkey] * sig_syst)
+
+        # If we're this far, we can create the signal sample
+        sname = '_'.join([self._signal_point,region])
+        signal, = _make_samples(
+            self.hf, [sname], [signal_count],
+            [sig_yield[self._errkey] * sig_syst])
 
         if self._inject:
             self._region_sums[region] += signal_count
@@ -263,21 +337,45 @@ class Workspace(object):
         signal.AddNormFactor('mu_Sig',1,0,2)
 
         # --- add systematics ---
-        syst_dict = self._systematics[region][self._signal_point]
-        for syst, var in syst_dict.iteritems():
-            signal.AddOverallSys(syst, *var)
+        sp = self._signal_point
+        for syst, down, up in self._systematics.get_variations(region, sp):
+            signal.AddOverallSys(syst, down, up)
+        # the CLs calculator fixes this to 0 or +-1
+        if self._sigsyst_np and self._inputs.has_sigsysts:
+            down, up = self._inputs.get_sigsyst_range(region, sp)
+            signal.AddOverallSys(SIGNAL_THEORY_NP, down, up)
 
         chan.AddSample(signal)
 
-    def _add_background_to_channel(self, chan, region, bg):
-        base_vals = self._yields[region].get(bg, [0.0, 0.0])
-        bg_n = base_vals[self._nkey]
-        # region sums are needed for blinded results
-        self._region_sums[region] += bg_n
-        sname = '_'.join([region,bg])
-        background = self.hf.Sample(sname)
-        _set_value(background, bg_n, base_vals[self._errkey])
-
+    def _add_backgrounds_to_channel(self, chan, region):
+        reg_yields = self._yields[region]
+        for bg in self._backgrounds:
+            # region sums are needed for blinded results
+            self._region_sums[region] += reg_yields.get(bg, [0.0])[self._nkey]
+
+        # The channel keeps a copy of the sample, so the same
+        # background samples can be added to every workspace.
+        missing = [
+            bg for bg in self._backgrounds
+            if (region, bg) not in self._bg_samples]
+        if missing:
+            self._make_backgrounds(region, missing)
+        for bg in self._backgrounds:
+            chan.AddSample(self._bg_samples[region, bg])
+
+    def _make_backgrounds(self, region, backgrounds):
+        """create the samples for `backgrounds` (all at once)"""
+        counts = [
+            self._yields[region].get(bg, [0.0, 0.0]) for bg in backgrounds]
+        samples = _make_samples(
+            self.hf, ['_'.join([region,bg]) for bg in backgrounds],
+            [vals[self._nkey] for vals in counts],
+            [vals[self._errkey] for vals in counts])
+        for bg, background in zip(backgrounds, samples):
+            self._configure_background(region, bg, background)
+            self._bg_samples[region, bg] = background
+
+    def _configure_background(self, region, bg, background):
         if not bg in self._fixed_backgrounds:
             background.AddNormFactor('mu_{}'.format(bg), 1,0,2)
         else:
@@ -287,31 +385,33 @@ class Workspace(object):
         # SEE ABOVE COMMENT on ActivateStatError
         background.ActivateStatError()
         # --- add systematics ---
-        syst_dict = self._systematics[region].get(bg, {})
-        for syst, var in syst_dict.iteritems():
-            background.AddOverallSys(syst, *var)
-
-        chan.AddSample(background)
+        for syst, down, up in self._systematics.get_variations(region, bg):
+            background.AddOverallSys(syst, down, up)
 
     # _________________________________________________________________
     # save the workspace
 
     def _get_ws_name(self):
+        return self.get_ws_name(
+            self._signal_point, self._fit_signal_region, self._sigsyst_sign)
+
+    @classmethod
+    def get_ws_name(cls, signal_point, fit_signal_region, sigsyst_sign):
         """
         The workspace is named according to the signal point. If there's
         no signal point, it's called 'background'
         """
-        if self._signal_point:
-            prefix = self._signal_point
-        elif self._fit_signal_region:
-            prefix = self.sr_plus_cr_fit_prefix
+        if signal_point:
+            prefix = signal_point
+        elif fit_signal_region:
+            prefix = cls.sr_plus_cr_fit_prefix
         else:
-            prefix = self.cr_only_fit_prefix
+            prefix = cls.cr_only_fit_prefix
 
-        outnames = {1: self.up1s, -1: self.down1s, 0: self.nominal}
-        sigsyst_name = outnames[self._sigsyst_sign]
+        outnames = {1: cls.up1s, -1: cls.down1s, 0: cls.nominal}
+        sigsyst_name = outnames[sigsyst_sign]
 
-        return self.name_tpl.format(pfx=prefix, sigdir=sigsyst_name)
+        return cls.name_tpl.format(pfx=prefix, sigdir=sigsyst_name)
 
     def _build_measurement(self):
         """
@@ -323,7 +423,7 @@ class Workspace(object):
                 pseudo_count = self._region_sums[chan_name]
                 if chan_name in self._non_fit_regions:
                     pseudo_count = 0.0
-                with OutputFilter():
+                with OutputFilter(discard=True):
                     channel.SetData(pseudo_count)
             self.meas.AddChannel(channel)
 
@@ -380,10 +480,12 @@ class Workspace(object):
         with OutputFilter(**filter_args):
             from ROOT import TFile
             h2ws = self.hf.HistoToWorkspaceFactoryFast(self.meas)
-            ws = h2ws.MakeCombinedModel(self.meas)
+            with stage('MakeCombinedModel'):
+                ws = h2ws.MakeCombinedModel(self.meas)
 
         out_path = join(results_dir, out_name)
-        ws.writeToFile(out_path, True)
+        with stage('writeToFile'):
+            ws.writeToFile(out_path, True)
 
     def do_histfitter_magic(self, ws_dir, verbose=False):
         """
@@ -435,7 +537,8 @@ class Workspace(object):
         # this snapshot error appears to be a hackish check, can ignore
         veto = {'snapshot_paramsVals_initial'}
 
-        with OutputFilter(accept_strings=accept_strings, veto_strings=veto):
+        with stage('GenerateFitAndPlot'), OutputFilter(
+                accept_strings=accept_strings, veto_strings=veto):
             Util.GenerateFitAndPlot(
                 fc.m_name,
                 "ana_name",
@@ -459,80 +562,12 @@ class Workspace(object):
 # _________________________________________________________________________
 # systematic calculation (convert yields to relative systematics, etc...)
 
-def _get_signal_systematics(rel_systs, syst_list, direction):
-    """
-    Return a {(region, process): sum_square, ...} dict.
-    The `direction` should be 'up','down', or None.
-    """
-    out_dict = {}
-    if not direction:
-        return out_dict
-    # translate version to an index in the systematic list
-    idx = {'down':0, 'up':1}[direction]
-    for syst in syst_list:
-        for region, procdict in rel_systs[syst].iteritems():
-            for proc, downup in procdict.iteritems():
-                # multiply the signal by the appropriate variation.
-                # we're assuming the systematics aren't correlated
-                # (and using linear error prop)
-                delta = downup[idx] - 1
-                out_key = region, proc
-                sum_sq = out_dict.get(out_key, 0.0)
-                sum_sq += delta**2
-                out_dict[out_key] = sum_sq
-    return out_dict
-
-def _get_relative_from_abs_systematics(base_yields, systematic_yields):
-    """calculate relative systematics based on absolute values"""
-    all_syst = set(systematic_yields.iterkeys())
-    sym_systematics, asym_systematics = _split_systematics(all_syst)
-
-    # the relative systematics are keyed as
-    # {region: {process:{systematic: (down, up), ...}, ... }, ...}
-    rel_systs = {}
-    # build all the relative systematics
-    for region, process_dict in base_yields.iteritems():
-        rel_systs[region] = {}
-        for process, vals in process_dict.iteritems():
-            if process == 'data':
-                continue
-            nom_yield, err = vals
-            rel_systs[region][process] = {}
-
-            # start with symmetric ones
-            for syst in sym_systematics:
-                try:
-                    varied_yield = systematic_yields[syst][region][process][0]
-                except KeyError as err:
-                    continue # missing means no variation
-                rel_syst_err = varied_yield / nom_yield - 1.0
-                rel_syst_err /= 2.0 # cut in half because it's symmetric
-                rel_syst_range = ( 1 - rel_syst_err, 1 + rel_syst_err)
-                rel_systs[region][process][syst] = rel_syst_range
-
-            # now do the asymmetric systematics
-            for syst in asym_systematics:
-                sdown = syst + _asym_suffix_down
-                sup = syst + _asym_suffix_up
-
-                def var(sys_name):
-                    """get the relative variation from sys_name"""
-                    try:
-                        raw = systematic_yields[sys_name][region][process][0]
-                    except KeyError as err:
-                        return None # missing means no variation
-                    return raw / nom_yield
-                updown = (var(sdown), var(sup))
-                if updown == (None, None):
-                    continue
-                rel_systs[region][process][syst] = updown
-
-    return rel_systs
-
-def _combine_backgrounds(yields, combine_dict):
+def _combine_backgrounds(yields, combine_dict, systematics):
     """
     Combine some backgrounds in the yeilds dictionary.
-    Return the resulting dictionary with the yields merged.
+    Return the resulting dictionary with the yields merged, and only
+    the yield systematics in `systematics` (and their up / down
+    variations).
     """
 
     def rename(proc):
@@ -561,7 +596,9 @@ def _combine_backgrounds(yields, combine_dict):
     nom_yields = yields[_baseline_yields_key]
     new_nom = {x:combine(y) for x, y in nom_yields.items()}
     new_systs = {}
-    for syst, regdic in yields[_yield_systematics_key].items():
+    requested, _ = _filter_systematics(
+        yields[_yield_systematics_key], systematics)
+    for syst, regdic in requested.items():
         new_sysreg = new_systs.setdefault(syst, {})
         for regname, procdic in regdic.items():
             new_sysreg[regname] = combine(procdic)
@@ -571,9 +608,6 @@ def _combine_backgrounds(yields, combine_dict):
         _relative_systematics_key: yields[_relative_systematics_key]}
 
 
-_asym_suffix_up = 'up'
-_asym_suffix_down = 'down'
-
 def _filter_systematics(original, requested):
     """
     Slim down 'original' dict of systematics by only allowing
@@ -608,54 +642,6 @@ def _filter_rel_systematics(original, requested):
             raise ValueError(_missing_syst_err.format(systn))
     return filtered
 
-def _split_systematics(systematics):
-    """
-    Split into symmetric and asymmetric vairations and return a tuple
-    (symmetric, asymmetric).
-    Works by finding the systematics with an "up" and "down" suffix,
-    and calling these asymmetric.
-    """
-    asym = set()
-    for sys in systematics:
-        if sys.endswith(_asym_suffix_up):
-            stem = sys[:-len(_asym_suffix_up)]
-            if stem + _asym_suffix_down in systematics:
-                asym.add(stem)
-
-    asym_variations = set()
-    for sys in asym:
-        asym_variations.add(sys + _asym_suffix_down)
-        asym_variations.add(sys + _asym_suffix_up)
-    sym_systematics = set(systematics) - asym_variations
-    return sym_systematics, asym
-
-def _update_with_relative_systematics(existing, rel_systs, all_proc):
-    """
-    Add relative systematics to the systematics we use. Throw an
-    exception if we try to overwrite.
-    """
-    for sys_name, region_dict in rel_systs.iteritems():
-        for region_name, process_dict in region_dict.iteritems():
-            exist_region = existing.setdefault(region_name, {})
-            # we allow a list to be passed to the region directly
-            # in which case it's applied to all processes
-            try:
-                for process_name, downup in process_dict.iteritems():
-                    exist_process = exist_region.setdefault(process_name, {})
-                    if sys_name in exist_process:
-                        raise ValueError('tried to overwrite systematic')
-                    exist_process[sys_name] = downup
-            except AttributeError as err:
-                if "object has no attribute 'iteritems'" not in str(err):
-                    raise
-                if not len(process_dict) == 2:
-                    raise ValueError(
-                        '{} not an up / down pair'.format(process_dict))
-                for proc in all_proc:
-                    exist_proc = exist_region.setdefault(proc, {})
-                    exist_proc[sys_name] = process_dict
-
-
 # __________________________________________________________________________
 # helper functions
 
@@ -675,20 +661,28 @@ def _check_subset(subset, superset):
         if not xx in superset:
             raise ValueError("{} not in {}".format(xx, ', '.join(superset)))
 
-def _set_value(sample, value, err):
+def _make_samples(hf, names, values, errors):
     """
-    Workaround for the crashing Sample.SetValue method.
+    Create a single bin sample for each entry in `names`, with the
+    contents given by `values` and `errors`. Returns a list.
 
-    Probably leaks memory, but good luck avoiding this with ROOT.
-    $@! FURTHER EXPLETIVES REMOVED BY AUTHOR !@$
+    Workaround for the crashing Sample.SetValue method. Each sample
+    takes ownership of its own histogram (`SetHisto` doesn't copy), so
+    they can't be shared, and python mustn't delete them.
     """
-    from ROOT import TH1D
-    sname = sample.GetName()
-    with OutputFilter():        # suppress memory leak complaint
-        hist = TH1D(sname + '_hist', '', 1, 0, 1)
-    hist.SetBinContent(1, value)
-    hist.SetBinError(1, err)
-    sample.SetHisto(hist)
+    from ROOT import TH1D, SetOwnership
+    samples = []
+    for name, value, err in zip(names, values, errors):
+        sample = hf.Sample(name)
+        hist = TH1D(name + '_hist', '', 1, 0, 1)
+        # not registered with gDirectory either, the sample owns it
+        hist.SetDirectory(0)
+        SetOwnership(hist, False)
+        hist.SetBinContent(1, value)
+        hist.SetBinError(1, err)
+        sample.SetHisto(hist)
+        samples.append(sample)
+    return samples
 
 def get_signal_points_and_backgrounds(all_yields):
     yields = all_yields[_baseline_yields_key]
@@ -0,0 +1,317 @@
+"""
+Array-backed version of the yields file, cached on disk.
+
+Parsing a big yields file with yaml is slow, so the first time a file is
+read it's converted to dense numpy arrays (see `YieldsTable`) and saved
+in a cache directory, under the hash of the file's contents. Later runs
+(and parallel workers) memory-map the arrays instead of parsing the yaml.
+
+The cache for one file is a directory with an `index.json` (names of the
+regions, processes, and systematics) and one `.npy` file per array.
+Missing entries are stored as NaN.
+
+Cached yields are handed out as read-only dicts that are filled from
+the arrays as they're looked up, so systematics that aren't used are
+never converted back. Every value comes back as a float, even where
+the yaml had an int.
+"""
+
+import os, json, hashlib, tempfile, shutil
+from collections import Mapping
+from os.path import join, isdir, expanduser
+import numpy as np
+import yaml
+
+# same keys as used in the workspace module
+from scharmfit.workspace import FitInputs
+_baseline_yields_key = FitInputs.baseline_yields_key
+_yield_systematics_key = FitInputs.yield_systematics_key
+_relative_systematics_key = FitInputs.relative_systematics_key
+
+# bump this if the layout of the cache changes
+_cache_version = 1
+_index_name = 'index.json'
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME', expanduser('~/.cache'))
+    return join(cache_home, 'scharmfit', 'yields')
+
+def load_yields(yields_path, cache_dir=None):
+    """
+    Return the yields dict from `yields_path`, in the same form as
+    `yaml.load` would give it. If `cache_dir` is given, use (or create)
+    the cached arrays there, in which case the dicts are read-only
+    (see `YieldsTable.as_dict`).
+    """
+    if cache_dir is None:
+        with open(yields_path) as yields_yml:
+            return _parse_yaml(yields_yml)
+    return get_yields_table(yields_path, cache_dir).as_dict()
+
+def get_yields_table(yields_path, cache_dir):
+    """Return the `YieldsTable` for `yields_path`, cached in `cache_dir`"""
+    with open(yields_path, 'rb') as yields_yml:
+        text = yields_yml.read()
+    digest = hashlib.sha1(text).hexdigest()
+    table_dir = join(cache_dir, '{}-v{}'.format(digest, _cache_version))
+    if isdir(table_dir):
+        return YieldsTable.load(table_dir)
+    table = YieldsTable.from_dict(_parse_yaml(text))
+    table.save(table_dir)
+    return table
+
+def _parse_yaml(text):
+    # the C loader is much faster, but isn't always built
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+class YieldsTable(object):
+    """
+    Dense arrays holding everything in the yields file. Indexed by the
+    names in `regions`, `processes`, `yield_systematics`, and
+    `relative_systematics`:
+
+     - `nominal`: (region, process, {yield, error})
+     - `syst_yields`: (yield systematic, region, process, {yield, error})
+     - `rel_systs`: (relative systematic, region, process, {down, up})
+     - `rel_region_systs`: (relative systematic, region, {down, up}),
+       for relative systematics applied to a full region.
+
+    The `*_regions` arrays flag which regions appear in each part of the
+    file (so that empty regions survive the round trip).
+    """
+    _arrays = [
+        'nominal', 'nominal_regions',
+        'syst_yields', 'syst_yield_regions',
+        'rel_systs', 'rel_region_systs', 'rel_syst_regions']
+
+    def __init__(self, index, arrays):
+        self.regions = index['regions']
+        self.processes = index['processes']
+        self.yield_systematics = index['yield_systematics']
+        self.relative_systematics = index['relative_systematics']
+        self._sections = index['sections']
+        for name in self._arrays:
+            setattr(self, name, arrays[name])
+
+    # ____________________________________________________________________
+    # conversion from / to the nested dicts
+
+    @classmethod
+    def from_dict(cls, yields):
+        nominal = yields.get(_baseline_yields_key, {})
+        syst_yields = yields.get(_yield_systematics_key, {})
+        rel_systs = yields.get(_relative_systematics_key, {})
+
+        regions, processes = set(nominal), set()
+        for procdict in nominal.itervalues():
+            processes.update(procdict)
+        for regdict in syst_yields.itervalues():
+            regions.update(regdict)
+            for procdict in regdict.itervalues():
+                processes.update(procdict)
+        for regdict in rel_systs.itervalues():
+            regions.update(regdict)
+            for procdict in regdict.itervalues():
+                if isinstance(procdict, dict):
+                    processes.update(procdict)
+
+        index = {
+            'regions': sorted(regions),
+            'processes': sorted(processes),
+            'yield_systematics': sorted(syst_yields),
+            'relative_systematics': sorted(rel_systs),
+            'sections': [k for k in [
+                    _baseline_yields_key, _yield_systematics_key,
+                    _relative_systematics_key] if k in yields],
+            }
+        reg_idx = _index(index['regions'])
+        proc_idx = _index(index['processes'])
+        n_reg, n_proc = len(reg_idx), len(proc_idx)
+        n_ysys = len(index['yield_systematics'])
+        n_rsys = len(index['relative_systematics'])
+
+        arrays = {
+            'nominal': np.full((n_reg, n_proc, 2), np.nan),
+            'nominal_regions': np.zeros(n_reg, dtype=bool),
+            'syst_yields': np.full((n_ysys, n_reg, n_proc, 2), np.nan),
+            'syst_yield_regions': np.zeros((n_ysys, n_reg), dtype=bool),
+            'rel_systs': np.full((n_rsys, n_reg, n_proc, 2), np.nan),
+            'rel_region_systs': np.full((n_rsys, n_reg, 2), np.nan),
+            'rel_syst_regions': np.zeros((n_rsys, n_reg), dtype=bool),
+            }
+        _fill_regions(arrays['nominal'], arrays['nominal_regions'],
+                      nominal, reg_idx, proc_idx)
+        for snum, syst in enumerate(index['yield_systematics']):
+            _fill_regions(
+                arrays['syst_yields'][snum],
+                arrays['syst_yield_regions'][snum],
+                syst_yields[syst], reg_idx, proc_idx)
+        for snum, syst in enumerate(index['relative_systematics']):
+            for region, procdict in rel_systs[syst].iteritems():
+                rnum = reg_idx[region]
+                arrays['rel_syst_regions'][snum, rnum] = True
+                # a list applies the systematic to the full region
+                if not isinstance(procdict, dict):
+                    arrays['rel_region_systs'][snum, rnum] = procdict
+                    continue
+                for proc, downup in procdict.iteritems():
+                    arrays['rel_systs'][snum, rnum, proc_idx[proc]] = downup
+        return cls(index, arrays)
+
+    def to_dict(self):
+        """rebuild the nested dicts, as they are in the yaml file"""
+        yields = {}
+        sections = set(self._sections)
+        if _baseline_yields_key in sections:
+            yields[_baseline_yields_key] = self._regions_dict(
+                self.nominal, self.nominal_regions)
+        if _yield_systematics_key in sections:
+            yields[_yield_systematics_key] = {
+                syst: self._regions_dict(
+                    self.syst_yields[snum], self.syst_yield_regions[snum])
+                for snum, syst in enumerate(self.yield_systematics)}
+        if _relative_systematics_key in sections:
+            yields[_relative_systematics_key] = {
+                syst: self._rel_syst_dict(snum)
+                for snum, syst in enumerate(self.relative_systematics)}
+        return yields
+
+    def as_dict(self):
+        """
+        Same as `to_dict`, but nothing is converted until it's looked
+        up: each section, and each systematic within the systematics
+        sections, is built the first time it's used.
+        """
+        ysyst_idx = _index(self.yield_systematics)
+        rsyst_idx = _index(self.relative_systematics)
+        def syst_yields(syst):
+            snum = ysyst_idx[syst]
+            return self._regions_dict(
+                self.syst_yields[snum], self.syst_yield_regions[snum])
+        def rel_systs(syst):
+            return self._rel_syst_dict(rsyst_idx[syst])
+        def section(key):
+            if key == _baseline_yields_key:
+                return self._regions_dict(self.nominal, self.nominal_regions)
+            if key == _yield_systematics_key:
+                return _LazyDict(self.yield_systematics, syst_yields)
+            return _LazyDict(self.relative_systematics, rel_systs)
+        return _LazyDict(self._sections, section)
+
+    def _regions_dict(self, values, region_mask):
+        """convert a (region, process, 2) array to {region: {proc: list}}"""
+        out = {self.regions[rnum]: {} for rnum in np.flatnonzero(region_mask)}
+        present = ~np.isnan(values[:,:,0])
+        for rnum, pnum in zip(*np.nonzero(present)):
+            val, err = values[rnum, pnum].tolist()
+            entry = [val] if err != err else [val, err]
+            out[self.regions[rnum]][self.processes[pnum]] = entry
+        return out
+
+    def _rel_syst_dict(self, snum):
+        out = {}
+        region_systs = self.rel_region_systs[snum]
+        for rnum in np.flatnonzero(self.rel_syst_regions[snum]):
+            if not np.isnan(region_systs[rnum, 0]):
+                out[self.regions[rnum]] = region_systs[rnum].tolist()
+            else:
+                out[self.regions[rnum]] = {}
+        present = ~np.isnan(self.rel_systs[snum, :, :, 0])
+        for rnum, pnum in zip(*np.nonzero(present)):
+            downup = self.rel_systs[snum, rnum, pnum].tolist()
+            out[self.regions[rnum]][self.processes[pnum]] = downup
+        return out
+
+    # ____________________________________________________________________
+    # reading / writing
+
+    def save(self, table_dir):
+        """
+        Write to `table_dir`. The files are written to a temporary
+        directory which is then moved into place, so several processes
+        can try to write the same table at once.
+        """
+        parent = os.path.dirname(table_dir)
+        if not isdir(parent):
+            os.makedirs(parent)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        index = {
+            'regions': self.regions,
+            'processes': self.processes,
+            'yield_systematics': self.yield_systematics,
+            'relative_systematics': self.relative_systematics,
+            'sections': self._sections,
+            }
+        with open(join(tmp_dir, _index_name), 'w') as index_file:
+            json.dump(index, index_file)
+        for name in self._arrays:
+            np.save(join(tmp_dir, name + '.npy'), getattr(self, name))
+        try:
+            os.rename(tmp_dir, table_dir)
+        except OSError:
+            # someone else got there first
+            if not isdir(table_dir):
+                raise
+            shutil.rmtree(tmp_dir)
+
+    @classmethod
+    def load(cls, table_dir):
+        """memory-map the arrays saved in `table_dir`"""
+        with open(join(table_dir, _index_name)) as index_file:
+            index = json.load(index_file)
+        arrays = {
+            name: np.load(join(table_dir, name + '.npy'), mmap_mode='r')
+            for name in cls._arrays}
+        return cls(_str_names(index), arrays)
+
+class _LazyDict(Mapping):
+    """
+    Read-only dict with the keys in `keys`. The value for a key is
+    `build(key)`, called the first time it's looked up.
+    """
+    def __init__(self, keys, build):
+        self._keys = list(keys)
+        self._key_set = set(self._keys)
+        self._build = build
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._key_set:
+                raise KeyError(key)
+            self._values[key] = self._build(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._key_set
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+# __________________________________________________________________________
+# helpers
+
+def _index(names):
+    return {name: num for num, name in enumerate(names)}
+
+def _fill_regions(values, region_mask, regdict, reg_idx, proc_idx):
+    """fill a (region, process, 2) array from {region: {proc: list}}"""
+    for region, procdict in regdict.iteritems():
+        rnum = reg_idx[region]
+        region_mask[rnum] = True
+        for proc, entry in procdict.iteritems():
+            values[rnum, proc_idx[proc], :len(entry)] = entry
+
+def _str_names(index):
+    """json gives back unicode, convert to str to match yaml"""
+    def conv(value):
+        if isinstance(value, list):
+            return [conv(x) for x in value]
+        if isinstance(value, unicode):
+            return str(value)
+        return value
+    return {str(k): conv(v) for k, v in index.iteritems()}
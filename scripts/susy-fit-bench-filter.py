@@ -0,0 +1,62 @@
+#!/usr/bin/env python2.7
+"""
+Micro-benchmark for the per-call overhead of OutputFilter.
+
+Times entering and leaving a filter a few thousand times, with and
+without some output inside, for each way of using the filter. The old
+temporary file version is included for comparison.
+"""
+
+import argparse, sys, os, tempfile, timeit
+from scharmfit.utils import OutputFilter
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--n-calls', type=int, default=5000,
+                        help="calls per test (default: %(default)s)")
+    parser.add_argument('-l', '--n-lines', type=int, default=20,
+                        help='lines printed in the "output" tests')
+    args = parser.parse_args()
+
+    lines = ''.join(
+        'some ROOT complaint number {}\n'.format(n)
+        for n in xrange(args.n_lines))
+    filters = [
+        ('temp file (old)', lambda: _TempFileFilter()),
+        ('default', lambda: OutputFilter()),
+        ('accept_re', lambda: OutputFilter(accept_re='ERROR')),
+        ('discard', lambda: OutputFilter(discard=True)),
+        ]
+    sys.stdout.write('{:<16} {:>12} {:>12}\n'.format(
+            'filter', 'empty [us]', 'output [us]'))
+    for name, make_filter in filters:
+        times = []
+        for text in ['', lines]:
+            def call():
+                with make_filter():
+                    os.write(1, text)
+            total = min(timeit.repeat(call, number=args.n_calls, repeat=3))
+            times.append(total / args.n_calls * 1e6)
+        sys.stdout.write('{:<16} {:>12.1f} {:>12.1f}\n'.format(name, *times))
+
+class _TempFileFilter(object):
+    """the previous OutputFilter, minus the line matching"""
+    def __init__(self):
+        self.temp = tempfile.NamedTemporaryFile()
+    def __enter__(self):
+        self.old_out, self.old_err = os.dup(1), os.dup(2)
+        os.dup2(self.temp.fileno(), 1)
+        os.dup2(self.temp.fileno(), 2)
+    def __exit__(self, exe_type, exe_val, tb):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.old_out, 1)
+        os.dup2(self.old_err, 2)
+        os.close(self.old_out)
+        os.close(self.old_err)
+        self.temp.seek(0)
+        for line in self.temp:
+            pass
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python2.7
+"""
+End-to-end benchmark of booking and fitting, on synthetic yields.
+
+Each case is a yields file made up by `scharmfit.synthetic`, with some
+number of regions, backgrounds, systematics, and signal points. For
+each case the stages from reading the yields to the limits are timed,
+per signal point where they run once per point. The median time of
+each stage is compared to a saved baseline, and anything that got
+slower than the tolerance is flagged (with a non-zero exit code).
+"""
+
+import argparse, sys, os, json, tempfile, shutil, timeit
+from os.path import join, isfile
+import yaml
+from scharmfit.synthetic import make_yields, make_fit_config
+
+# (regions, backgrounds, yield systematics, relative systematics,
+# signal points) for each case
+_cases = {
+    'small': (2, 2, 2, 1, 4),
+    'medium': (4, 4, 8, 4, 16),
+    'large': (8, 8, 24, 8, 64),
+    }
+_case_keys = [
+    'n_regions', 'n_backgrounds', 'n_yield_systs', 'n_relative_systs',
+    'n_signal_points']
+
+# in the order they run (see `_needed_stages` for what needs what)
+_free_stages = ['yaml', 'inputs', 'counting']
+_root_stages = ['workspace', 'save', 'histfitter', 'cls', 'ul']
+_stages = _free_stages + _root_stages
+
+_misc_config = dict(
+    blind=False, injection=False, signal_systematic=None, debug=False,
+    signal_theory_np=False, do_hf=False)
+
+_stages_help = (
+    'stages to time, the stages they depend on are timed too '
+    '(default: all, or the ROOT-free ones if ROOT is missing)')
+_fits_help = 'only book and fit this many signal points per case'
+_baseline_help = 'compare to (or save) the baseline here'
+_tolerance_help = (
+    'flag stages that are slower than the baseline by more than '
+    'this fraction')
+
+def run():
+    d = '(default: %(default)s)'
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--cases', nargs='+', choices=sorted(_cases),
+                        default=['small', 'medium'], help=d)
+    parser.add_argument('-s', '--stages', nargs='+', choices=_stages,
+                        help=_stages_help)
+    parser.add_argument('-n', '--max-points', type=int, default=4,
+                        help=_fits_help + ' ' + d)
+    parser.add_argument('-b', '--baseline', default='bench-baseline.json',
+                        help=_baseline_help + ' ' + d)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help=_tolerance_help + ' ' + d)
+    parser.add_argument('-o', '--output', help='save the timings here')
+    args = parser.parse_args(sys.argv[1:])
+    stages = args.stages or _default_stages()
+
+    timings = {}
+    work_dir = tempfile.mkdtemp(prefix='susy-fit-bench-')
+    try:
+        for case in args.cases:
+            print 'running {} case'.format(case)
+            case_dir = join(work_dir, case)
+            os.makedirs(case_dir)
+            timings[case] = _run_case(
+                case, stages, args.max_points, case_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    baseline = {}
+    if isfile(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    slower = _compare(timings, baseline, args.tolerance)
+    if args.output:
+        _write_json(args.output, timings)
+    if args.save_baseline:
+        baseline.update(timings)
+        _write_json(args.baseline, baseline)
+        print 'saved baseline in {}'.format(args.baseline)
+    elif slower:
+        sys.stderr.write('{} stages got slower than {}\n'.format(
+                slower, args.baseline))
+        sys.exit(1)
+
+def _default_stages():
+    try:
+        import ROOT
+    except ImportError:
+        print "can't import ROOT, only running {}".format(
+            ', '.join(_free_stages))
+        return _free_stages
+    return _stages
+
+# _________________________________________________________________________
+# timing
+
+def _run_case(case, stages, max_points, case_dir):
+    """
+    Time every stage needed for `stages` for one case, return a dict of
+    {stage: {'calls': N, 'total': seconds, 'median': seconds}}
+    """
+    from scharmfit.workspace import get_signal_points_and_backgrounds
+    from scharmfit.workspace import FitInputs
+    from scharmfit.yieldcache import load_yields
+    needed = _needed_stages(stages)
+    times = {stage: [] for stage in needed}
+    def timed(stage, func, *args):
+        start = timeit.default_timer()
+        out = func(*args)
+        times[stage].append(timeit.default_timer() - start)
+        return out
+
+    yields = make_yields(seed=1, **dict(zip(_case_keys, _cases[case])))
+    fit_config = make_fit_config(yields)
+    yields_path = join(case_dir, 'yields.yml')
+    with open(yields_path, 'w') as yields_yml:
+        yields_yml.write(yaml.dump(yields))
+    signal_points = sorted(get_signal_points_and_backgrounds(yields)[0])
+    signal_points = signal_points[:max_points]
+
+    yields = timed('yaml', load_yields, yields_path)
+    if 'inputs' in needed:
+        timed('inputs', FitInputs, yields, fit_config, _misc_config)
+    if 'counting' in needed:
+        from scharmfit.calculators import CountingCLsCalc
+        calc = CountingCLsCalc(yields, fit_config, _misc_config)
+        for signal_point in signal_points:
+            timed('counting', calc.calculate_cls, signal_point)
+    if 'workspace' in needed:
+        _time_root_stages(
+            yields, fit_config, signal_points, needed, case_dir, timed)
+
+    return {stage: _summarize(stage_times)
+            for stage, stage_times in times.iteritems()}
+
+def _time_root_stages(yields, fit_config, signal_points, needed, out_dir,
+                      timed):
+    """book (and fit) each signal point, timing each stage"""
+    from scharmfit.workspace import WorkspaceTemplate, Workspace
+    from scharmfit.calculators import CLsCalc, UpperLimitCalc
+    template = WorkspaceTemplate(yields, fit_config, _misc_config)
+    def build(signal_point):
+        fit = template.get_workspace()
+        fit.set_signal(signal_point)
+        for sr in fit_config['signal_regions']:
+            fit.add_sr(sr)
+        for cr in fit_config['control_regions']:
+            fit.add_cr(cr)
+        return fit
+    for signal_point in signal_points:
+        fit = timed('workspace', build, signal_point)
+        if 'save' not in needed:
+            continue
+        timed('save', fit.save_workspace, out_dir)
+        if 'histfitter' in needed:
+            timed('histfitter', fit.do_histfitter_magic, out_dir)
+        ws_path = join(out_dir, Workspace.get_ws_name(signal_point, True, 0))
+        if 'cls' in needed:
+            timed('cls', CLsCalc().calculate_cls, ws_path)
+        if 'ul' in needed:
+            timed('ul', UpperLimitCalc().upper_limits, ws_path)
+
+def _needed_stages(stages):
+    """
+    The requested stages, plus the stages they depend on: everything
+    reads the yields, the fits and HistFitter need a saved workspace,
+    and saving needs a booked one.
+    """
+    needed = set(stages)
+    if needed & set(_root_stages[2:]):
+        needed.add('save')
+    if needed & set(_root_stages):
+        needed.add('workspace')
+    return needed | {'yaml'}
+
+def _summarize(stage_times):
+    ordered = sorted(stage_times)
+    return {
+        'calls': len(ordered),
+        'total': sum(ordered),
+        'median': ordered[len(ordered) // 2] if ordered else None,
+        }
+
+# _________________________________________________________________________
+# baseline comparison
+
+def _compare(timings, baseline, tolerance):
+    """
+    Print each stage's median time next to the baseline, return the
+    number of stages that are slower by more than `tolerance`.
+    """
+    row = '{:<8} {:<11} {:>6} {:>12} {:>12} {:>8}  {}\n'
+    sys.stdout.write(row.format(
+            'case', 'stage', 'calls', 'median [ms]', 'base [ms]', 'change',
+            ''))
+    slower = 0
+    for case, stage_dict in sorted(timings.iteritems()):
+        for stage in _stages:
+            if stage not in stage_dict:
+                continue
+            median = stage_dict[stage]['median']
+            base = baseline.get(case, {}).get(stage, {}).get('median')
+            change, flag = '', ''
+            if median is not None and base:
+                ratio = median / base - 1.0
+                change = '{:+.0%}'.format(ratio)
+                if ratio > tolerance:
+                    flag = 'SLOWER'
+                    slower += 1
+            sys.stdout.write(row.format(
+                    case, stage, stage_dict[stage]['calls'],
+                    _ms(median), _ms(base), change, flag))
+    return slower
+
+def _ms(seconds):
+    return '' if seconds is None else '{:.1f}'.format(seconds * 1e3)
+
+def _write_json(path, obj):
+    with open(path, 'w') as out_file:
+        json.dump(obj, out_file, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    run()
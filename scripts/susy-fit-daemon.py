@@ -0,0 +1,30 @@
+#!/usr/bin/env python2.7
+"""
+Keep ROOT and libSusyFitter loaded, and run the workspace and fit
+scripts here when they're started. Runs until it's stopped (with
+--stop or ctrl-c).
+"""
+_socket_help = (
+    'listen on this unix socket (default: $SUSYFIT_DAEMON, or '
+    'scharmfit-<uid>/daemon.sock in $XDG_RUNTIME_DIR or /tmp)')
+_stop_help = 'stop the server that is running'
+
+import argparse, sys
+from scharmfit import daemon
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-s', '--socket', help=_socket_help)
+    parser.add_argument('--stop', action='store_true', help=_stop_help)
+    args = parser.parse_args(sys.argv[1:])
+    address = args.socket or daemon.default_address()
+    if args.stop:
+        if not daemon.stop(address):
+            sys.exit('no server at {}'.format(address))
+        return
+    if daemon.is_running(address):
+        sys.exit('already serving on {}'.format(address))
+    daemon.serve(address)
+
+if __name__ == '__main__':
+    run()
@@ -10,6 +10,8 @@ import argparse, glob, sys
 from os import walk
 
 from scharmfit.utils import load_susyfit, make_dir_if_none
+from scharmfit import profiling
+from scharmfit.daemon import forward
 
 # __________________________________________________________________________
 # constants
@@ -17,6 +19,10 @@ from scharmfit.utils import load_susyfit, make_dir_if_none
 # only fit files that start with this
 _prefit_prefix = 'discovery'
 
+_profile_help = (
+    'time each stage of the fits, write a chrome trace here and print '
+    'the slowest stages')
+
 # __________________________________________________________________________
 # run routine
 
@@ -26,10 +32,14 @@ def run():
     parser.add_argument('workspace_dir')
     parser.add_argument(
         '-o','--output-dir', help='save outcrap here ' + d, default='shit')
+    parser.add_argument('--profile', metavar='TRACE', help=_profile_help)
     config = parser.parse_args(sys.argv[1:])
 
     # run the fits
+    if config.profile:
+        profiling.enable(config.profile)
     _make_calc_file(config)
+    profiling.finish()
 
 def _is_prefit(workspace):
     if workspace.endswith('afterFit.root'):
@@ -48,7 +58,8 @@ def _make_calc_file(config):
                 raise OSError("too many workspaces: {}".format(
                         ', '.join(workspaces)))
             ws_name = workspaces[0]
-            _fit_ws(ws_name, config.output_dir)
+            with profiling.stage('fit', workspace=ws_name):
+                _fit_ws(ws_name, config.output_dir)
 
 def _fit_ws(ws_path, output_dir, toys=0):
     """Print some plots, figures out file name by the ws_path"""
@@ -64,10 +75,14 @@ def _fit_ws(ws_path, output_dir, toys=0):
     use_cls = True
     points = 20                 # mu values to use
 
-    ws = Util.GetWorkspaceFromFile(ws_path, 'combined')
-    result = RooStats.MakeUpperLimitPlot(
-        out_pfx, ws, ctype, test_stat_type, toys, use_cls, points)
+    with profiling.stage('GetWorkspaceFromFile'):
+        ws = Util.GetWorkspaceFromFile(ws_path, 'combined')
+    with profiling.stage('MakeUpperLimitPlot'):
+        result = RooStats.MakeUpperLimitPlot(
+            out_pfx, ws, ctype, test_stat_type, toys, use_cls, points)
     
 
 if __name__ == '__main__':
+    # run in the server, if there is one (see scharmfit.daemon)
+    forward(__file__)
     run()
@@ -7,7 +7,15 @@ workspaces as an input.
 import yaml
 from os.path import join, relpath, basename
 import argparse, re, sys, glob
-from scharmfit.calculators import UpperLimitCalc, CLsCalc
+from scharmfit.calculators import UpperLimitCalc, CLsCalc, MultiCalc
+from scharmfit.calculators import CountingCLsCalc
+from scharmfit.results import ResultStore
+from scharmfit.warmstart import FitSeeds
+from scharmfit import fingerprint as fprint
+from scharmfit import profiling
+from scharmfit.daemon import forward
+from scharmfit.progress import RunStatus
+from scharmfit.utils import get_fit_timing, reset_fit_timing
 from os import walk
 
 # __________________________________________________________________________
@@ -16,28 +24,151 @@ from os import walk
 # only fit files that start with this
 _prefit_prefix = 'scharm'
 
+_backends = {'histfactory', 'counting'}
+_backend_help = (
+    'fit HistFactory workspaces, or build a ROOT-free counting '
+    'experiment from the yields')
+_yields_help = 'yaml file giving the yields'
+_fit_config_help = 'fit configuration the workspaces were booked with'
+_cache_help = (
+    'directory to cache the parsed yields in '
+    '(default: ~/.cache/scharmfit/yields)')
+_no_cache_help = "don't cache the parsed yields"
+_calc_type_help = (
+    'what to calculate, giving several calculates them all with one '
+    'pass over each workspace')
+_max_jobs_help = 'replace each worker process after this many fits'
+_max_rss_help = (
+    'replace a worker process once it uses more than this many MB')
+_adaptive_help = (
+    'fit a coarse grid of points first, then only the points near the '
+    'exclusion contour, the rest are inferred from their neighbours')
+_toys_help = (
+    'use this many toys rather than the asymptotic formulae (the '
+    'histfactory backend only uses them for upper limits)')
+_toy_workers_help = (
+    'run the toys for each hypothesis test in this many processes')
+_toy_seed_help = 'base random seed for the toys'
+_hybrid_help = (
+    'fit everything with the asymptotic formulae first, then redo the '
+    'points near the exclusion contour, or with a small background, '
+    'with --toys')
+_toy_budget_help = 'redo at most this many points with toys'
+_toy_references_help = (
+    'for counting backend upper limits, generate the toys at this many '
+    'signal strengths and reweight them to the others, rather than '
+    'generating new toys for every signal strength tested')
+_profile_help = (
+    'time each stage of the fits, write a chrome trace here and print '
+    'the slowest stages')
+_status_help = (
+    'write the progress (points done / failed / skipped, throughput, '
+    'ETA, memory) here, as json, or as a Prometheus textfile if the '
+    'name ends in .prom')
+_status_interval_help = 'seconds between progress updates'
+_no_warm_start_help = (
+    "start every fit from the workspace defaults, rather than from the "
+    "closest point that's already been fit")
+
 # __________________________________________________________________________
 # run routine
 
 def run():
     d = '(default: %(default)s)'
-    outputs = {'ul':'upper-limits.yml', 'cls':'cls.yml'}
+    outputs = {
+        'ul':'upper-limits.yml', 'cls':'cls.yml', 'cls+ul':'limits.yml'}
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('workspace_dir')
+    parser.add_argument('workspace_dir', nargs='?')
+    parser.add_argument(
+        '-c','--calc-type', choices=['cls', 'ul'], default=['cls'],
+        nargs='+', help=_calc_type_help + ' ' + d)
     parser.add_argument(
-        '-c','--calc-type', choices=outputs.keys(), default='cls',
-        help=d)
+        '-b','--backend', choices=_backends, default='histfactory',
+        help=_backend_help + ' ' + d)
+    counting = parser.add_argument_group('counting backend options')
+    counting.add_argument('-y','--yields-file', help=_yields_help)
+    counting.add_argument('-f','--fit-config', help=_fit_config_help)
+    yields_cache = counting.add_mutually_exclusive_group()
+    yields_cache.add_argument('--yields-cache', help=_cache_help)
+    yields_cache.add_argument(
+        '--no-yields-cache', action='store_true', help=_no_cache_help)
+    fit_version = counting.add_mutually_exclusive_group()
+    fit_version.add_argument('--blind', action='store_true')
+    fit_version.add_argument('--injection', action='store_true')
 
     # default output file depends on what you're running
     def_string = ', '.join('{}: {}'.format(*x) for x in outputs.iteritems())
     parser.add_argument(
         '-o','--output-file', help='defaults -- {}'.format(def_string))
+    parser.add_argument(
+        '-j','--jobs', type=int, default=1,
+        help='fit in this many worker processes ' + d)
+    parser.add_argument(
+        '--force', action='store_true',
+        help='refit workspaces even if they have saved results')
+    parser.add_argument(
+        '--no-warm-start', action='store_true', help=_no_warm_start_help)
+    parser.add_argument(
+        '-a', '--adaptive', action='store_true', help=_adaptive_help)
+    toys = parser.add_argument_group('toys')
+    toys.add_argument('-t', '--toys', type=int, default=0, metavar='N',
+                      help=_toys_help)
+    toys.add_argument('--toy-workers', type=int, default=1, metavar='N',
+                      help=_toy_workers_help + ' ' + d)
+    toys.add_argument('--toy-seed', type=int, default=1,
+                      help=_toy_seed_help + ' ' + d)
+    toys.add_argument('--hybrid', action='store_true', help=_hybrid_help)
+    toys.add_argument('--toy-budget', type=int, metavar='POINTS',
+                      help=_toy_budget_help)
+    toys.add_argument('--toy-references', type=int, default=0, metavar='N',
+                      help=_toy_references_help)
+    workers = parser.add_argument_group('worker recycling')
+    workers.add_argument('--worker-max-jobs', type=int, metavar='N',
+                         help=_max_jobs_help)
+    workers.add_argument('--worker-max-rss', type=float, metavar='MB',
+                         help=_max_rss_help)
+    parser.add_argument(
+        '-r','--results-db', default='fit-results.db',
+        help='save results here as they come in ' + d)
+    parser.add_argument('--profile', metavar='TRACE', help=_profile_help)
+    parser.add_argument('--status-file', help=_status_help)
+    parser.add_argument(
+        '--status-interval', type=float, default=30.0, metavar='SECONDS',
+        help=_status_interval_help + ' ' + d)
     config = parser.parse_args(sys.argv[1:])
+    config.calc_type = '+'.join(sorted(set(config.calc_type)))
+    if config.backend == 'counting':
+        if not (config.yields_file and config.fit_config):
+            parser.error('counting backend needs a yields and fit config')
+    elif not config.workspace_dir:
+        parser.error('need a workspace directory')
     if not config.output_file:
         config.output_file = outputs[config.calc_type]
+    if config.hybrid and not config.toys:
+        parser.error('--hybrid needs --toys')
+    if config.toy_budget is not None and not config.hybrid:
+        parser.error('--toy-budget only applies with --hybrid')
+    if config.toy_references:
+        if not config.toys or config.backend != 'counting':
+            parser.error('--toy-references needs --toys and -b counting')
+    if config.toys and config.backend == 'histfactory':
+        if config.calc_type != 'ul':
+            parser.error('histfactory toys are only used for upper limits')
+        # the fit workers can't start processes of their own
+        fit_workers = (config.jobs > 1 or config.worker_max_jobs or
+                       config.worker_max_rss)
+        if config.toy_workers > 1 and fit_workers:
+            parser.error("--toy-workers can't be used with fit workers")
+        _ul_options.update(n_toys=config.toys, n_workers=config.toy_workers,
+                           seed=config.toy_seed)
 
     # run the fits
-    _make_calc_file(config)
+    if config.profile:
+        profiling.enable(config.profile)
+    failed = _make_calc_file(config)
+    profiling.finish()
+    if failed:
+        sys.exit(1)
 
 # _________________________________________________________________________
 # file filters
@@ -56,62 +187,380 @@ def _is_prefit_nominal(workspace):
 # main routine
 
 def _make_calc_file(config):
-    cfg_dict = {}
-    # choose the calculator
-    calculate = {'ul':_get_ul, 'cls':_get_cls}[config.calc_type]
-    # ...and the filter
-    filt = {'ul': _is_prefit_nominal, 'cls': _is_prefit}[config.calc_type]
-
-    # loop over all the workspaces, fit them all
-    for base, dirs, files in walk(config.workspace_dir):
+    # choose the filter
+    filt = {
+        'ul': _is_prefit_nominal, 'cls': _is_prefit, 'cls+ul': _is_prefit,
+        }[config.calc_type]
+    if config.backend == 'counting':
+        jobs = _setup_counting(config)
+        store = None
+    else:
+        jobs = list(_get_workspaces(config.workspace_dir, filt))
+        store = ResultStore(config.results_db)
+
+    cfg_dict = {cfg: {} for cfg, _ in jobs}
+    seeds = None if config.no_warm_start else FitSeeds()
+    status = RunStatus('fitting', config.status_file, config.status_interval)
+    # in hybrid mode the first pass is asymptotic, then some points
+    # are redone with toys
+    toys = bool(config.toys) and not config.hybrid
+    cached = set()
+    failed = _run_pass(config, jobs, store, cfg_dict, seeds, status, toys,
+                       config.adaptive, cached)
+    if config.hybrid:
+        failed += _redo_with_toys(
+            config, jobs, store, cfg_dict, seeds, status, failed, cached)
+    status.finish()
+
+    with open(config.output_file,'w') as out_yml:
+        out_yml.write(yaml.dump(_flatten_cls_dict(cfg_dict)))
+    return failed
+
+def _run_pass(config, jobs, store, cfg_dict, seeds, status, toys,
+              adaptive, cached=None):
+    """
+    Fit every workspace in `jobs` (with toys if `toys` is set), adding
+    the results to `cfg_dict` and counting them in `status`. Fits start
+    from the closest point in `seeds`, if there are any. Workspaces
+    with results saved in `store` are added to `cached` (if given).
+    Returns a list of failed workspaces.
+    """
+    def add_point(cfg, fit_dict):
+        sp = fit_dict['scharm_mass'], fit_dict['lsp_mass']
+        cfg_dict[cfg].setdefault(sp,{}).update(fit_dict)
+
+    # look up anything that's already been fit, and save new results
+    # as they come in
+    if store:
+        settings = _get_settings(config.calc_type, toys)
+        ws_hashes = {ws: _get_ws_hash(ws) for _, ws in jobs}
+        todo = []
+        for cfg, ws_name in jobs:
+            saved = None
+            if not config.force:
+                saved = store.get(ws_hashes[ws_name], settings)
+            if saved is None:
+                todo.append((cfg, ws_name))
+            else:
+                add_point(cfg, saved)
+                if cached is not None:
+                    cached.add(ws_name)
+        print 'found {} of {} results in {}'.format(
+            len(jobs) - len(todo), len(jobs), config.results_db)
+        status.add(len(jobs) - len(todo))
+        status.skipped(len(jobs) - len(todo))
+    else:
+        todo = list(jobs)
+
+    # fit neighbouring points one after the other, so each fit can
+    # start from the best fit of the closest point already done
+    todo.sort(key=lambda job: (job[0], _get_mass_point(job[1])))
+    def get_start(cfg, ws_name):
+        if seeds is None:
+            return None
+        return seeds.closest(cfg, _get_mass_point(ws_name))
+    def save_point(cfg, ws_name, fit_dict, best_fit):
+        if store:
+            store.put(ws_hashes[ws_name], settings, ws_name, cfg, fit_dict)
+        add_point(cfg, fit_dict)
+        if seeds is not None:
+            seeds.add(cfg, _get_mass_point(ws_name), best_fit)
+
+    use_workers = (
+        config.jobs > 1 or config.worker_max_jobs or config.worker_max_rss)
+    # in adaptive mode the total grows as each round is picked
+    def run_fits(fit_jobs):
+        status.add(len(fit_jobs))
+        if use_workers:
+            return _fit_parallel(
+                config, fit_jobs, get_start, save_point, status, toys)
+        for cfg, workspace_name in fit_jobs:
+            print 'fitting {}'.format(workspace_name)
+            start = get_start(cfg, workspace_name)
+            fit_dict, best_fit = _calculate(
+                config.calc_type, workspace_name, start, toys)
+            save_point(cfg, workspace_name, fit_dict, best_fit)
+            status.completed()
+        return []
+
+    if adaptive:
+        return _fit_adaptive(jobs, todo, cfg_dict, run_fits)
+    return run_fits(todo)
+
+def _redo_with_toys(config, jobs, store, cfg_dict, seeds, status,
+                    failed, cached):
+    """
+    Redo the points in `cfg_dict` that need toys (see
+    `scharmfit.hybrid`), up to `config.toy_budget` of them. The toy
+    results replace the asymptotic ones. The `failed` and `cached`
+    workspaces from the asymptotic pass are needed to count each
+    workspace once in `status`. Returns a list of failed workspaces.
+    """
+    from scharmfit.hybrid import pick_toy_points
+    results = {}
+    for cfg, pt_dict in cfg_dict.iteritems():
+        for point, fit_dict in pt_dict.iteritems():
+            results[cfg, point] = fit_dict
+    picked = set(pick_toy_points(results, config.toy_budget))
+    print 'redoing {} of {} points with toys'.format(
+        len(picked), len(results))
+    toy_jobs = [(cfg, ws_name) for cfg, ws_name in jobs
+                if (cfg, _get_mass_point(ws_name)) in picked]
+    # these get counted again as they're redone
+    ws_names = [ws_name for _, ws_name in toy_jobs]
+    n_failed = len(set(ws_names) & set(failed))
+    n_cached = len(set(ws_names) & cached)
+    status.retract('failed', n_failed)
+    status.retract('skipped', n_cached)
+    status.retract('completed', len(ws_names) - n_failed - n_cached)
+    return _run_pass(config, toy_jobs, store, cfg_dict, seeds, status,
+                     True, False)
+
+def _get_workspaces(workspace_dir, filt):
+    """yields (config_name, workspace_name) for every workspace to fit"""
+    for base, dirs, files in walk(workspace_dir):
         if not dirs and files:
             workspaces = filter(filt,glob.glob(join(base, '*.root')))
             # the configuration name (key under which the fit result
             # is saved) is the path from the directory we run on to
             # the directory where the workspaces are found.
             cfg = base
-            if base != config.workspace_dir:
-                cfg = relpath(base, config.workspace_dir)
-            all_pts = {}
+            if base != workspace_dir:
+                cfg = relpath(base, workspace_dir)
             for workspace_name in workspaces:
-                print 'fitting {}'.format(workspace_name)
-                fit_dict = calculate(workspace_name.strip())
-                fit_dict.update(_get_sp_dict(workspace_name))
-                sp = fit_dict['scharm_mass'], fit_dict['lsp_mass']
-                all_pts.setdefault(sp,{}).update(fit_dict)
-            cfg_dict[cfg] = all_pts
+                yield cfg, workspace_name.strip()
 
-    with open(config.output_file,'w') as out_yml:
-        out_yml.write(yaml.dump(_flatten_cls_dict(cfg_dict)))
+def _fit_parallel(config, jobs, get_start, save_point, status, toys=False):
+    """
+    Run the fits in `config.jobs` worker processes (with toys if `toys`
+    is set), pass the results to `save_point` as they come in, and
+    count them in `status`. Each fit starts from
+    `get_start(config, workspace)`, which is called as the fit is sent
+    to a worker. Returns a list of failed workspaces.
+    """
+    from scharmfit.parallel import run_jobs
+    arg_list = [(config.calc_type, ws_name) for _, ws_name in jobs]
+    ws_cfg = {ws_name: cfg for cfg, ws_name in jobs}
+    def add_start(args):
+        calc_type, ws_name = args
+        start = get_start(ws_cfg[ws_name], ws_name)
+        return calc_type, ws_name, start, toys
+    failed = []
+    outputs = run_jobs(_calculate, arg_list, config.jobs,
+                       max_tasks=config.worker_max_jobs,
+                       max_rss=config.worker_max_rss,
+                       report=_report_worker, prepare=add_start,
+                       monitor=lambda stats: status.add_rss(stats.peak_rss))
+    for (_, workspace_name, _, _), result, error in outputs:
+        if error:
+            sys.stderr.write('failed fitting {}:\n{}'.format(
+                    workspace_name, error))
+            failed.append(workspace_name)
+            status.failed()
+        else:
+            print 'fitted {}'.format(workspace_name)
+            fit_dict, best_fit = result
+            save_point(ws_cfg[workspace_name], workspace_name, fit_dict,
+                       best_fit)
+            status.completed()
+    if failed:
+        sys.stderr.write('{} of {} fits failed:\n'.format(
+                len(failed), len(jobs)))
+        for workspace_name in failed:
+            sys.stderr.write('  {}\n'.format(workspace_name))
+    return failed
+
+def _fit_adaptive(jobs, todo, cfg_dict, run_fits):
+    """
+    Fit the points in `todo` round by round, as picked by a
+    `ContourRefiner` for each configuration. Points in `jobs` but not
+    in `todo` are already in `cfg_dict`. The points that don't get fit
+    are added to `cfg_dict` with an `inferred` flag. Returns a list of
+    failed workspaces.
+    """
+    from scharmfit.contour import ContourRefiner
+    # all the workspaces (nominal, up, down...) for each point are fit
+    # together
+    point_jobs = {}
+    for cfg, ws_name in todo:
+        point = cfg, _get_mass_point(ws_name)
+        point_jobs.setdefault(point, []).append((cfg, ws_name))
+    cfg_points = {}
+    for cfg, ws_name in jobs:
+        cfg_points.setdefault(cfg, set()).add(_get_mass_point(ws_name))
+    refiners = {}
+    for cfg, points in cfg_points.iteritems():
+        refiners[cfg] = ContourRefiner(points)
+        for point in points:
+            if (cfg, point) not in point_jobs:
+                refiners[cfg].add_result(point, cfg_dict[cfg][point])
+
+    failed = []
+    while True:
+        fitting = []
+        for cfg, refiner in sorted(refiners.iteritems()):
+            fitting += [(cfg, pt) for pt in refiner.next_points()]
+        if not fitting:
+            break
+        print 'fitting {} points near the contour'.format(len(fitting))
+        failed += run_fits(sum((point_jobs[pt] for pt in fitting), []))
+        for cfg, point in fitting:
+            # failed fits are added empty, their neighbours get fit
+            refiners[cfg].add_result(point, cfg_dict[cfg].get(point, {}))
+
+    n_inferred = 0
+    for cfg, refiner in refiners.iteritems():
+        for (schs, lsps), fit_dict in refiner.inferred().iteritems():
+            fit_dict.update(scharm_mass=schs, lsp_mass=lsps, inferred=True)
+            cfg_dict[cfg][schs, lsps] = fit_dict
+            n_inferred += 1
+    print 'inferred {} of {} points'.format(
+        n_inferred, sum(len(pts) for pts in cfg_points.itervalues()))
+    return failed
+
+def _report_worker(worker_stats):
+    print worker_stats
 
 _sp_re = re.compile('scharm-([0-9]+)-([0-9]+)_')
 def _get_sp_dict(workspace_name):
     """gets a dictionary describing the signal point"""
+    schs, lsps = _get_mass_point(workspace_name)
+    return {'scharm_mass': schs, 'lsp_mass': lsps}
+
+def _get_mass_point(workspace_name):
+    """(scharm, lsp) mass tuple"""
     schs, lsps = _sp_re.search(workspace_name).group(1,2)
-    return {'scharm_mass': int(schs), 'lsp_mass': int(lsps)}
+    return int(schs), int(lsps)
 
 def _flatten_cls_dict(cls_dict):
     """flattens cls_dict to return {region: [ params, ... ], ...} dict"""
     flat_dict = {}
     for region, pt_dict in cls_dict.iteritems():
-        for params in pt_dict.itervalues():
-            flat_dict.setdefault(region,[]).append(params)
+        # sorted so the output doesn't depend on the order points were fit
+        for sp in sorted(pt_dict):
+            flat_dict.setdefault(region,[]).append(pt_dict[sp])
     return flat_dict
 
 # __________________________________________________________________________
 # calculate functions (very thin wrapper on the imported calculators)
 
-def _get_ul(workspace_name):
-    ul_calc = UpperLimitCalc()
-    upper_limit = ul_calc.observed_upper_limit(workspace_name)
+def _calculate(calc_type, workspace_name, start=None, toys=False):
+    """
+    run the `calc_type` calculator (with toys if `toys` is set), add
+    the signal point info, the method used, and the libSusyFitter
+    timing (if SUSYFIT_TIMING is set). Returns the result and the best
+    fit parameters (to start other fits from).
+    """
+    with profiling.stage('fit', workspace=workspace_name):
+        if workspace_name in _counting_jobs:
+            calc, fit_dict = _get_counting(
+                calc_type, workspace_name, start, toys)
+        else:
+            calculate = {
+                'ul':_get_ul, 'cls':_get_cls, 'cls+ul':_get_all}[calc_type]
+            reset_fit_timing()
+            calc, fit_dict = calculate(workspace_name, start, toys)
+            fit_timing = get_fit_timing()
+            if fit_timing is not None:
+                fit_dict['fit_timing'] = fit_timing
+    fit_dict.update(_get_sp_dict(workspace_name))
+    fit_dict['method'] = 'toys' if toys else 'asymptotic'
+    if calc.sr_background is not None:
+        fit_dict['sr_background'] = calc.sr_background
+    return fit_dict, calc.best_fit
+
+def _get_ws_hash(workspace_name):
+    """
+    Hash of the workspace contents. The file name is included too,
+    since the calculators use it to decide what to return.
+    """
+    return fprint.get_fingerprint(
+        fprint.file_hash(workspace_name), basename(workspace_name))
+
+def _get_settings(calc_type, toys=False):
+    """the settings used to identify saved results"""
+    if calc_type == 'ul':
+        calc = _make_ul_calc(toys)
+    else:
+        calc = {'cls': CLsCalc, 'cls+ul': MultiCalc}[calc_type]()
+    settings = calc.get_settings()
+    from scharmfit import calculators
+    code_version = fprint.code_version(calculators.__file__, __file__)
+    settings.update(calc=calc_type, code_version=code_version)
+    return settings
+
+# toy options for the upper limit calculator, set from the command line
+_ul_options = {}
+
+def _make_ul_calc(toys=False):
+    return UpperLimitCalc(**(_ul_options if toys else {}))
+
+def _get_ul(workspace_name, start, toys):
+    ul_calc = _make_ul_calc(toys)
+    upper_limit = ul_calc.observed_upper_limit(workspace_name, start)
     ul_dict = {
         'ul': upper_limit,
         }
-    return ul_dict
+    return ul_calc, ul_dict
 
-def _get_cls(workspace_name):
+def _get_cls(workspace_name, start, toys):
     calc = CLsCalc()
-    return calc.calculate_cls(workspace_name)
+    return calc, calc.calculate_cls(workspace_name, start)
+
+def _get_all(workspace_name, start, toys):
+    calc = MultiCalc()
+    return calc, calc.calculate(workspace_name, start)
+
+# The counting backend doesn't have workspaces, instead we make up a
+# name for each (configuration, signal point), in the same form as
+# the workspace name. The calculators for each job (keyed by whether
+# they use toys) are kept here, so workers forked from this process
+# can use them.
+_counting_jobs = {}
+
+def _setup_counting(config):
+    """
+    Build one calculator per fit configuration, return a list of
+    (configuration name, job name) for all the points to fit.
+    """
+    from scharmfit.workspace import get_signal_points_and_backgrounds
+    from scharmfit.yieldcache import load_yields, default_cache_dir
+    cache_dir = None
+    if not config.no_yields_cache:
+        cache_dir = config.yields_cache or default_cache_dir()
+    with profiling.stage('yaml.load'):
+        yields = load_yields(config.yields_file, cache_dir)
+    with open(config.fit_config) as cfg_yml:
+        fit_configs = yaml.load(cfg_yml)
+    misc_config = dict(
+        blind=config.blind, injection=config.injection,
+        signal_systematic=None)
+
+    signal_points, _ = get_signal_points_and_backgrounds(yields)
+    jobs = []
+    for cfg_name, fit_config in sorted(fit_configs.iteritems()):
+        calcs = {False: CountingCLsCalc(yields, fit_config, misc_config)}
+        if config.toys:
+            calcs[True] = CountingCLsCalc(
+                yields, fit_config, misc_config, n_toys=config.toys,
+                seed=config.toy_seed, n_reference=config.toy_references)
+        for signal_point in sorted(signal_points):
+            job_name = join(cfg_name, signal_point + '_counting')
+            _counting_jobs[job_name] = (calcs, signal_point)
+            jobs.append((cfg_name, job_name))
+    return jobs
+
+def _get_counting(calc_type, job_name, start, toys):
+    calcs, signal_point = _counting_jobs[job_name]
+    calc = calcs[toys]
+    fit_dict = {}
+    if 'cls' in calc_type.split('+'):
+        fit_dict.update(calc.calculate_cls(signal_point, start))
+    if 'ul' in calc_type.split('+'):
+        fit_dict.update(calc.upper_limits(signal_point, start))
+    return calc, fit_dict
 
 if __name__ == '__main__':
+    # run in the server, if there is one (see scharmfit.daemon)
+    forward(__file__)
     run()
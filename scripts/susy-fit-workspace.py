@@ -9,15 +9,41 @@ _after_fit = "produce and 'afterFit' files"
 _upper_limits = "produce histfitter 'upper limit' stuff"
 _up_help = 'do upward variant of signal theory'
 _down_help = 'do downward variant of signal theory'
+_theory_np_help = (
+    'add the signal theory uncertainty as a nuisance parameter, '
+    'rather than booking up / down variations')
 _sub_help = 'only use subset of fit configurations'
+_jobs_help = 'book workspaces in this many worker processes (%(default)s)'
+_force_help = 'rebuild workspaces even if their inputs are unchanged'
+_max_jobs_help = (
+    'replace each worker process after booking this many workspaces')
+_max_rss_help = (
+    'replace a worker process once it uses more than this many MB')
+_cache_help = (
+    'directory to cache the parsed yields in '
+    '(default: ~/.cache/scharmfit/yields)')
+_no_cache_help = "don't cache the parsed yields"
+_profile_help = (
+    'time each stage of the booking, write a chrome trace here and '
+    'print the slowest stages')
+_status_help = (
+    'write the progress (points done / failed / skipped, throughput, '
+    'ETA, memory) here, as json, or as a Prometheus textfile if the '
+    'name ends in .prom')
+_status_interval_help = 'seconds between progress updates (%(default)s)'
 
 import argparse, re, sys, os
 from os.path import isfile, isdir, join, dirname
 from itertools import chain
 import yaml
 import warnings
-from scharmfit.workspace import Workspace, do_upper_limits, DISCOVERY
+from scharmfit.workspace import WorkspaceTemplate, do_upper_limits, DISCOVERY
+from scharmfit.workspace import Workspace
+from scharmfit import fingerprint as fprint
 from scharmfit.workspace import get_signal_points_and_backgrounds
+from scharmfit import profiling
+from scharmfit.daemon import forward
+from scharmfit.progress import RunStatus
 
 def run():
     d = 'default: %(default)s'
@@ -38,15 +64,46 @@ def run():
     fit_version.add_argument('--injection', action='store_true')
     fit_version.add_argument('--up', const='up', help=_up_help, **sigop)
     fit_version.add_argument('--down', const='down', help=_down_help, **sigop)
+    parser.add_argument('--signal-theory-np', action='store_true',
+                        help=_theory_np_help)
     hf_action = parser.add_mutually_exclusive_group()
     hf_action.add_argument('-f', '--after-fit', action='store_true',
                            help=_after_fit)
     hf_action.add_argument('-l', '--upper-limit', action='store_true',
                            help=_upper_limits)
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help=_jobs_help)
+    parser.add_argument('--force', action='store_true', help=_force_help)
+    workers = parser.add_argument_group(
+        'worker recycling (HistFactory leaks memory with every workspace)')
+    workers.add_argument('--worker-max-jobs', type=int, metavar='N',
+                         help=_max_jobs_help)
+    workers.add_argument('--worker-max-rss', type=float, metavar='MB',
+                         help=_max_rss_help)
+    yields_cache = parser.add_mutually_exclusive_group()
+    yields_cache.add_argument('--yields-cache', help=_cache_help)
+    yields_cache.add_argument(
+        '--no-yields-cache', action='store_true', help=_no_cache_help)
+    parser.add_argument('--profile', metavar='TRACE', help=_profile_help)
+    parser.add_argument('--status-file', help=_status_help)
+    parser.add_argument('--status-interval', type=float, default=30.0,
+                        metavar='SECONDS', help=_status_interval_help)
     # parse inputs and run
     args = parser.parse_args(sys.argv[1:])
-    _book_workspaces(args)
+    if args.signal_theory_np and args.signal_systematic:
+        parser.error("--signal-theory-np replaces --up and --down")
+    args.use_workers = (
+        args.jobs > 1 or args.worker_max_jobs or args.worker_max_rss)
+    if args.use_workers and args.upper_limit:
+        # the upper limit routine reads HistFitter globals that are
+        # filled while booking, these would be stuck in the workers.
+        parser.error("can't calculate upper limits in worker processes")
+    if args.profile:
+        profiling.enable(args.profile)
+    failed = _book_workspaces(args)
+    profiling.finish()
+    if failed:
+        sys.exit(1)
 
 # _________________________________________________________________________
 # main workspace booking function
@@ -54,8 +111,8 @@ def run():
 def _book_workspaces(args):
     """book one workspace for each signal point"""
 
-    with open(args.yields_file) as yields_yml:
-        yields = yaml.load(yields_yml)
+    with profiling.stage('yaml.load'):
+        yields = _load_yields(args)
 
     # get / generate the fit configuration
     fit_configs = _get_config(args.fit_config, yields, args.subset)
@@ -76,24 +133,39 @@ def _book_workspaces(args):
     cl_config = dict(do_hf=run_histfitter)
     pass_options = [
         'out_dir', 'debug', 'verbose', 'blind', 'injection',
-        'signal_systematic']
+        'signal_systematic', 'signal_theory_np']
     cl_config.update({x:getattr(args, x) for x in pass_options})
+    # upper limits need all the fits to be booked in this process
+    cl_config['force'] = args.force or args.upper_limit
 
     # loop ovar all signal points and fit configurations.
+    jobs = []
     for cfg in fit_configs.iteritems():
         cfg_name, fit_cfg = cfg
-
-        print 'booking background with config {}'.format(cfg_name)
-        _book_background_fits(yields, cfg, cl_config)
+        jobs += [(sp, cfg) for sp in _background_points]
 
         # skip signal points if doing 'up' or 'down' with no given sig systs
         if not fit_cfg.get('signal_systematics') and args.signal_systematic:
             continue
 
-        for signal_point in signal_points:
-            print 'booking signal point {} with {} config'.format(
-                signal_point, cfg_name)
-            _book_signal_point(yields, signal_point, cfg, cl_config)
+        jobs += [(sp, cfg) for sp in signal_points]
+
+    status = RunStatus('booking', args.status_file, args.status_interval)
+    status.add(len(jobs))
+    if args.use_workers:
+        failed = _book_parallel(yields, jobs, cl_config, args, status)
+    else:
+        failed = []
+        for signal_point, cfg in jobs:
+            _print_booking(signal_point, cfg)
+            with _booking_stage(signal_point, cfg):
+                booked = _book_signal_point(
+                    yields, signal_point, cfg, cl_config)
+            if booked:
+                status.completed()
+            else:
+                status.skipped()
+    status.finish()
 
     # this relies on HistFitter's global variables, has to be run
     # after booking a bunch of workspaces.
@@ -101,31 +173,105 @@ def _book_workspaces(args):
         pfx = args.signal_systematic or 'nominal'
         dirpfx = join(dirname(args.fit_config), pfx)
         print 'calculating {} upper limits (may take a while)'.format(dirpfx)
-        do_upper_limits(verbose=args.verbose, prefix=dirpfx)
-
-def _book_background_fits(yields, cfg, cl_config):
-    """various types of 'background only' fits"""
-
-    # everything here calls the method below, with some special version
-    # of the signal point
+        with profiling.stage('upper limits'):
+            do_upper_limits(verbose=args.verbose, prefix=dirpfx)
+
+    return failed
+
+# various types of 'background only' fits, these are booked with the
+# same function as the signal points, using a special signal point:
+_background_points = [
+    '',                         # no point (but use SR in fit)
+    'CR_ONLY',                  # don't use SR in fit
+    DISCOVERY,                  # set signal to 1 in SR only
+    ]
+
+def _print_booking(signal_point, fit_configuration):
+    cfg_name = fit_configuration[0]
+    if signal_point in _background_points:
+        print 'booking background ({}) with config {}'.format(
+            signal_point or 'srcr', cfg_name)
+    else:
+        print 'booking signal point {} with {} config'.format(
+            signal_point, cfg_name)
 
-    # blank signal point means no point (but use SR in fit)
-    _book_signal_point(yields, '', cfg, cl_config)
-    # 'CR_ONLY' means don't use SR in fit
-    _book_signal_point(yields, 'CR_ONLY', cfg, cl_config)
-    # DISCOVERY means set signal to 1 in SR only
-    _book_signal_point(yields, DISCOVERY, cfg, cl_config)
+def _booking_stage(signal_point, fit_configuration):
+    return profiling.stage('book', signal_point=signal_point or 'background',
+                           config=fit_configuration[0])
 
+# _________________________________________________________________________
+# parallel booking
+
+# The yields are handed to each worker once when it starts (rather
+# than pickled with every job), and kept here.
+_worker_yields = None
+def _init_worker(yields):
+    global _worker_yields
+    _worker_yields = yields
+
+def _book_in_worker(signal_point, fit_configuration, cl_config):
+    _print_booking(signal_point, fit_configuration)
+    with _booking_stage(signal_point, fit_configuration):
+        return _book_signal_point(
+            _worker_yields, signal_point, fit_configuration, cl_config)
+
+def _book_parallel(yields, jobs, cl_config, args, status):
+    """
+    Book all the (signal_point, fit_configuration) `jobs` in worker
+    processes, counting them in `status`. Failing jobs don't stop the
+    others, instead a list of the failed jobs is returned.
+    """
+    from scharmfit.parallel import run_jobs
+    arg_list = [(sp, cfg, cl_config) for sp, cfg in jobs]
+    failed = []
+    outputs = run_jobs(_book_in_worker, arg_list, args.jobs,
+                       initializer=_init_worker, initargs=(yields,),
+                       max_tasks=args.worker_max_jobs,
+                       max_rss=args.worker_max_rss,
+                       report=_report_worker,
+                       monitor=lambda stats: status.add_rss(stats.peak_rss))
+    for (signal_point, cfg, _), booked, error in outputs:
+        if error:
+            sys.stderr.write('failed booking {!r} with {} config:\n{}'.format(
+                    signal_point, cfg[0], error))
+            failed.append((signal_point, cfg[0]))
+            status.failed()
+        elif booked:
+            status.completed()
+        else:
+            status.skipped()
+    if failed:
+        sys.stderr.write('{} of {} workspaces failed:\n'.format(
+                len(failed), len(jobs)))
+        for signal_point, cfg_name in failed:
+            sys.stderr.write('  {!r} with {} config\n'.format(
+                    signal_point, cfg_name))
+    return failed
+
+def _report_worker(worker_stats):
+    print worker_stats
 
 def _book_signal_point(yields, signal_point, fit_configuration, cl_config):
     """
     Book the workspace for one signal point. If the point is '' we run
-    a background only fit.
+    a background only fit. Returns False if the workspace was already
+    up to date.
     """
     cfg_name, fit_config = fit_configuration
+    out_dir = join(cl_config['out_dir'], cfg_name)
+
+    # skip anything that was already built from the same inputs
+    fingerprint = _get_fingerprint(
+        yields, signal_point, fit_configuration, cl_config)
+    ws_path = join(out_dir, _get_ws_name(signal_point, fit_config, cl_config))
+    if not cl_config['force'] and fprint.is_current(ws_path, fingerprint):
+        print 'skipping {}, already up to date'.format(ws_path)
+        return False
+    fprint.clear(ws_path)
+
     import ROOT
     # TODO: this leaks memory like crazy, known HistFactory bug
-    fit = Workspace(yields, fit_config, cl_config)
+    fit = _get_template(yields, fit_configuration, cl_config).get_workspace()
 
     fit_sr = True
     # hackish way to specify no signal point AND no signal region
@@ -145,21 +291,102 @@ def _book_signal_point(yields, signal_point, fit_configuration, cl_config):
         for vr in fit_config.get('validation_regions', []):
             fit.add_vr(vr)
 
-    out_dir = join(cl_config['out_dir'], cfg_name)
     if not isdir(out_dir):
         os.makedirs(out_dir)
 
     fit.save_workspace(out_dir)
 
-    if not cl_config['do_hf']:
-        return
+    if cl_config['do_hf']:
+        # here be black magic
+        fit.do_histfitter_magic(out_dir, verbose=cl_config['verbose'])
 
-    # here be black magic
-    fit.do_histfitter_magic(out_dir, verbose=cl_config['verbose'])
+    fprint.record(ws_path, fingerprint)
+    return True
+
+def _get_ws_name(signal_point, fit_config, cl_config):
+    """name of the workspace _book_signal_point will write"""
+    fit_sr = signal_point != 'CR_ONLY' and bool(fit_config['signal_regions'])
+    if signal_point == 'CR_ONLY':
+        signal_point = ''
+    sign = {'up':1, 'down':-1}.get(cl_config['signal_systematic'], 0)
+    return Workspace.get_ws_name(signal_point, fit_sr, sign)
+
+# _________________________________________________________________________
+# fingerprints (to skip workspaces that are already up to date)
+
+# all the command line options that change the workspace
+_fingerprint_options = [
+    'blind', 'injection', 'signal_systematic', 'signal_theory_np', 'do_hf']
+
+# Hashes of the yields used by each fit configuration, as a tuple
+# (backgrounds in fit regions, validation regions, {signal point: hash})
+_yields_hashes = {}
+_code_version = []
+
+def _get_fingerprint(yields, signal_point, fit_configuration, cl_config):
+    """hash all the inputs that go into one workspace"""
+    cfg_name, fit_config = fit_configuration
+    if cfg_name not in _yields_hashes:
+        _yields_hashes[cfg_name] = _hash_yields(yields, fit_config)
+    common, validation, signals = _yields_hashes[cfg_name]
+    if not _code_version:
+        from scharmfit import workspace, systematics
+        _code_version.append(fprint.code_version(
+                workspace.__file__, systematics.__file__, __file__))
+
+    options = [cl_config[opt] for opt in _fingerprint_options]
+    parts = [_code_version[0], fit_config, options, signal_point, common]
+    if signal_point in _background_points:
+        parts.append(validation)
+    else:
+        parts.append(signals.get(signal_point))
+    return fprint.get_fingerprint(*parts)
+
+def _hash_yields(yields, fit_config):
+    # only include the systematics this configuration can use
+    wanted = set(fit_config['systematics'])
+    wanted |= set(fit_config.get('signal_systematics', []))
+    def used(syst):
+        return syst in wanted or _strip_updown(syst) in wanted
+    yields = {
+        key: section if key == _nom_yields_key else {
+            syst: section[syst] for syst in section if used(syst)}
+        for key, section in yields.iteritems()}
+
+    fit_regions = fit_config['signal_regions'] + fit_config['control_regions']
+    signal_points = set(get_signal_points_and_backgrounds(yields)[0])
+    is_signal = signal_points.__contains__
+    common, signals = fprint.split_yields(yields, fit_regions, is_signal)
+    validation, _ = fprint.split_yields(
+        yields, fit_config.get('validation_regions', []), is_signal)
+    signal_hashes = {
+        sp: fprint.get_fingerprint(syields)
+        for sp, syields in signals.iteritems()}
+    return (fprint.get_fingerprint(common), fprint.get_fingerprint(validation),
+            signal_hashes)
+
+# Everything that doesn't depend on the signal point is only built once
+# per fit configuration (and process), and kept here.
+_templates = {}
+def _get_template(yields, fit_configuration, cl_config):
+    cfg_name, fit_config = fit_configuration
+    if cfg_name not in _templates:
+        _templates[cfg_name] = WorkspaceTemplate(
+            yields, fit_config, cl_config)
+    return _templates[cfg_name]
 
 # _______________________________________________________________________
 # helpers
 
+def _load_yields(args):
+    """read the yields file, through the cache unless it's turned off"""
+    if args.no_yields_cache:
+        with open(args.yields_file) as yields_yml:
+            return yaml.load(yields_yml)
+    from scharmfit.yieldcache import load_yields, default_cache_dir
+    cache_dir = args.yields_cache or default_cache_dir()
+    return load_yields(args.yields_file, cache_dir)
+
 _nom_yields_key = 'nominal_yields'
 _syst_yields_key = 'yield_systematics'
 def _get_config(cfg_name, yields_dict, subset=None):
@@ -209,12 +436,15 @@ def _get_config(cfg_name, yields_dict, subset=None):
 def _all_syst_from_yields(yields_dict):
     """return the systematic variations, with up / down stripped off"""
     all_syst = set(yields_dict[_syst_yields_key].iterkeys())
-    def _strip(syst):
-        for suffix in ['up','down']:
-            if syst.endswith(suffix):
-                return syst[:-len(suffix)]
-        return syst
-    return set(_strip(x) for x in all_syst)
+    return set(_strip_updown(x) for x in all_syst)
+
+def _strip_updown(syst):
+    for suffix in ['up','down']:
+        if syst.endswith(suffix):
+            return syst[:-len(suffix)]
+    return syst
 
 if __name__ == '__main__':
+    # run in the server, if there is one (see scharmfit.daemon)
+    forward(__file__)
     run()
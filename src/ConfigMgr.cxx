@@ -8,6 +8,7 @@
 
 //SusyFitter includes
 #include "TMsgLogger.h"
+#include "FitTimer.h"
 #include "ConfigMgr.h"
 #include "Utils.h"
 #include "StatTools.h"
@@ -401,6 +402,7 @@ void ConfigMgr::doUpperLimit(int i) {
 }
 
 void ConfigMgr::doUpperLimit(FitConfig* fc) {
+    FitTimer::Scope timer("doUpperLimit");
     TString outfileName = m_outputFileName;
     outfileName.ReplaceAll(".root","_upperlimit.root");
     TFile* outfile = TFile::Open(outfileName,"UPDATE");
@@ -0,0 +1,127 @@
+// vim: ts=4:sw=4
+#include "FitTimer.h"
+
+#include "RooFitResult.h"
+#include "TStopwatch.h"
+#include "TString.h"
+
+#include <cstdlib>
+#include <cstring>
+#include <map>
+#include <sstream>
+
+namespace {
+    struct PhaseStats {
+        PhaseStats() : calls(0), wall(0), cpu(0) {}
+        long calls;
+        double wall;
+        double cpu;
+    };
+
+    // -1 until the environment has been read
+    int s_enabled = -1;
+    std::map<std::string, PhaseStats> s_phases;
+    std::map<std::string, long> s_counters;
+
+    // phase and counter names are ours, but quote them properly anyway
+    std::string jsonString(const std::string& str) {
+        std::string out = "\"";
+        for (unsigned int i = 0; i < str.size(); i++) {
+            if (str[i] == '"' || str[i] == '\\') out += '\\';
+            out += str[i];
+        }
+        return out + "\"";
+    }
+}
+
+//________________________________________________________________________________________________
+bool FitTimer::Enabled() {
+    if (s_enabled < 0) {
+        const char* env = std::getenv("SUSYFIT_TIMING");
+        s_enabled = (env && *env && std::strcmp(env, "0") != 0) ? 1 : 0;
+    }
+    return s_enabled;
+}
+
+//________________________________________________________________________________________________
+void FitTimer::Enable(bool enable) {
+    s_enabled = enable ? 1 : 0;
+}
+
+//________________________________________________________________________________________________
+void FitTimer::Reset() {
+    s_phases.clear();
+    s_counters.clear();
+}
+
+//________________________________________________________________________________________________
+void FitTimer::AddTime(const char* phase, double wall, double cpu) {
+    if (!Enabled()) return;
+    PhaseStats& stats = s_phases[phase];
+    stats.calls++;
+    stats.wall += wall;
+    stats.cpu += cpu;
+}
+
+//________________________________________________________________________________________________
+void FitTimer::Count(const char* counter, long n) {
+    if (!Enabled()) return;
+    s_counters[counter] += n;
+}
+
+//________________________________________________________________________________________________
+void FitTimer::CountFit(int status) {
+    if (!Enabled()) return;
+    Count("susyfit_minimizations");
+    Count(Form("susyfit_minuit_status_%d", status));
+}
+
+//________________________________________________________________________________________________
+void FitTimer::CountFit(const RooFitResult* result) {
+    if (!Enabled() || !result) return;
+    CountFit(result->status());
+    Count("initial_fit_invalid_nll_evaluations", result->numInvalidNLL());
+}
+
+//________________________________________________________________________________________________
+std::string FitTimer::Report() {
+    std::ostringstream out;
+    out.precision(9);
+    out << "{\"phases\": {";
+    std::map<std::string, PhaseStats>::const_iterator phase;
+    for (phase = s_phases.begin(); phase != s_phases.end(); ++phase) {
+        if (phase != s_phases.begin()) out << ", ";
+        out << jsonString(phase->first) << ": {\"calls\": " << phase->second.calls
+            << ", \"wall\": " << phase->second.wall
+            << ", \"cpu\": " << phase->second.cpu << "}";
+    }
+    out << "}, \"counters\": {";
+    std::map<std::string, long>::const_iterator counter;
+    for (counter = s_counters.begin(); counter != s_counters.end(); ++counter) {
+        if (counter != s_counters.begin()) out << ", ";
+        out << jsonString(counter->first) << ": " << counter->second;
+    }
+    out << "}}";
+    return out.str();
+}
+
+//________________________________________________________________________________________________
+FitTimer::Scope::Scope(const char* phase) : m_phase(phase), m_watch(0) {
+    if (!Enabled()) return;
+    m_watch = new TStopwatch();
+    m_watch->Start();
+}
+
+//________________________________________________________________________________________________
+FitTimer::Scope::~Scope() {
+    Stop();
+}
+
+//________________________________________________________________________________________________
+void FitTimer::Scope::Stop() {
+    if (!m_watch) return;
+    m_watch->Stop();
+    AddTime(m_phase.c_str(), m_watch->RealTime(), m_watch->CpuTime());
+    delete m_watch;
+    m_watch = 0;
+}
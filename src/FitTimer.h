@@ -0,0 +1,51 @@
+// vim: ts=4:sw=4
+#ifndef FITTIMER_H
+#define FITTIMER_H
+
+#include <string>
+
+class RooFitResult;
+class TStopwatch;
+
+// Opt-in timers and counters for the fitting phases (Asimov generation,
+// initial fits, the inverter scan, ...). Nothing is recorded unless the
+// environment variable SUSYFIT_TIMING is set to something other than
+// "0", or Enable() is called. The results accumulate until Reset(),
+// Report() returns them as a json string so they can be read from
+// python after each call.
+namespace FitTimer {
+    bool Enabled();
+    void Enable(bool enable=true);
+    void Reset();
+
+    // add one call to `phase`, taking `wall` and `cpu` seconds
+    void AddTime(const char* phase, double wall, double cpu);
+    // add `n` to a counter
+    void Count(const char* counter, long n=1);
+    // count one minimization and its Minuit status. Only the fits run
+    // here (the HypoTestTool initial fit, FitPdf, doFreeFit) are
+    // counted, the ones inside the RooStats calculators and test
+    // statistics only show up in the phase timers.
+    void CountFit(int status);
+    // also adds the invalid NLL evaluations in `result` (only the
+    // initial fit saves one)
+    void CountFit(const RooFitResult* result);
+
+    // {"phases": {name: {"calls", "wall", "cpu"}}, "counters": {name: n}}
+    std::string Report();
+
+    // times the phase from construction to Stop() or destruction
+    class Scope {
+        public:
+            Scope(const char* phase);
+            ~Scope();
+            void Stop();
+        private:
+            Scope(const Scope&);
+            Scope& operator=(const Scope&);
+            std::string m_phase;
+            TStopwatch* m_watch;
+    };
+}
+
+#endif
@@ -7,6 +7,7 @@
 
 #include "HypoTestTool.h"
 #include "TMsgLogger.h"
+#include "FitTimer.h"
 
 #include "TSystem.h"
 #include "TFile.h"
@@ -294,7 +295,11 @@ RooStats::HypoTestTool::RunHypoTestInverter(RooWorkspace * w,
 
     TStopwatch tw; 
     tw.Start();
-    HypoTestInverterResult * r = m_calc->GetInterval();
+    HypoTestInverterResult * r = 0;
+    {
+        FitTimer::Scope timer("inverter scan");
+        r = m_calc->GetInterval();
+    }
 
     m_logger << kINFO << "Time to perform limit scan \n";
     tw.Print();
@@ -348,7 +353,11 @@ RooStats::HypoTestTool::RunHypoTest(RooWorkspace * w, bool doUL,
 
     TStopwatch tw; 
     tw.Start();
-    HypoTestResult * r = m_hc->GetHypoTest();
+    HypoTestResult * r = 0;
+    {
+        FitTimer::Scope timer("hypothesis test");
+        r = m_hc->GetHypoTest();
+    }
     tw.Print();
 
     m_logger << kINFO << ">>> Done running HypoTestCalculator on the workspace " << w->GetName() << GEndl;
@@ -523,13 +532,20 @@ RooStats::HypoTestTool::SetupHypoTestCalculator(RooWorkspace * w, bool doUL,
         TStopwatch tw;
         tw.Start();
         Bool_t verbose = (m_logger.GetMinLevel() <= kDEBUG) ? kTRUE : kFALSE;
-        RooFitResult * fitres = sbModel->GetPdf()->fitTo(*data,InitialHesse(false), Hesse(false),
-                Minimizer(mMinimizerType.c_str(),"Migrad"), Strategy(0), Verbose(verbose),
-                PrintLevel(mPrintLevel+1), Constrain(constrainParams), Save(true) );
-        if (fitres->status() != 0) { 
-            Warning("StandardHypoTestInvDemo","Fit to the model failed - try with strategy 1 and perform first an Hesse computation");
-            fitres = sbModel->GetPdf()->fitTo(*data,InitialHesse(true), Hesse(false),Minimizer(mMinimizerType.c_str(),"Migrad"), 
-                    Strategy(1), PrintLevel(mPrintLevel+1), Constrain(constrainParams), Save(true), Verbose(verbose) );
+        RooFitResult * fitres = 0;
+        {
+            // only time the fits, not the setup that follows
+            FitTimer::Scope timer("initial fit");
+            fitres = sbModel->GetPdf()->fitTo(*data,InitialHesse(false), Hesse(false),
+                    Minimizer(mMinimizerType.c_str(),"Migrad"), Strategy(0), Verbose(verbose),
+                    PrintLevel(mPrintLevel+1), Constrain(constrainParams), Save(true) );
+            FitTimer::CountFit(fitres);
+            if (fitres->status() != 0) { 
+                Warning("StandardHypoTestInvDemo","Fit to the model failed - try with strategy 1 and perform first an Hesse computation");
+                fitres = sbModel->GetPdf()->fitTo(*data,InitialHesse(true), Hesse(false),Minimizer(mMinimizerType.c_str(),"Migrad"), 
+                        Strategy(1), PrintLevel(mPrintLevel+1), Constrain(constrainParams), Save(true), Verbose(verbose) );
+                FitTimer::CountFit(fitres);
+            }
         }
         if (fitres->status() != 0) 
             Warning("StandardHypoTestInvDemo"," Fit still failed - continue anyway.....");
@@ -686,13 +702,17 @@ RooStats::HypoTestTool::SetupHypoTestCalculator(RooWorkspace * w, bool doUL,
     // create the HypoTest calculator class 
     this->ResetHypoTestCalculator(); // first clear
 
-    if (type == 0) m_hc = new FrequentistCalculator(*data, *altModel, *nullModel);
-    else if (type == 1) m_hc = new HybridCalculator(*data, *altModel, *nullModel);
-    else if (type == 2) m_hc = new AsymptoticCalculator(*data, *altModel, *nullModel);
-    else if (type == 3) m_hc = new AsymptoticCalculator(*data, *altModel, *nullModel, true);  // for using Asimov data generated with nominal values 
-    else {
-        Error("HypoTestTool","Invalid - calculator type = %d supported values are only :\n\t\t\t 0 (Frequentist) , 1 (Hybrid) , 2 (Asymptotic) ",type);
-        return false;
+    // the asymptotic calculator fits and makes the Asimov data here
+    {
+        FitTimer::Scope timer(type >= 2 ? "asimov" : "calculator setup");
+        if (type == 0) m_hc = new FrequentistCalculator(*data, *altModel, *nullModel);
+        else if (type == 1) m_hc = new HybridCalculator(*data, *altModel, *nullModel);
+        else if (type == 2) m_hc = new AsymptoticCalculator(*data, *altModel, *nullModel);
+        else if (type == 3) m_hc = new AsymptoticCalculator(*data, *altModel, *nullModel, true);  // for using Asimov data generated with nominal values 
+        else {
+            Error("HypoTestTool","Invalid - calculator type = %d supported values are only :\n\t\t\t 0 (Frequentist) , 1 (Hybrid) , 2 (Asymptotic) ",type);
+            return false;
+        }
     }
 
     // set the test statistic 
@@ -94,6 +94,17 @@
 //HypoTestTool.cxx
 #pragma link C++ class RooStats::HypoTestTool;
 
+//FitTimer.cxx
+#pragma link C++ namespace FitTimer;
+#pragma link C++ class FitTimer::Scope;
+#pragma link C++ function FitTimer::Enabled;
+#pragma link C++ function FitTimer::Enable;
+#pragma link C++ function FitTimer::Reset;
+#pragma link C++ function FitTimer::AddTime;
+#pragma link C++ function FitTimer::Count;
+#pragma link C++ function FitTimer::CountFit;
+#pragma link C++ function FitTimer::Report;
+
 #pragma link C++ class LimitResult;
 
 #endif
@@ -3,6 +3,7 @@
 #include "Utils.h"
 #include "CombineWorkSpaces.h"
 #include "TMsgLogger.h"
+#include "FitTimer.h"
 
 #include "HypoTestTool.h"
 
@@ -338,6 +339,7 @@ nToyRatio            ratio of S+B/B toys (default is 2)
         return 0;
     }
 
+    FitTimer::Scope timer("DoHypoTestInversion");
     HypoTestTool calc;
 
     // set parameters
@@ -429,6 +431,7 @@ nToyRatio            ratio of S+B/B toys (default is 2)
         return 0;
     }
 
+    FitTimer::Scope timer("DoHypoTest");
     HypoTestTool calc;
 
     // set parameters
@@ -736,6 +739,7 @@ LimitResult RooStats::get_Pvalue(     RooWorkspace* w,
         bool useNumberCounting, // = false,
         const char * nuisPriorName) // = 0  
 {
+    FitTimer::Scope timer("get_Pvalue");
     LimitResult lres;
 
     double muVal = ( doUL ? 1.0 : 0.0 );
@@ -2,6 +2,7 @@
 #include "Utils.h"
 #include "ConfigMgr.h"
 #include "TMsgLogger.h"
+#include "FitTimer.h"
 #include "ChannelStyle.h"
 
 #include "TMap.h"
@@ -455,10 +456,12 @@ RooFitResult* Util::FitPdf( RooWorkspace* w, TString fitRegions, Bool_t lumiCons
     Logger << kINFO << " with strategy  " << strategy << " and tolerance " << tol << GEndl;
 
 
+    FitTimer::Scope fitTimer("FitPdf minimize");
     //bool kickApplied(false);
     for (int tries = 1, maxtries = 4; tries <= maxtries; ++tries) {
         //	 status = minim.minimize(fMinimizer, ROOT::Math::MinimizerOptions::DefaultMinimizerAlgo().c_str());
         status = minim.minimize(minimizer, algorithm);  
+        FitTimer::CountFit(status);
         if (status%1000 == 0) {  // ignore erros from Improve 
             break;
         } else { 
@@ -493,11 +496,15 @@ RooFitResult* Util::FitPdf( RooWorkspace* w, TString fitRegions, Bool_t lumiCons
         }
     }
 
+    fitTimer.Stop();
+    FitTimer::Count("util_fit_nll_evaluations", minim.evalCounter());
+
     //RooFitResult * result = 0; 
     double val(0);
 	
     if (status%100 == 0) { // ignore errors in Hesse or in Improve
 	  // only calculate minos errors if fit with Migrad converged
+      FitTimer::Scope errorTimer("FitPdf errors");
       if(minos && (minosPars == "all" || minosPars == "ALL")){
 	minim.hesse();
 	minim.minos();
@@ -1927,10 +1934,12 @@ Util::doFreeFit( RooWorkspace* w, RooDataSet* inputdata, const bool& verbose, co
     Logger << kINFO << "Util::doFreeFit()  ........ using " << minimizer << " / " << algorithm 
         << " with strategy  " << strategy << " and tolerance " << tol << GEndl;
 
+    FitTimer::Scope fitTimer("doFreeFit minimize");
     //bool kickApplied(false);
     for (int tries = 1, maxtries = 4; tries <= maxtries; ++tries) {
         //	 status = minim.minimize(fMinimizer, ROOT::Math::MinimizerOptions::DefaultMinimizerAlgo().c_str());
         status = minim.minimize(minimizer, algorithm);  
+        FitTimer::CountFit(status);
         if (status%1000 == 0) {  // ignore erros from Improve 
             break;
         } else { 
@@ -1963,6 +1972,9 @@ Util::doFreeFit( RooWorkspace* w, RooDataSet* inputdata, const bool& verbose, co
         }
     }
 
+    fitTimer.Stop();
+    FitTimer::Count("util_fit_nll_evaluations", minim.evalCounter());
+
     RooFitResult * result = 0; 
     double val(0);
 
@@ -0,0 +1,9 @@
+"""
+The tests use the python modules in this checkout, whether or not
+`install.py` has been run. Nothing here needs ROOT.
+"""
+
+import sys
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'python'))
@@ -0,0 +1,107 @@
+import math
+import pytest
+from scharmfit.contour import ContourRefiner, exclusion, boundary_distance
+
+def _grid(n_scharm=9, n_lsp=9):
+    return [(200 + 50 * i, 50 * j)
+            for i in xrange(n_scharm) for j in xrange(n_lsp)]
+
+def _cls(point):
+    """CLs that crosses 0.05 on a line through the grid"""
+    scharm, lsp = point
+    value = 0.05 * math.exp((scharm - 500.0) / 100.0 + lsp / 400.0)
+    return {'obs': value, 'exp': value * 1.2,
+            'scharm_mass': scharm, 'lsp_mass': lsp}
+
+def _refine(points, result=_cls):
+    """run the refiner to the end, return (fitted points, inferred)"""
+    refiner = ContourRefiner(points)
+    fitted = []
+    while True:
+        todo = refiner.next_points()
+        if not todo:
+            break
+        for point in todo:
+            assert point not in fitted
+            fitted.append(point)
+            refiner.add_result(point, result(point))
+    return fitted, refiner.inferred()
+
+def test_exclusion():
+    assert exclusion({'obs': 0.01, 'exp': 0.2}) == (True, False)
+    assert exclusion({'ul': 0.5, 'ul_exp': 2.0}) == (True, False)
+    assert exclusion({'obs': -1, 'exp': 0.2}) is None
+    assert exclusion({}) is None
+
+def test_boundary_distance():
+    assert boundary_distance({'obs': 0.5, 'exp': 0.01}) == pytest.approx(
+        math.log(5.0))
+    assert boundary_distance({'obs': 0.0, 'exp': 0.0}) == float('inf')
+    assert boundary_distance({'obs': -1, 'exp': 0.2}) is None
+
+def test_fits_fewer_points():
+    points = _grid()
+    fitted, inferred = _refine(points)
+    assert len(fitted) < len(points)
+    assert sorted(fitted + list(inferred)) == sorted(points)
+
+def test_inferred_agree_with_fits():
+    # everything away from the contour is inferred correctly
+    fitted, inferred = _refine(_grid())
+    for point, fit_dict in inferred.items():
+        assert exclusion(fit_dict) == exclusion(_cls(point)), point
+
+def test_coarse_grid_first():
+    refiner = ContourRefiner(_grid(), coarse_step=4)
+    first = refiner.next_points()
+    assert sorted(first) == [
+        (200 + 50 * i, 50 * j) for i in [0, 4, 8] for j in [0, 4, 8]]
+
+def test_neighbours_that_disagree_get_fit():
+    fitted, _ = _refine(_grid())
+    for point in _grid():
+        scharm, lsp = point
+        neighbours = [(scharm + 50 * di, lsp + 50 * dj)
+                      for di in [-1, 0, 1] for dj in [-1, 0, 1]]
+        neighbours = [pt for pt in neighbours if pt in fitted]
+        classes = {exclusion(_cls(pt)) for pt in neighbours}
+        if point not in fitted and len(neighbours) > 1:
+            assert len(classes) == 1, point
+
+def test_inferred_is_geometric_mean():
+    # a 3 x 3 grid fits the corners at step 2, the middle of each edge
+    # is between two of them
+    points = [(200 + 50 * i, 50 * j) for i in xrange(3) for j in xrange(3)]
+    values = {pt: 0.2 * (1 + pt[0] / 1000.0) * (1 + pt[1] / 100.0)
+              for pt in points}
+    def result(point):
+        return {'obs': values[point], 'exp': 2 * values[point],
+                'method': 'asymptotic', 'scharm_mass': point[0],
+                'lsp_mass': point[1]}
+    refiner = ContourRefiner(points, coarse_step=2)
+    for point in refiner.next_points():
+        refiner.add_result(point, result(point))
+    assert refiner.next_points() == []
+    inferred = refiner.inferred()
+    middle = inferred[250, 0]
+    expected = math.sqrt(values[200, 0] * values[300, 0])
+    assert middle['obs'] == pytest.approx(expected)
+    assert middle['exp'] == pytest.approx(2 * expected)
+    # strings and the masses aren't averaged
+    assert set(middle) == {'obs', 'exp'}
+
+def test_failed_fits_get_neighbours_fit():
+    points = [(200 + 50 * i, 50 * j) for i in xrange(3) for j in xrange(3)]
+    def result(point):
+        if point == (200, 0):
+            return {}
+        return _cls(point)
+    fitted, _ = _refine(points, result)
+    # the neighbours of the failed corner can't be inferred from it
+    assert (250, 0) in fitted and (200, 50) in fitted
+
+def test_known_results_are_not_refit():
+    points = _grid(5, 5)
+    refiner = ContourRefiner(points)
+    refiner.add_result((200, 0), _cls((200, 0)))
+    assert (200, 0) not in refiner.next_points()
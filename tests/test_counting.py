@@ -0,0 +1,172 @@
+import math
+import numpy as np
+import pytest
+from scipy import optimize
+from scipy.special import ndtr
+from scharmfit import counting
+from scharmfit.counting import CountingModel, _Code4Interpolation
+from scharmfit.workspace import FitInputs
+
+# __________________________________________________________________________
+# interpolation
+
+# worked out from the FlexibleInterpVar code 4 formula, for a (0.8, 1.3)
+# variation
+_code4_values = [
+    (-2.0, 0.64),
+    (-1.0, 0.8),
+    (-0.5, 0.8922758384),
+    (0.0, 1.0),
+    (0.3, 1.0793309775),
+    (0.8, 1.2332912688),
+    (1.0, 1.3),
+    (1.5, 1.4822280526),
+    ]
+
+def test_code4_values():
+    interp = _Code4Interpolation(np.array(0.8), np.array(1.3))
+    for alpha, expected in _code4_values:
+        value, _ = interp(np.array(alpha))
+        assert float(value) == pytest.approx(expected, abs=1e-9)
+
+def test_code4_smooth_at_one_sigma():
+    interp = _Code4Interpolation(np.array([0.8, 0.5]), np.array([1.3, 1.1]))
+    eps = 1e-6
+    for edge in [-1.0, 1.0]:
+        inside = edge * (1 - eps)
+        outside = edge * (1 + eps)
+        val_in, deriv_in = interp(np.array([inside, inside]))
+        val_out, deriv_out = interp(np.array([outside, outside]))
+        assert np.allclose(val_in, val_out, atol=1e-5)
+        assert np.allclose(deriv_in, deriv_out, atol=1e-4)
+
+def test_code4_derivative():
+    interp = _Code4Interpolation(np.array([0.8, 0.5]), np.array([1.3, 1.1]))
+    eps = 1e-6
+    for alpha in [-1.7, -0.4, 0.2, 0.9, 2.5]:
+        x = np.array([alpha, alpha])
+        _, deriv = interp(x)
+        numeric = (interp(x + eps)[0] - interp(x - eps)[0]) / (2 * eps)
+        assert np.allclose(deriv, numeric, rtol=1e-5)
+
+def test_code4_toy_dimensions():
+    # one row per toy, as used by the batched fits
+    interp = _Code4Interpolation(np.array([0.8, 0.5]), np.array([1.3, 1.1]))
+    alphas = np.array([[-0.5, 0.3], [1.5, -2.0], [0.0, 0.8]])
+    values, _ = interp(alphas)
+    assert values.shape == alphas.shape
+    for row, alpha_row in zip(values, alphas):
+        assert np.allclose(row, interp(alpha_row)[0])
+
+# __________________________________________________________________________
+# one bin model
+
+_signal = 'scharm-400-200'
+_fit_config = {
+    'signal_regions': ['sr'], 'control_regions': [],
+    'fixed_backgrounds': ['bg'], 'systematics': []}
+_misc_config = {
+    'blind': False, 'injection': False, 'signal_systematic': None}
+
+def _one_bin_model(sig, bg, obs):
+    """
+    a signal region with one fixed background, so the only nuisance
+    parameter is the luminosity
+    """
+    yields = {
+        FitInputs.baseline_yields_key: {'sr': {
+                'data': [obs], 'bg': [bg, 0.0], _signal: [sig, 0.0]}},
+        FitInputs.yield_systematics_key: {},
+        FitInputs.relative_systematics_key: {},
+        }
+    inputs = FitInputs(yields, _fit_config, _misc_config)
+    return CountingModel(inputs, _fit_config, _misc_config, _signal)
+
+def _profiled_nll(mu, sig, bg, obs, lumi_glob):
+    """nll profiled over the luminosity, written out by hand"""
+    err = counting._lumi_rel_err
+    def nll(lumi):
+        nu = (mu * sig + bg) * lumi
+        return nu - obs * math.log(nu) + 0.5 * ((lumi - lumi_glob) / err)**2
+    result = optimize.minimize_scalar(
+        nll, bounds=(1 - 5 * err, 1 + 5 * err), method='bounded',
+        options={'xatol': 1e-10})
+    return result.fun, result.x
+
+def _qmu_tilde(mu, sig, bg, obs, lumi_glob):
+    free = optimize.minimize_scalar(
+        lambda m: _profiled_nll(m, sig, bg, obs, lumi_glob)[0],
+        bounds=(0.0, 2.0), method='bounded', options={'xatol': 1e-10})
+    if free.x > mu:
+        return 0.0
+    cond = _profiled_nll(mu, sig, bg, obs, lumi_glob)[0]
+    return max(2 * (cond - free.fun), 0.0)
+
+def test_one_bin_asymptotic_cls():
+    sig, bg, obs, mu = 10.0, 50.0, 55.0, 1.0
+    qmu = _qmu_tilde(mu, sig, bg, obs, 1.0)
+    # asimov data from the background only fit to data
+    lumi_bg = _profiled_nll(0.0, sig, bg, obs, 1.0)[1]
+    qmu_a = _qmu_tilde(mu, sig, bg, bg * lumi_bg, lumi_bg)
+    assert 0 < qmu < qmu_a
+    sqrtq, sqrtq_a = math.sqrt(qmu), math.sqrt(qmu_a)
+    expected = {'obs': ndtr(-sqrtq) / ndtr(sqrtq_a - sqrtq)}
+    # the expected bands, with +N sigma the weaker exclusion
+    for nsigma, key in [(0, 'exp'), (1, 'exp_u1s'), (-1, 'exp_d1s'),
+                        (2, 'exp_u2s'), (-2, 'exp_d2s')]:
+        expected[key] = ndtr(nsigma - sqrtq_a) / ndtr(nsigma)
+
+    cls = _one_bin_model(sig, bg, obs).asymptotic_cls(mu)
+    assert sorted(cls) == sorted(expected)
+    for key, value in expected.items():
+        assert cls[key] == pytest.approx(value, rel=1e-4)
+    assert (cls['exp_d2s'] < cls['exp_d1s'] < cls['exp'] <
+            cls['exp_u1s'] < cls['exp_u2s'])
+
+def test_fit_matches_nll():
+    model = _one_bin_model(10.0, 50.0, 55.0)
+    pars, nll = model.fit()
+    assert nll == pytest.approx(model.nll(pars, model.data,
+                                          model.nominal_globs)[0])
+    # all the excess goes to the signal
+    assert model.expected(pars)[0] == pytest.approx(55.0, rel=1e-4)
+
+def test_nll_gradient():
+    model = _one_bin_model(10.0, 50.0, 55.0)
+    pars = np.array(model.init_pars) * 1.05
+    _, grad = model.nll(pars, model.data, model.nominal_globs)
+    eps = 1e-7
+    for num in xrange(len(pars)):
+        step = np.zeros(len(pars))
+        step[num] = eps
+        up = model.nll(pars + step, model.data, model.nominal_globs)[0]
+        down = model.nll(pars - step, model.data, model.nominal_globs)[0]
+        assert grad[num] == pytest.approx((up - down) / (2 * eps), rel=1e-4)
+
+# __________________________________________________________________________
+# toys
+
+def test_batched_fits_match_single_fits():
+    model = _one_bin_model(10.0, 50.0, 55.0)
+    random = np.random.RandomState(7)
+    data, globs = model.generate_toys(model.init_pars, 20, random)
+    for poi in [None, 1.5]:
+        pars, nll = model.fit_toys(data, globs, poi=poi)
+        for toy in xrange(len(data)):
+            _, single_nll = model.fit(data[toy], globs[toy], poi=poi)
+            assert nll[toy] == pytest.approx(single_nll, abs=1e-6)
+
+def test_toy_cls_converges_to_asymptotic():
+    # plenty of events, so the asymptotic formulae should hold
+    model = _one_bin_model(40.0, 400.0, 410.0)
+    mu = 1.0
+    asymptotic = model.asymptotic_cls(mu)
+    toy = model.toy_cls(mu, n_toys=4000, seed=3)
+    for key in ['obs', 'exp', 'exp_u1s', 'exp_d1s']:
+        assert toy[key] == pytest.approx(asymptotic[key], abs=0.015)
+
+def test_toys_are_reproducible():
+    model = _one_bin_model(10.0, 50.0, 55.0)
+    first = model.toy_cls(1.0, n_toys=400, seed=5)
+    assert model.toy_cls(1.0, n_toys=400, seed=5) == first
+    assert model.toy_cls(1.0, n_toys=400, seed=6) != first
@@ -0,0 +1,88 @@
+import imp, copy
+from os.path import join, dirname, abspath
+import pytest
+from scharmfit import synthetic
+
+_script = join(dirname(dirname(abspath(__file__))), 'scripts',
+               'susy-fit-workspace.py')
+booking = imp.load_source('susy_fit_workspace', _script)
+
+_cl_config = {'blind': False, 'injection': False, 'signal_systematic': None,
+              'signal_theory_np': False, 'do_hf': False}
+
+def _inputs():
+    """yields, and two fit configurations that use them differently"""
+    yields = synthetic.make_yields(n_regions=4, n_signal_points=4)
+    full = synthetic.make_fit_config(yields)
+    full['control_regions'].remove('cr_2')
+    full['validation_regions'] = ['cr_2']
+    nosyst = dict(copy.deepcopy(full), systematics=[], validation_regions=[])
+    return yields, {'full': full, 'nosyst': nosyst}
+
+def _fingerprints(yields, configs, cl_config=_cl_config):
+    """{(configuration, signal point): fingerprint} for every workspace"""
+    # the script caches the yields hashes by configuration name
+    booking._yields_hashes.clear()
+    signal_points = booking.get_signal_points_and_backgrounds(yields)[0]
+    out = {}
+    for cfg_name, fit_config in configs.items():
+        for sp in signal_points + booking._background_points:
+            out[cfg_name, sp] = booking._get_fingerprint(
+                yields, sp, (cfg_name, fit_config), cl_config)
+    return out
+
+def _changed(before, after):
+    return {key for key in before if before[key] != after[key]}
+
+@pytest.fixture
+def inputs():
+    yields, configs = _inputs()
+    return yields, configs, _fingerprints(yields, configs)
+
+def test_unchanged_inputs(inputs):
+    _, _, before = inputs
+    assert _fingerprints(*_inputs()) == before
+
+def test_integer_yields(inputs):
+    # a yields file with `data: [30]` rather than `[30.0]`
+    yields, configs, before = inputs
+    for procs in yields['nominal_yields'].values():
+        procs['data'] = [int(procs['data'][0])]
+    assert _fingerprints(yields, configs) == before
+
+def test_changed_systematic(inputs):
+    yields, configs, before = inputs
+    yields['yield_systematics']['yield0up']['cr_0']['bg0'][0] *= 1.1
+    changed = _changed(before, _fingerprints(yields, configs))
+    assert changed == {key for key in before if key[0] == 'full'}
+
+def test_unused_systematic(inputs):
+    yields, configs, before = inputs
+    yields['yield_systematics']['unused'] = copy.deepcopy(
+        yields['yield_systematics']['yield0up'])
+    assert _fingerprints(yields, configs) == before
+
+def test_changed_signal_yield(inputs):
+    yields, configs, before = inputs
+    yields['nominal_yields']['signal']['scharm-200-50'][0] *= 1.1
+    changed = _changed(before, _fingerprints(yields, configs))
+    assert changed == {('full', 'scharm-200-50'), ('nosyst', 'scharm-200-50')}
+
+def test_changed_validation_region(inputs):
+    # only the background only workspaces include the validation regions
+    yields, configs, before = inputs
+    yields['nominal_yields']['cr_2']['bg0'][0] *= 1.1
+    changed = _changed(before, _fingerprints(yields, configs))
+    assert changed == {('full', sp) for sp in booking._background_points}
+
+def test_changed_config(inputs):
+    yields, configs, before = inputs
+    configs['nosyst']['systematics'] = ['yield1']
+    changed = _changed(before, _fingerprints(yields, configs))
+    assert changed == {key for key in before if key[0] == 'nosyst'}
+
+def test_changed_option(inputs):
+    yields, configs, before = inputs
+    cl_config = dict(_cl_config, blind=True)
+    after = _fingerprints(yields, configs, cl_config)
+    assert _changed(before, after) == set(before)
@@ -0,0 +1,42 @@
+import pytest
+from scharmfit import hybrid
+from scharmfit.hybrid import pick_toy_points
+
+def _result(obs, exp, background=50.0, **extra):
+    fit_dict = {'obs': obs, 'exp': exp, 'sr_background': background}
+    fit_dict.update(extra)
+    return fit_dict
+
+_results = {
+    'near': _result(0.06, 0.3),
+    'nearer': _result(0.05, 0.3),
+    'far_excluded': _result(1e-4, 1e-4),
+    'far_allowed': _result(0.9, 0.9),
+    'small_background': _result(0.9, 0.9, background=2.0),
+    'failed': _result(-1, -1, background=2.0),
+    'inferred': _result(0.05, 0.05, inferred=True),
+    'no_background': _result(0.9, 0.9, background=None),
+    }
+
+def test_picks_near_and_small_background():
+    picked = pick_toy_points(_results)
+    assert picked == ['nearer', 'near', 'small_background']
+
+def test_budget_none_picks_everything():
+    picked = pick_toy_points(_results, None)
+    assert picked == pick_toy_points(_results, len(_results))
+
+def test_budget_keeps_closest():
+    assert pick_toy_points(_results, 2) == ['nearer', 'near']
+    assert pick_toy_points(_results, 0) == []
+
+def test_boundary_factor():
+    cut = 0.05 * hybrid._boundary_factor
+    results = {'inside': _result(cut * 0.99, 1.0),
+               'outside': _result(cut * 1.01, 1.0)}
+    assert pick_toy_points(results) == ['inside']
+
+def test_upper_limits():
+    results = {'near': {'ul': 1.2, 'ul_exp': 5.0, 'sr_background': 50.0},
+               'far': {'ul': 10.0, 'ul_exp': 10.0, 'sr_background': 50.0}}
+    assert pick_toy_points(results) == ['near']
@@ -0,0 +1,89 @@
+import math
+import pytest
+from scharmfit import limits
+from scharmfit.limits import find_upper_limits, estimate_bracket
+
+# CLs falls off exponentially with the signal strength, with a
+# different slope for each key, so every limit is known exactly
+_slopes = {'obs': 1.0, 'exp': 1.5, 'exp_u1s': 0.8, 'exp_d1s': 2.0,
+           'exp_u2s': 0.6, 'exp_d2s': 3.0}
+
+def _exp_cls(scale=1.0):
+    calls = []
+    def get_cls(mu):
+        calls.append(mu)
+        return {key: 0.5 * math.exp(-slope * mu / scale)
+                for key, slope in _slopes.items()}
+    return get_cls, calls
+
+def _true_limit(key, scale=1.0):
+    return scale * math.log(0.5 / limits._cls_target) / _slopes[key]
+
+def test_converges_on_every_limit():
+    get_cls, calls = _exp_cls()
+    rel_tol = 0.005
+    found, n_tests = find_upper_limits(get_cls, (1.0, 3.0), rel_tol=rel_tol)
+    assert n_tests == len(set(calls))
+    for key, name in limits.limit_keys:
+        assert found[name] == pytest.approx(_true_limit(key), rel=rel_tol)
+
+def test_tests_are_shared_between_limits():
+    get_cls, calls = _exp_cls()
+    _, n_all = find_upper_limits(get_cls, (1.0, 3.0))
+    _, n_obs = find_upper_limits(_exp_cls()[0], (1.0, 3.0), keys=['obs'])
+    # each extra limit starts from the tests already run
+    assert n_all < len(limits.limit_keys) * n_obs
+
+@pytest.mark.parametrize('scale', [0.01, 100.0])
+def test_bracket_is_widened(scale):
+    # the crossing is well outside the initial bracket
+    get_cls, calls = _exp_cls(scale)
+    found, _ = find_upper_limits(get_cls, (1.0, 3.0), keys=['obs'])
+    assert found['ul'] == pytest.approx(_true_limit('obs', scale), rel=0.01)
+    assert min(calls) < _true_limit('obs', scale) < max(calls)
+
+def test_earlier_tests_give_the_bracket():
+    get_cls, calls = _exp_cls()
+    tested = {mu: get_cls(mu) for mu in [2.0, 2.5]}
+    del calls[:]
+    found, _ = find_upper_limits(
+        get_cls, (0.01, 100.0), keys=['obs'], tested=tested)
+    assert found['ul'] == pytest.approx(_true_limit('obs'), rel=0.01)
+    assert all(2.0 < mu < 2.5 for mu in calls)
+
+def test_limit_below_smallest_mu():
+    # excluded at any signal strength we can test
+    found, _ = find_upper_limits(
+        lambda mu: {'obs': 0.01}, (1.0, 3.0), keys=['obs'])
+    assert found['ul'] == -1
+
+def test_limit_above_largest_mu():
+    found, _ = find_upper_limits(
+        lambda mu: {'obs': 0.5}, (1.0, 3.0), keys=['obs'])
+    assert found['ul'] == -1
+
+def test_failed_tests_count_as_excluded():
+    # the calculators give -1 for CLs they can't calculate
+    def get_cls(mu):
+        return {'obs': 0.5 if mu < 2.0 else -1}
+    found, _ = find_upper_limits(get_cls, (1.0, 3.0), keys=['obs'])
+    assert found['ul'] == pytest.approx(2.0, rel=0.01)
+
+def test_too_many_tests():
+    get_cls, calls = _exp_cls()
+    found, n_tests = find_upper_limits(
+        get_cls, (1.0, 3.0), keys=['obs'], max_tests=2)
+    assert found['ul'] == -1
+    assert n_tests == 2
+
+def test_estimate_bracket_uses_sensitive_channel():
+    # (signal, background, observed), the second is the signal region
+    channels = [(1.0, 100.0, 100.0), (10.0, 4.0, 4.0), (0.0, 10.0, 8.0)]
+    low, high = estimate_bracket(channels)
+    rough = 2.0 * math.sqrt(5.0) / 10.0
+    assert low < rough < high
+    assert high / low == pytest.approx(limits._bracket_factor**2)
+
+def test_no_signal_no_bracket():
+    with pytest.raises(ValueError):
+        estimate_bracket([(0.0, 10.0, 8.0)])
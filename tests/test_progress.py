@@ -0,0 +1,19 @@
+from scharmfit.progress import RunStatus
+
+def test_redone_points_count_once():
+    # as in a hybrid run: an asymptotic pass, then some points redone
+    status = RunStatus('fitting', interval=1e9)
+    status.add(10)
+    status.completed(7)
+    status.failed(1)
+    status.skipped(2)
+    assert status.eta() == 0.0
+    for outcome in ['completed', 'failed', 'skipped']:
+        status.retract(outcome)
+    status.add(3)
+    assert status.total == 10
+    assert sum(status.counts.values()) == 7
+    assert status.eta() > 0
+    status.completed(3)
+    assert status.get_status()['total'] == 10
+    assert status.counts == {'completed': 9, 'failed': 0, 'skipped': 1}
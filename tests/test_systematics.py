@@ -0,0 +1,152 @@
+import pytest
+from scharmfit.systematics import SystematicsTable, split_systematics
+
+# __________________________________________________________________________
+# the conversion as it was done before `SystematicsTable`, with dicts
+
+def _old_relative_from_abs(base_yields, systematic_yields):
+    sym_systematics, asym_systematics = split_systematics(
+        set(systematic_yields))
+    rel_systs = {}
+    for region, process_dict in base_yields.iteritems():
+        rel_systs[region] = {}
+        for process, vals in process_dict.iteritems():
+            if process == 'data':
+                continue
+            nom_yield, err = vals
+            rel_systs[region][process] = {}
+            for syst in sym_systematics:
+                try:
+                    varied_yield = systematic_yields[syst][region][process][0]
+                except KeyError:
+                    continue
+                rel_syst_err = (varied_yield / nom_yield - 1.0) / 2.0
+                rel_systs[region][process][syst] = (
+                    1 - rel_syst_err, 1 + rel_syst_err)
+            for syst in asym_systematics:
+                def var(sys_name):
+                    try:
+                        raw = systematic_yields[sys_name][region][process][0]
+                    except KeyError:
+                        return None
+                    return raw / nom_yield
+                updown = (var(syst + 'down'), var(syst + 'up'))
+                if updown == (None, None):
+                    continue
+                rel_systs[region][process][syst] = updown
+    return rel_systs
+
+def _old_update_with_relative(existing, rel_systs, all_proc):
+    for sys_name, region_dict in rel_systs.iteritems():
+        for region_name, process_dict in region_dict.iteritems():
+            exist_region = existing.setdefault(region_name, {})
+            if isinstance(process_dict, dict):
+                for process_name, downup in process_dict.iteritems():
+                    exist_region.setdefault(process_name, {})[sys_name] = (
+                        tuple(downup))
+            else:
+                for proc in all_proc:
+                    exist_region.setdefault(proc, {})[sys_name] = (
+                        tuple(process_dict))
+
+def _old_signal_systematics(rel_systs, syst_list, direction):
+    out_dict = {}
+    idx = {'down':0, 'up':1}[direction]
+    for syst in syst_list:
+        for region, procdict in rel_systs[syst].iteritems():
+            for proc, downup in procdict.iteritems():
+                out_key = region, proc
+                out_dict[out_key] = (
+                    out_dict.get(out_key, 0.0) + (downup[idx] - 1)**2)
+    return out_dict
+
+# __________________________________________________________________________
+# inputs
+
+_sig = 'scharm-400-200'
+_all_proc = [_sig, 'top', 'wjets']
+
+def _base_yields():
+    return {
+        'sr': {'data': [20.0], _sig: [8.0, 0.5], 'top': [10.0, 1.0],
+               'wjets': [5.0, 0.4]},
+        'cr': {'data': [100.0], 'top': [80.0, 3.0], 'wjets': [15.0, 1.0]},
+        }
+
+# `jes` is symmetric, `jer` asymmetric, with one side missing for
+# wjets in the signal region and both for top in the control region
+_yield_systs = {
+    'jes': {'sr': {_sig: [8.8], 'top': [11.0], 'wjets': [4.6]},
+            'cr': {'top': [84.0]}},
+    'jerup': {'sr': {_sig: [8.4], 'top': [10.5], 'wjets': [5.5]},
+              'cr': {'wjets': [16.0]}},
+    'jerdown': {'sr': {_sig: [7.7], 'top': [9.2]},
+                'cr': {'wjets': [14.1]}},
+    }
+
+_rel_systs = {
+    'xsec': {'sr': {'top': [0.9, 1.15]}, 'cr': {'top': [0.9, 1.15]}},
+    # applies to every process in the region
+    'trigger': {'sr': [0.98, 1.03]},
+    }
+
+_sig_systs = {
+    'scale': {'sr': {_sig: [0.85, 1.1]}},
+    'pdf': {'sr': {_sig: [0.95, 1.07]}},
+    }
+
+# __________________________________________________________________________
+# tests
+
+def test_variations_match_dict_version():
+    table = SystematicsTable(
+        _base_yields(), _yield_systs, _rel_systs, _all_proc, _sig_systs)
+    old = _old_relative_from_abs(_base_yields(), _yield_systs)
+    _old_update_with_relative(old, _rel_systs, _all_proc)
+    for region, procdict in old.iteritems():
+        for proc, systs in procdict.iteritems():
+            new = {syst: (down, up) for syst, down, up in
+                   table.get_variations(region, proc)}
+            assert sorted(new) == sorted(systs), (region, proc)
+            for syst, (down, up) in systs.iteritems():
+                new_down, new_up = new[syst]
+                for old_val, new_val in [(down, new_down), (up, new_up)]:
+                    if old_val is None:
+                        assert new_val is None
+                    else:
+                        assert new_val == pytest.approx(old_val)
+
+def test_missing_side_of_asymmetric_variation():
+    table = SystematicsTable(_base_yields(), _yield_systs, {}, _all_proc)
+    variations = {syst: (down, up) for syst, down, up in
+                  table.get_variations('sr', 'wjets')}
+    assert variations['jer'] == (None, pytest.approx(1.1))
+    # nothing at all for top in the control region
+    assert 'jer' not in [
+        syst for syst, _, _ in table.get_variations('cr', 'top')]
+
+def test_signal_sum_of_squares_matches_dict_version():
+    table = SystematicsTable(
+        _base_yields(), _yield_systs, _rel_systs, _all_proc, _sig_systs)
+    for direction, sign in [('down', -1), ('up', 1)]:
+        old = _old_signal_systematics(_sig_systs, list(_sig_systs), direction)
+        for (region, proc), sum_sq in old.iteritems():
+            assert table.get_sigsyst_sumsq(region, proc, sign) == (
+                pytest.approx(sum_sq))
+    with pytest.raises(KeyError):
+        table.get_sigsyst_sumsq('cr', 'top', 1)
+
+@pytest.mark.parametrize('syst', ['jes', 'jerup'])
+def test_zero_yield(syst):
+    base = _base_yields()
+    base['cr']['wjets'] = [0.0, 0.0]
+    yield_systs = {syst: {'cr': {'wjets': [1.0]}}}
+    with pytest.raises(ZeroDivisionError):
+        _old_relative_from_abs(base, yield_systs)
+    with pytest.raises(ZeroDivisionError):
+        SystematicsTable(base, yield_systs, {}, _all_proc)
+
+def test_overwrite_is_an_error():
+    rel_systs = {'jes': {'sr': {'top': [0.9, 1.1]}}}
+    with pytest.raises(ValueError):
+        SystematicsTable(_base_yields(), _yield_systs, rel_systs, _all_proc)